@@ -0,0 +1,211 @@
+# admission.py
+# Admission control, request deadlines and load shedding.
+#
+# Each limited endpoint group has an AdmissionLimiter: at most max_concurrent
+# requests run at once and at most max_queued wait, first come first served.
+# AdmissionMiddleware takes a slot before the request body is read, so shed
+# requests cost almost nothing:
+#   429  the wait queue is full
+#   503  the request waited longer than queue_timeout, or its deadline passed
+# Both carry Retry-After, estimated from recent service times and the queue.
+#
+# Clients send their remaining budget in X-Request-Timeout-Ms; the absolute
+# deadline is kept in a context variable for the rest of the request, so
+# expensive stages call check_deadline() first and drop work whose caller has
+# already given up (DeadlineExceeded, answered with 503).
+import asyncio
+import contextvars
+import json
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, Optional
+
+from metrics import Counter, Histogram
+
+DEADLINE_HEADER = b"x-request-timeout-ms"
+
+ADMISSION_REJECTED = Counter(
+    "healease_admission_rejected_total", "Requests shed by admission control", ["group", "reason"]
+)
+ADMISSION_QUEUE_SECONDS = Histogram(
+    "healease_admission_queue_seconds", "Time admitted requests waited for a slot", ["group"]
+)
+DEADLINE_DROPPED = Counter(
+    "healease_deadline_dropped_total", "Work dropped because the request deadline had passed", ["stage"]
+)
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    status_code = 503
+
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def current_deadline() -> Optional[float]:
+    """perf_counter() time by which the current request must finish, if the client gave one"""
+    return _deadline.get()
+
+
+def deadline_exceeded(stage: str) -> DeadlineExceeded:
+    """Count work dropped at a stage and return the exception to raise for it"""
+    DEADLINE_DROPPED.labels(stage).inc()
+    return DeadlineExceeded(f"Request deadline passed before {stage}")
+
+
+def check_deadline(stage: str):
+    """Raise DeadlineExceeded if the current request is already past its deadline"""
+    deadline = _deadline.get()
+    if deadline is not None and time.perf_counter() >= deadline:
+        raise deadline_exceeded(stage)
+
+
+class AdmissionLimiter:
+    """Concurrency limit with a bounded FIFO wait queue"""
+
+    def __init__(self, name: str, max_concurrent: int, max_queued: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queued = max(0, max_queued)
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        # Exponentially weighted service time, for Retry-After
+        self.service_time = 0.0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "queue_timeout": 0, "deadline": 0}
+
+    def retry_after(self) -> int:
+        waves = (len(self._waiters) + self.active) / self.max_concurrent
+        return max(1, math.ceil(self.service_time * waves))
+
+    def _reject(self, status_code: int, reason: str) -> Rejected:
+        self.rejected[reason] += 1
+        ADMISSION_REJECTED.labels(self.name, reason).inc()
+        return Rejected(status_code, reason, self.retry_after())
+
+    async def acquire(self, deadline: Optional[float]):
+        started = time.perf_counter()
+        if deadline is not None and started >= deadline:
+            raise self._reject(503, "deadline")
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+        else:
+            if len(self._waiters) >= self.max_queued:
+                raise self._reject(429, "queue_full")
+            timeout = self.queue_timeout if deadline is None else min(self.queue_timeout, deadline - started)
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                # release() hands the slot over by resolving the future
+                await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            except asyncio.TimeoutError:
+                if waiter.done() and not waiter.cancelled():
+                    # Granted at the last moment; give it back
+                    self._release_slot()
+                else:
+                    waiter.cancel()
+                    self._waiters.remove(waiter)
+                expired = deadline is not None and time.perf_counter() >= deadline
+                raise self._reject(503, "deadline" if expired else "queue_timeout")
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    self._release_slot()
+                else:
+                    waiter.cancel()
+                    self._waiters.remove(waiter)
+                raise
+        self.admitted += 1
+        ADMISSION_QUEUE_SECONDS.labels(self.name).observe(time.perf_counter() - started)
+
+    def _release_slot(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot passes straight to the next waiter
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def release(self, service_time: float):
+        self.service_time = 0.9 * self.service_time + 0.1 * service_time if self.service_time else service_time
+        self._release_slot()
+
+    def stats(self) -> Dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "queue_timeout": self.queue_timeout,
+            "active": self.active,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_service_seconds": self.service_time,
+        }
+
+
+class AdmissionMiddleware:
+    """Admits requests to limited paths through their group's limiter and sets their deadline"""
+
+    def __init__(self, app, limiters: Iterable[AdmissionLimiter], paths: Dict[str, str],
+                 default_timeout: Optional[float] = None):
+        self.app = app
+        self.limiters = {limiter.name: limiter for limiter in limiters}
+        # path -> limiter name
+        self.paths = paths
+        self.default_timeout = default_timeout
+
+    def _deadline(self, scope, arrived: float) -> Optional[float]:
+        for name, value in scope.get("headers", []):
+            if name == DEADLINE_HEADER:
+                try:
+                    return arrived + max(0.0, float(value)) / 1000.0
+                except ValueError:
+                    break
+        return arrived + self.default_timeout if self.default_timeout else None
+
+    @staticmethod
+    async def _send_rejection(send, rejected: Rejected):
+        body = json.dumps({"detail": f"Server busy ({rejected.reason}); retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": rejected.status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(rejected.retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        # CORS preflights carry no work and must not take a slot
+        group = self.paths.get(scope["path"]) if scope["type"] == "http" and scope["method"] != "OPTIONS" else None
+        if group is None:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiters[group]
+        arrived = time.perf_counter()
+        deadline = self._deadline(scope, arrived)
+        try:
+            await limiter.acquire(deadline)
+        except Rejected as rejected:
+            await self._send_rejection(send, rejected)
+            return
+
+        token = _deadline.set(deadline)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
+            limiter.release(time.perf_counter() - started)
@@ -0,0 +1,201 @@
+# batching.py
+# Dynamic micro-batching for image inference.
+#
+# Concurrent requests each submit one preprocessed tensor; a single worker task
+# collects up to max_batch_size of them (waiting at most max_wait_ms after the
+# first one arrives), runs one forward pass over the stacked batch and hands
+# every caller its own slice of the result. Up to max_concurrent forward passes
+# run at once (one per inference pool thread); the next batch only starts
+# collecting once a slot is free, so a busy pool yields fuller batches.
+# submit_many() queues a caller's whole group at once so it lands in the same
+# batch. Items may carry a deadline (see admission.py); ones already past it
+# when their batch forms are failed with DeadlineExceeded instead of being run.
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+
+import torch
+
+from admission import deadline_exceeded
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-item inference calls into batched forward passes"""
+
+    def __init__(
+        self,
+        forward_fn: Callable[[torch.Tensor], Sequence[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+        executor=None,
+        max_concurrent: Optional[int] = None,
+    ):
+        # forward_fn takes a stacked [B, ...] tensor and returns B per-item results
+        self.forward_fn = forward_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.executor = executor
+        # Defaults to the executor's thread count, so every inference worker gets a batch
+        self.max_concurrent = max(1, max_concurrent or getattr(executor, "workers", 1))
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._running: Set[asyncio.Task] = set()
+
+        # Running totals for tuning the throughput/latency trade-off
+        self.batches = 0
+        self.items = 0
+        self.batch_size_counts: Dict[int, int] = {}
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.forward_time_total = 0.0
+        self.forward_time_max = 0.0
+        self.last_batch_size = 0
+        self.last_forward_time = 0.0
+        self.expired = 0
+
+    def _ensure_started(self):
+        # The worker is bound to the loop it was created on, so (re)start it
+        # lazily from whichever loop is submitting work
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._loop is not loop or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+            self._running = set()
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, item: torch.Tensor, deadline: Optional[float] = None) -> Any:
+        """Queue one un-batched input tensor and wait for its slice of the batched output"""
+        self._ensure_started()
+        future = self._loop.create_future()
+        self._queue.put_nowait((item, future, time.perf_counter(), deadline))
+        return await future
+
+    def submit_many(self, items: Sequence[torch.Tensor], deadline: Optional[float] = None) -> List[asyncio.Future]:
+        """Queue several inputs together and return one future per item, in order
+
+        The items are queued back to back, so they share forward passes (split
+        at max_batch_size) instead of each waiting for a batch of its own.
+        """
+        self._ensure_started()
+        enqueued = time.perf_counter()
+        futures = []
+        for item in items:
+            future = self._loop.create_future()
+            self._queue.put_nowait((item, future, enqueued, deadline))
+            futures.append(future)
+        return futures
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            for task in self._running:
+                task.cancel()
+            await asyncio.gather(self._worker, *self._running, return_exceptions=True)
+            self._worker = None
+            self._running = set()
+
+    async def _collect(self) -> List[tuple]:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            # Wait for a free forward-pass slot before collecting, so queued
+            # items keep accumulating into the next batch meanwhile
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            task = asyncio.get_running_loop().create_task(self._forward(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _forward(self, batch: List[tuple]):
+        try:
+            await self._run_batch(batch)
+        finally:
+            self._slots.release()
+
+    async def _run_batch(self, batch: List[tuple]):
+        # Drop callers that gave up while queued
+        batch = [entry for entry in batch if not entry[1].done()]
+        if not batch:
+            return
+
+        started = time.perf_counter()
+        live = []
+        for entry in batch:
+            _, future, enqueued, deadline = entry
+            if deadline is not None and started >= deadline:
+                future.set_exception(deadline_exceeded("inference_batch"))
+                self.expired += 1
+                continue
+            wait = started - enqueued
+            self.queue_wait_total += wait
+            self.queue_wait_max = max(self.queue_wait_max, wait)
+            live.append(entry)
+        batch = live
+        if not batch:
+            return
+
+        try:
+            inputs = torch.stack([entry[0] for entry in batch])
+            outputs = await asyncio.get_running_loop().run_in_executor(self.executor, self.forward_fn, inputs)
+        except Exception as e:
+            for _, future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        forward_time = time.perf_counter() - started
+        self.batches += 1
+        self.items += len(batch)
+        self.batch_size_counts[len(batch)] = self.batch_size_counts.get(len(batch), 0) + 1
+        self.forward_time_total += forward_time
+        self.forward_time_max = max(self.forward_time_max, forward_time)
+        self.last_batch_size = len(batch)
+        self.last_forward_time = forward_time
+
+        for (_, future, _, _), output in zip(batch, outputs):
+            if not future.done():
+                future.set_result(output)
+
+    def stats(self) -> Dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "max_concurrent": self.max_concurrent,
+            "running_batches": len(self._running),
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "batch_size_counts": dict(sorted(self.batch_size_counts.items())),
+            "avg_queue_wait_ms": self.queue_wait_total / self.items * 1000.0 if self.items else 0.0,
+            "max_queue_wait_ms": self.queue_wait_max * 1000.0,
+            "avg_forward_ms": self.forward_time_total / self.batches * 1000.0 if self.batches else 0.0,
+            "max_forward_ms": self.forward_time_max * 1000.0,
+            "last_batch_size": self.last_batch_size,
+            "last_forward_ms": self.last_forward_time * 1000.0,
+            "expired": self.expired,
+        }
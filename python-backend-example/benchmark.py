@@ -0,0 +1,689 @@
+# benchmark.py
+# Load tests and micro-benchmarks for the backend, using only synthetic inputs
+# so runs are reproducible offline.
+#
+#   python benchmark.py load --concurrency 16 --requests 2000 --out load.json
+#   python benchmark.py load --url http://localhost:8000 --mix symptoms=8,image=1,hospitals=1
+#   python benchmark.py load --spawn --workers 2 --out load.json
+#   python benchmark.py micro --out micro.json
+#   python benchmark.py compare baseline.json candidate.json --threshold 0.10
+#   python benchmark.py engines --out engines.json
+#   python benchmark.py similar --cases 1000000 --out similar.json
+#
+# `load` drives the API in-process through an ASGI transport by default, or
+# out-of-process against a running server (--url) or one it starts itself
+# with uvicorn (--spawn). Nearby-hospital lookups use a synthetic dataset
+# through the offline provider, and the result caches are disabled unless
+# --cache is given, so every request does real work. `micro` times the hot
+# stages in isolation. Both write JSON with throughput and p50/p95/p99
+# latency per benchmark; `compare` flags regressions between two such files
+# and exits non-zero if it finds any. `engines` evaluates the symptom scoring
+# engines on held-out training phrases: accuracy, how often they agree, and
+# single-text and batched latency. `similar` builds a similar-case index over
+# a synthetic corpus and times top-k queries, appends and compaction.
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SYMPTOM_PHRASES = [
+    "fever", "high temperature", "chills", "headache", "dry cough", "sore throat",
+    "runny nose", "body ache", "fatigue", "nausea", "vomiting", "diarrhea",
+    "stomach pain", "chest pain", "shortness of breath", "dizziness", "rash",
+    "itching", "joint pain", "back pain", "burning urination", "loss of appetite",
+]
+SYMPTOM_MODIFIERS = ["mild", "severe", "sharp", "constant", "since two days", "at night", "in my head", "in my chest"]
+MEDICAL_SYSTEMS = ["Allopathy", "Ayurveda", "Homeopathy"]
+DEFAULT_MIX = "symptoms=6,image=2,hospitals=2"
+
+
+# -- synthetic inputs ---------------------------------------------------------
+
+def synthetic_texts(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        parts = [
+            f"{rng.choice(SYMPTOM_MODIFIERS)} {p}" if rng.random() < 0.4 else p
+            for p in rng.sample(SYMPTOM_PHRASES, rng.randint(2, 6))
+        ]
+        texts.append("I have " + ", ".join(parts))
+    return texts
+
+
+SYNTHETIC_CONDITIONS = ["Eczema", "Psoriasis", "Acne", "Fungal infection", "Contact dermatitis", "Urticaria"]
+CASE_BODY_PARTS = ["face", "arms", "legs", "back", "chest", "neck", "hands", "feet", "scalp"]
+
+
+def synthetic_cases(count: int, seed: int = 0, vocabulary: int = 50000) -> tuple:
+    """(texts, conditions) for case notes: symptom phrases plus a Zipf-distributed long tail of other words"""
+    rng = np.random.default_rng(seed)
+    texts = synthetic_texts(count, seed)
+    parts = rng.integers(0, len(CASE_BODY_PARTS), count)
+    days = rng.integers(1, 30, count)
+    tail_lengths = rng.integers(3, 12, count)
+    tail = np.minimum(rng.zipf(1.3, int(tail_lengths.sum())), vocabulary)
+    offsets = np.concatenate([[0], np.cumsum(tail_lengths)])
+    for i in range(count):
+        words = " ".join(f"t{w}" for w in tail[offsets[i]:offsets[i + 1]])
+        texts[i] = f"{texts[i]} on my {CASE_BODY_PARTS[parts[i]]} for {days[i]} days, {words}"
+    conditions = [SYNTHETIC_CONDITIONS[c] for c in rng.integers(0, len(SYNTHETIC_CONDITIONS), count)]
+    return texts, conditions
+
+
+def synthetic_image(width: int, height: int, seed: int = 0, fmt: str = "JPEG") -> bytes:
+    """A noisy gradient image; noise keeps JPEG sizes realistic"""
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    base = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                     np.broadcast_to((x + y) / 2, (height, width))], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 25, base.shape), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format=fmt, quality=90)
+    return buffer.getvalue()
+
+
+def synthetic_hospital_dataset(path: str, count: int = 50000, seed: int = 0):
+    rng = random.Random(seed)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["place_id", "name", "lat", "lon", "vicinity"])
+        for i in range(count):
+            writer.writerow([f"bench-{i}", f"Bench Hospital {i}", rng.uniform(8.0, 35.0),
+                             rng.uniform(68.0, 97.0), f"{i} Synthetic Road"])
+
+
+def synthetic_locations(count: int, seed: int = 0) -> List[tuple]:
+    rng = random.Random(seed)
+    return [(round(rng.uniform(8.0, 35.0), 5), round(rng.uniform(68.0, 97.0), 5)) for _ in range(count)]
+
+
+# -- statistics -----------------------------------------------------------------
+
+def summarize(latencies_s: List[float], elapsed_s: Optional[float] = None) -> Dict:
+    """Latency percentiles in milliseconds, and throughput in operations per second"""
+    if not latencies_s:
+        return {"count": 0}
+    ms = np.asarray(latencies_s) * 1000.0
+    elapsed = elapsed_s if elapsed_s is not None else float(np.sum(latencies_s))
+    return {
+        "count": int(ms.size),
+        "throughput": ms.size / elapsed if elapsed > 0 else 0.0,
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def environment() -> Dict:
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.time(),
+    }
+    try:
+        info["git_rev"] = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True, timeout=5
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        pass
+    try:
+        import torch
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return info
+
+
+def write_results(path: Optional[str], kind: str, args, results: Dict, extra: Optional[Dict] = None):
+    report = {
+        "kind": kind,
+        "meta": {**environment(), "args": {k: v for k, v in vars(args).items() if k != "func"}},
+        "benchmarks": results,
+        **(extra or {}),
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if path:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+        print(f"Wrote {path}")
+    return report
+
+
+def print_table(results: Dict):
+    print(f"{'benchmark':<36}{'count':>8}{'ops/s':>11}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in results.items():
+        if not r.get("count"):
+            print(f"{name:<36}{'-':>8}")
+            continue
+        print(f"{name:<36}{r['count']:>8}{r['throughput']:>11.1f}{r['p50_ms']:>10.2f}"
+              f"{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}")
+
+
+# -- load test ------------------------------------------------------------------
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("symptoms", "image", "hospitals"):
+            raise ValueError(f"Unknown request type in mix: {name}")
+        weights[name] = float(weight or 1)
+    return {k: v for k, v in weights.items() if v > 0}
+
+
+def prepare_env(args, dataset_path: str) -> Dict[str, str]:
+    env = {
+        "HOSPITAL_PROVIDER": "offline",
+        "HOSPITAL_DATASET": dataset_path,
+        "HOSPITAL_DATASET_POLL": "0",
+        "MODEL_LOADING": "eager" if args.spawn else "lazy",
+    }
+    if not args.cache:
+        env["RESULT_CACHE_ENTRIES"] = "0"
+        env["RESULT_CACHE_DIR"] = ""
+    return env
+
+
+class LoadGenerator:
+    def __init__(self, client, mix: Dict[str, float], seed: int, image_sizes: List[tuple]):
+        self.client = client
+        self.kinds = list(mix)
+        self.weights = [mix[k] for k in self.kinds]
+        self.rng = random.Random(seed)
+        self.texts = synthetic_texts(256, seed)
+        self.images = [synthetic_image(w, h, seed + i) for i, (w, h) in enumerate(image_sizes * 8)]
+        self.locations = synthetic_locations(256, seed)
+        self.latencies: Dict[str, List[float]] = {k: [] for k in self.kinds}
+        self.statuses: Dict[str, Dict[str, int]] = {k: {} for k in self.kinds}
+        self.errors = 0
+
+    async def one(self, kind: str):
+        if kind == "symptoms":
+            body = {"symptoms": self.rng.choice(self.texts), "medicalSystem": self.rng.choice(MEDICAL_SYSTEMS)}
+            request = self.client.post("/api/analyze-symptoms", json=body)
+        elif kind == "image":
+            files = {"file": ("bench.jpg", self.rng.choice(self.images), "image/jpeg")}
+            request = self.client.post("/api/analyze-image", files=files)
+        else:
+            lat, lon = self.rng.choice(self.locations)
+            request = self.client.get("/api/nearby-hospitals", params={"lat": lat, "lon": lon, "radius": 20000})
+
+        start = time.perf_counter()
+        try:
+            response = await request
+            status = str(response.status_code)
+            await response.aread()
+        except Exception as e:
+            self.errors += 1
+            status = type(e).__name__
+        self.latencies[kind].append(time.perf_counter() - start)
+        self.statuses[kind][status] = self.statuses[kind].get(status, 0) + 1
+
+    async def run(self, concurrency: int, total: int, duration: float, warmup: int) -> float:
+        for kind in self.kinds:
+            for _ in range(warmup):
+                await self.one(kind)
+        for kind in self.kinds:
+            self.latencies[kind].clear()
+            self.statuses[kind].clear()
+
+        remaining = total
+        deadline = time.perf_counter() + duration if duration else None
+
+        async def worker():
+            nonlocal remaining
+            while True:
+                if deadline is not None:
+                    if time.perf_counter() >= deadline:
+                        return
+                else:
+                    if remaining <= 0:
+                        return
+                    remaining -= 1
+                await self.one(self.rng.choices(self.kinds, self.weights)[0])
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+    def results(self, elapsed: float) -> Dict:
+        results = {}
+        everything = []
+        for kind in self.kinds:
+            results[f"load.{kind}"] = {**summarize(self.latencies[kind], elapsed), "statuses": self.statuses[kind]}
+            everything.extend(self.latencies[kind])
+        results["load.total"] = {**summarize(everything, elapsed), "errors": self.errors}
+        return results
+
+
+def wait_for_server(url: str, timeout: float):
+    import httpx
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url + "/readyz", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server at {url} did not become ready within {timeout} seconds")
+
+
+async def run_load_async(args, mix: Dict[str, float]) -> Dict:
+    import httpx
+
+    image_sizes = [tuple(int(v) for v in s.split("x")) for s in args.image_sizes]
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=timeout, limits=limits)
+    else:
+        import main
+
+        # The ASGI transport does not run startup hooks; load models up front
+        main.model_registry.load_all()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=timeout)
+
+    async with client:
+        generator = LoadGenerator(client, mix, args.seed, image_sizes)
+        elapsed = await generator.run(args.concurrency, args.requests, args.duration, args.warmup)
+    return generator.results(elapsed)
+
+
+def cmd_load(args):
+    mix = parse_mix(args.mix)
+    server = None
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset = os.path.join(tmp, "hospitals.csv")
+        synthetic_hospital_dataset(dataset, seed=args.seed)
+        env = prepare_env(args, dataset)
+        if args.spawn:
+            args.url = f"http://127.0.0.1:{args.port}"
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port),
+                 "--workers", str(args.workers), "--log-level", "warning"],
+                cwd=HERE, env={**os.environ, **env},
+            )
+        elif not args.url:
+            os.environ.update(env)
+            sys.path.insert(0, HERE)
+
+        try:
+            if args.url:
+                wait_for_server(args.url.rstrip("/"), args.ready_timeout)
+            results = asyncio.run(run_load_async(args, mix))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=30)
+
+    print_table(results)
+    write_results(args.out, "load", args, results)
+
+
+# -- micro-benchmarks ---------------------------------------------------------
+
+def time_calls(fn: Callable[[], object], min_time: float, min_calls: int = 5, warmup: int = 3) -> Dict:
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < min_calls or time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies)
+
+
+def cmd_micro(args):
+    os.environ.setdefault("MODEL_LOADING", "lazy")
+    sys.path.insert(0, HERE)
+    from PIL import Image
+    import torch
+
+    import main
+    from image_preprocess import preprocess_image
+
+    selected = set(args.only or [])
+
+    def wanted(name: str) -> bool:
+        return not selected or any(name.startswith(s) for s in selected)
+
+    results = {}
+
+    def bench(name: str, fn: Callable[[], object]):
+        if wanted(name):
+            results[name] = time_calls(fn, args.min_time)
+            r = results[name]
+            print(f"{name:<36}{r['p50_ms']:>10.3f} ms p50 {r['p99_ms']:>10.3f} ms p99")
+
+    kb = main.knowledge.current
+    texts = synthetic_texts(512, args.seed)
+    cycle = iter(range(1 << 62))
+    bench("micro.keyword_scoring", lambda: kb.scorer.score(texts[next(cycle) % len(texts)].lower()))
+    batch = [t.lower() for t in texts[:64]]
+    bench("micro.keyword_scoring_batch64", lambda: kb.scorer.score_batch(batch))
+
+    images = {size: synthetic_image(*size, seed=args.seed) for size in [(640, 480), (3024, 4032)]}
+    for (w, h), data in images.items():
+        def decode(data=data):
+            with Image.open(io.BytesIO(data)) as image:
+                return image.convert("RGB")
+        bench(f"micro.pil_decode_{w}x{h}", decode)
+        bench(f"micro.preprocess_image_{w}x{h}", lambda data=data: preprocess_image(data))
+
+    decoded = Image.open(io.BytesIO(images[(640, 480)])).convert("RGB")
+    bench("micro.image_transform_640x480", lambda: main.image_transform(decoded))
+
+    if any(wanted(f"micro.forward_b{b}") for b in args.batch_sizes):
+        main.model_registry.load_all()
+        engine = main.model_registry.get("image_engine")
+        for b in args.batch_sizes:
+            inputs = torch.randn(b, 3, 224, 224, generator=torch.Generator().manual_seed(args.seed))
+            bench(f"micro.forward_b{b}", lambda inputs=inputs: engine(inputs))
+
+    # Building and encoding the response body from scorer / classifier outputs
+    scores, severity_hits = kb.scorer.score(texts[0].lower())
+    probs = torch.softmax(torch.randn(1, len(kb.skin_conditions)), dim=1)
+    top_probs, top_indices = torch.topk(probs, main.IMAGE_TOP_K, dim=1)
+    top_probs, top_indices = top_probs[0].tolist(), top_indices[0].tolist()
+    bench("micro.json_symptom_response",
+          lambda: main.RawJSONResponse(main.build_symptom_response(kb, scores, severity_hits)).body)
+    bench("micro.json_image_response",
+          lambda: main.RawJSONResponse(main.build_image_response(kb, top_probs, top_indices)).body)
+
+    write_results(args.out, "micro", args, results)
+
+
+# -- engines ------------------------------------------------------------------
+
+def held_out_folds(pairs: List[tuple], folds: int) -> List[tuple]:
+    """(train, held out) splits that hold out every folds-th phrase of each condition"""
+    position: Dict[str, int] = {}
+    fold_of = []
+    for _, condition in pairs:
+        fold_of.append(position.get(condition, 0) % folds)
+        position[condition] = position.get(condition, 0) + 1
+    return [
+        ([p for p, f in zip(pairs, fold_of) if f != k], [p for p, f in zip(pairs, fold_of) if f == k])
+        for k in range(folds)
+    ]
+
+
+def ranked(scored) -> List[str]:
+    """Conditions in the order the response builder would list them"""
+    return [condition for condition, _ in sorted(scored[0], key=lambda x: x[1], reverse=True)]
+
+
+def cmd_engines(args):
+    os.environ.setdefault("MODEL_LOADING", "lazy")
+    sys.path.insert(0, HERE)
+    import main
+    from knowledge_base import load_training_data
+    from symptom_engines import ENGINES, NaiveBayesScorer, create_symptom_engine
+    from symptom_scoring import SymptomScorer
+
+    kb = main.knowledge.current
+    if args.phrases:
+        # Explicit held-out set, scored by engines trained on all of the training data
+        splits = [(kb.training_data, load_training_data(args.phrases))]
+    else:
+        splits = held_out_folds(kb.training_data, args.folds)
+
+    labels: List[str] = []
+    rankings: Dict[str, List[List[str]]] = {name: [] for name in ENGINES}
+    single: Dict[str, List[float]] = {name: [] for name in ENGINES}
+    batched: Dict[str, List[float]] = {name: [] for name in ENGINES}
+    for train, held_out in splits:
+        scorer = SymptomScorer(kb.skin_conditions, main.CONDITION_KEYWORDS, train, main.SEVERITY_WORDS,
+                               main.BODY_PARTS, main.SEVERITY_INDICATORS)
+        classifier = NaiveBayesScorer(main.initialize_symptom_classifier(train))
+        texts = [text.strip().lower() for text, _ in held_out]
+        labels.extend(condition for _, condition in held_out)
+        for name in ENGINES:
+            engine = create_symptom_engine(name, scorer, classifier, main.HYBRID_KEYWORD_WEIGHT)
+            for text in texts:
+                for _ in range(args.repeat):
+                    t0 = time.perf_counter()
+                    scored = engine.score(text)
+                    single[name].append(time.perf_counter() - t0)
+                rankings[name].append(ranked(scored))
+            batch = (texts * (args.batch_size // max(1, len(texts)) + 1))[:args.batch_size]
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                engine.score_batch(batch)
+                # Per text, so single and batched latency compare directly
+                batched[name].append((time.perf_counter() - t0) / len(batch))
+
+    results = {}
+    for name in ENGINES:
+        results[f"engines.{name}"] = summarize(single[name])
+        results[f"engines.{name}_batch{args.batch_size}_per_text"] = summarize(batched[name])
+
+    def top1(ranking):
+        return ranking[0] if ranking else None
+
+    accuracy = {
+        name: {
+            "top1": sum(top1(r) == label for r, label in zip(rankings[name], labels)) / len(labels),
+            "top3": sum(label in r[:3] for r, label in zip(rankings[name], labels)) / len(labels),
+        }
+        for name in ENGINES
+    }
+    agreement = {
+        f"{a}/{b}": sum(top1(x) == top1(y) for x, y in zip(rankings[a], rankings[b])) / len(labels)
+        for i, a in enumerate(ENGINES) for b in ENGINES[i + 1:]
+    }
+
+    print(f"{len(labels)} held-out phrases in {len(splits)} split(s)\n")
+    print(f"{'engine':<12}{'top-1':>8}{'top-3':>8}{'p50 ms':>10}{'p99 ms':>10}{'batch ms/text':>15}")
+    for name in ENGINES:
+        r, b = results[f"engines.{name}"], results[f"engines.{name}_batch{args.batch_size}_per_text"]
+        print(f"{name:<12}{accuracy[name]['top1']:>8.1%}{accuracy[name]['top3']:>8.1%}"
+              f"{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}{b['p50_ms']:>15.4f}")
+    print("\ntop-1 agreement: " + ", ".join(f"{pair} {value:.1%}" for pair, value in agreement.items()))
+
+    write_results(args.out, "engines", args, results, {
+        "evaluation": {"phrases": len(labels), "splits": len(splits), "accuracy": accuracy, "agreement": agreement}
+    })
+
+
+# -- similar cases ------------------------------------------------------------
+
+def cmd_similar(args):
+    sys.path.insert(0, HERE)
+    import scipy.sparse as sp
+
+    from similar_cases import SimilarCaseIndex
+
+    texts, conditions = synthetic_cases(args.cases, args.seed)
+    path = args.index or tempfile.mkdtemp(prefix="similar-cases-")
+    index = SimilarCaseIndex.open(path, max_segments=args.cases // args.chunk + 2)
+    if len(index) != args.cases:
+        if len(index):
+            raise SystemExit(f"{path} holds {len(index)} cases, not {args.cases}; use another --index")
+        t0 = time.perf_counter()
+        for start in range(0, args.cases, args.chunk):
+            index.append(texts[start:start + args.chunk], conditions[start:start + args.chunk])
+        print(f"Indexed {args.cases} cases in {time.perf_counter() - t0:.1f}s")
+        t0 = time.perf_counter()
+        index.compact()
+        print(f"Compacted to one segment in {time.perf_counter() - t0:.1f}s")
+    index = SimilarCaseIndex.open(path, max_postings=args.max_postings, rerank=args.rerank)
+    print(f"{index.stats()['postings']} postings in {path}")
+
+    # Queries look like what /api/analyze-symptoms receives
+    queries = synthetic_texts(args.queries, args.seed + 1)
+    results = {}
+    for k in args.k:
+        latencies = []
+        for query in queries:
+            t0 = time.perf_counter()
+            index.search(query, k)
+            latencies.append(time.perf_counter() - t0)
+        results[f"similar.search_k{k}"] = summarize(latencies)
+
+    # Exhaustive scoring of a sample: how many of the true top k the index returns
+    recall = None
+    if args.verify:
+        matrix = sp.vstack([segment.to_matrix(index.n_features) for _, segment in index.segments], format="csr")
+        k = max(args.k)
+        hits = 0
+        for query in queries[:args.verify]:
+            terms, weights = index._query(query, index.segments)
+            vector = sp.csr_matrix((weights, terms, [0, len(terms)]), shape=(1, index.n_features))
+            expected = np.sort((matrix @ vector.T).toarray().ravel())[::-1][:k]
+            found = np.array([score for _, _, score in index.search(query, k)])
+            # By score, so ties at the k-th place do not count as misses
+            hits += int(np.sum(found >= expected[-1] - 1e-5))
+        recall = hits / (k * args.verify)
+
+    # Appends land as a small in-memory segment next to the mapped one
+    extra, extra_conditions = synthetic_cases(args.append, args.seed + 2)
+    index.path = None
+    t0 = time.perf_counter()
+    index.append(extra, extra_conditions)
+    results[f"similar.append_{args.append}"] = summarize([time.perf_counter() - t0])
+    latencies = []
+    for query in queries:
+        t0 = time.perf_counter()
+        index.search(query, max(args.k))
+        latencies.append(time.perf_counter() - t0)
+    results[f"similar.search_k{max(args.k)}_after_append"] = summarize(latencies)
+
+    print_table(results)
+    if recall is not None:
+        print(f"\nrecall@{max(args.k)} against exhaustive scoring: {recall:.1%} over {args.verify} queries")
+    if not args.index:
+        shutil.rmtree(path, ignore_errors=True)
+    write_results(args.out, "similar", args, results, {
+        "index": {"cases": args.cases, "postings": index.stats()["postings"], "max_postings": index.max_postings,
+                  "rerank": index.rerank, "recall": recall}
+    })
+
+
+# -- compare ------------------------------------------------------------------
+
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def cmd_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)["benchmarks"]
+    with open(args.candidate) as f:
+        candidate = json.load(f)["benchmarks"]
+
+    regressions = []
+    print(f"{'benchmark':<36}{'metric':>10}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    for name in sorted(set(baseline) & set(candidate)):
+        old, new = baseline[name], candidate[name]
+        if not old.get("count") or not new.get("count"):
+            continue
+        for metric in args.metrics:
+            if metric not in old or metric not in new or not old[metric]:
+                continue
+            change = (new[metric] - old[metric]) / old[metric]
+            worse = change > args.threshold if metric in LOWER_IS_BETTER else change < -args.threshold
+            flag = "  REGRESSION" if worse else ""
+            print(f"{name:<36}{metric:>10}{old[metric]:>12.3f}{new[metric]:>12.3f}{change:>+10.1%}{flag}")
+            if worse:
+                regressions.append((name, metric, change))
+
+    for name in sorted(set(baseline) ^ set(candidate)):
+        print(f"{name:<36} only in {'baseline' if name in baseline else 'candidate'}")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load tests and micro-benchmarks with synthetic inputs")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    load = sub.add_parser("load", help="drive the API endpoints with a request mix")
+    load.add_argument("--url", default=None, help="running server to target (default: in-process ASGI)")
+    load.add_argument("--spawn", action="store_true", help="start uvicorn in a subprocess and target it")
+    load.add_argument("--port", type=int, default=8765)
+    load.add_argument("--workers", type=int, default=1, help="uvicorn workers with --spawn")
+    load.add_argument("--concurrency", type=int, default=16)
+    load.add_argument("--requests", type=int, default=1000, help="total requests (ignored with --duration)")
+    load.add_argument("--duration", type=float, default=0, help="run for this many seconds instead")
+    load.add_argument("--warmup", type=int, default=5, help="unmeasured requests per type before the run")
+    load.add_argument("--mix", default=DEFAULT_MIX, help="weights per request type")
+    load.add_argument("--image-sizes", nargs="+", default=["640x480", "1920x1080"])
+    load.add_argument("--cache", action="store_true", help="keep the result caches enabled")
+    load.add_argument("--timeout", type=float, default=60.0)
+    load.add_argument("--ready-timeout", type=float, default=300.0)
+    load.add_argument("--seed", type=int, default=0)
+    load.add_argument("--out", default=None, help="write results as JSON")
+    load.set_defaults(func=cmd_load)
+
+    micro = sub.add_parser("micro", help="time the hot stages in isolation")
+    micro.add_argument("--min-time", type=float, default=1.0, help="seconds per benchmark")
+    micro.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    micro.add_argument("--only", nargs="+", default=None, help="benchmark name prefixes to run")
+    micro.add_argument("--seed", type=int, default=0)
+    micro.add_argument("--out", default=None, help="write results as JSON")
+    micro.set_defaults(func=cmd_micro)
+
+    engines = sub.add_parser("engines", help="compare symptom engines on held-out phrases")
+    engines.add_argument("--folds", type=int, default=3, help="cross-validation folds over the training phrases")
+    engines.add_argument("--phrases", default=None,
+                         help="held-out phrases as {condition: [phrases]} JSON, instead of folds")
+    engines.add_argument("--batch-size", type=int, default=64)
+    engines.add_argument("--repeat", type=int, default=20, help="timed runs per phrase and per batch")
+    engines.add_argument("--out", default=None, help="write results as JSON")
+    engines.set_defaults(func=cmd_engines)
+
+    similar = sub.add_parser("similar", help="time similar-case search over a synthetic corpus")
+    similar.add_argument("--cases", type=int, default=1000000)
+    similar.add_argument("--index", default=None, help="index directory to build or reuse (default: temporary)")
+    similar.add_argument("--chunk", type=int, default=100000, help="cases per append while building")
+    similar.add_argument("--queries", type=int, default=500)
+    similar.add_argument("--k", type=int, nargs="+", default=[5, 20])
+    similar.add_argument("--max-postings", type=int, default=100000, help="postings read per query (0: all, exact)")
+    similar.add_argument("--rerank", type=int, default=2048, help="candidates rescored exactly")
+    similar.add_argument("--append", type=int, default=1000, help="cases appended after the timed queries")
+    similar.add_argument("--verify", type=int, default=20, help="queries checked against exhaustive scoring")
+    similar.add_argument("--seed", type=int, default=0)
+    similar.add_argument("--out", default=None, help="write results as JSON")
+    similar.set_defaults(func=cmd_similar)
+
+    compare = sub.add_parser("compare", help="flag regressions between two result files")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    compare.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown")
+    compare.add_argument("--metrics", nargs="+", default=["p50_ms", "p95_ms", "throughput"])
+    compare.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# build_bundle.py
+# Build the offline model bundle used for fast startup.
+#
+#   python build_bundle.py --out model_bundle
+#
+# Run this once on a machine with network access (for the ImageNet backbone
+# weights, unless medical_image_model.pth is present), then ship the bundle
+# directory to the serving nodes and point MODEL_BUNDLE_DIR at it.
+import argparse
+import logging
+import os
+
+# Build the bundle from the legacy code path, never from an existing bundle
+os.environ["MODEL_BUNDLE_DIR"] = ""
+os.environ["MODEL_LOADING"] = "lazy"
+
+import main  # noqa: E402
+from model_bundle import write_bundle  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+def build():
+    parser = argparse.ArgumentParser(description="Build the offline model bundle")
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_bundle"))
+    parser.add_argument("--weights", default="medical_image_model.pth", help="fine-tuned image model weights")
+    args = parser.parse_args()
+
+    knowledge = main.knowledge.current
+    classifier = main.initialize_symptom_classifier(knowledge.training_data)
+    image_model = main.initialize_image_analyzer()
+    finetuned = main.load_finetuned_weights(image_model, args.weights)
+
+    write_bundle(args.out, classifier, image_model, knowledge.skin_conditions, finetuned, knowledge.training_data)
+    logger.info(f"Model bundle written to {args.out}")
+
+
+if __name__ == "__main__":
+    build()
@@ -0,0 +1,49 @@
+# build_case_index.py
+# Build or extend the similar-case index searched by /api/analyze-symptoms.
+#
+#   python build_case_index.py cases.csv --out similar_cases_index
+#   python build_case_index.py new_cases.jsonl --out similar_cases_index --append
+#
+# Case files are .csv, .jsonl or .json records with the symptom text
+# (`symptoms`, `text` or `notes`), the confirmed `condition` (or `diagnosis`,
+# `label`) and an optional `caseId`/`id`. Cases are added in chunks, then the
+# segments are compacted into one. Running servers pick up the new manifest
+# within SIMILAR_CASES_POLL_SECONDS.
+import argparse
+import logging
+import os
+import shutil
+import time
+
+from similar_cases import DEFAULT_FEATURES, MANIFEST, SimilarCaseIndex, load_cases
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def build():
+    parser = argparse.ArgumentParser(description="Build or extend the similar-case index")
+    parser.add_argument("cases", help="case records (.csv, .jsonl or .json)")
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "similar_cases_index"))
+    parser.add_argument("--append", action="store_true", help="add to an existing index instead of replacing it")
+    parser.add_argument("--features", type=int, default=DEFAULT_FEATURES, help="hashed feature space size")
+    parser.add_argument("--chunk", type=int, default=100000, help="cases hashed per segment")
+    args = parser.parse_args()
+
+    if not args.append and os.path.exists(os.path.join(args.out, MANIFEST)):
+        shutil.rmtree(args.out)
+    texts, conditions, case_ids = load_cases(args.cases)
+    index = SimilarCaseIndex.open(args.out, n_features=args.features, max_segments=len(texts) // args.chunk + 2)
+    started = time.perf_counter()
+    for start in range(0, len(texts), args.chunk):
+        end = start + args.chunk
+        index.append(texts[start:end], conditions[start:end], case_ids[start:end])
+    index.compact()
+    logger.info(
+        f"Indexed {len(texts)} cases from {args.cases} in {time.perf_counter() - started:.1f}s; "
+        f"{len(index)} cases in {args.out}"
+    )
+
+
+if __name__ == "__main__":
+    build()
@@ -0,0 +1,104 @@
+# calibrate_cascade.py
+# Pick confidence/margin thresholds for the image model cascade (cascade.py).
+#
+#   python calibrate_cascade.py --weights medical_image_model.pth --samples-dir samples/ \
+#       --stages lowres-112 --target-agreement 0.98 --out artifacts/cascade.json
+#
+# Every sample goes through the full model and each screening stage. Stage by
+# stage, on the images the earlier stages escalate, the thresholds that accept
+# the most images while their top-1 agrees with the full model at the target
+# rate are kept. The report has each stage's acceptance and agreement on the
+# samples, the measured per-image cost of every model and the expected average
+# cost per image against the full model alone. Serve with IMAGE_CASCADE=<stages>;
+# the thresholds are read from IMAGE_CASCADE_THRESHOLDS (default
+# <IMAGE_ARTIFACT_DIR>/cascade.json). Use samples that look like real uploads:
+# thresholds calibrated on synthetic images mean little.
+import argparse
+import json
+import logging
+import os
+import time
+
+import torch
+
+from cascade import THRESHOLDS_FILE, calibrate, create_screen
+from export_model import load_samples
+from inference_engine import EagerEngine, InferenceEngine, build_image_model, load_finetuned_weights
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def run(engine: InferenceEngine, inputs: torch.Tensor, batch_size: int):
+    """(probabilities, milliseconds per image) of an engine over the samples"""
+    engine(inputs[:1])  # warm-up
+    outputs = []
+    started = time.perf_counter()
+    for i in range(0, len(inputs), batch_size):
+        outputs.append(engine(inputs[i:i + batch_size]).float())
+    elapsed = time.perf_counter() - started
+    return torch.cat(outputs).numpy(), elapsed / len(inputs) * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the thresholds of the image model cascade")
+    parser.add_argument("--weights", default="medical_image_model.pth", help="fine-tuned state dict")
+    parser.add_argument("--stages", nargs="+", default=["lowres-112"], help="screening stages, cheapest first")
+    parser.add_argument("--samples-dir", default=None, help="representative images")
+    parser.add_argument("--samples", type=int, default=256)
+    parser.add_argument("--target-agreement", type=float, default=0.98,
+                        help="minimum top-1 agreement with the full model for images a stage answers")
+    parser.add_argument("--artifact-dir", default="artifacts", help="where screening model weights live")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--out", default=None, help=f"defaults to <artifact dir>/{THRESHOLDS_FILE}")
+    args = parser.parse_args()
+
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "medical_conditions.json")) as f:
+        num_conditions = len(json.load(f)["skin_conditions"])
+    has_weights = os.path.exists(args.weights)
+    model = build_image_model(num_conditions, pretrained=not has_weights)
+    if has_weights:
+        load_finetuned_weights(model, args.weights)
+    else:
+        logger.warning(f"{args.weights} not found, calibrating the ImageNet backbone with an untrained head")
+    model.eval()
+
+    samples = load_samples(args.samples_dir, args.samples)
+    full_probs, full_ms = run(EagerEngine(model), samples, args.batch_size)
+    stage_probs, stage_ms = {}, {}
+    for name in args.stages:
+        screen = create_screen(name, model, num_conditions, args.artifact_dir)
+        stage_probs[name], stage_ms[name] = run(screen, samples, args.batch_size)
+    stages = calibrate(stage_probs, full_probs, args.target_agreement)
+
+    # Expected cost: every image pays for each stage it reaches, escalated ones for the full model too
+    reaching, cost = 1.0, 0.0
+    for name, limits in stages.items():
+        cost += reaching * stage_ms[name]
+        limits["latency_ms_per_image"] = stage_ms[name]
+        limits["acceptance_rate"] = limits["accepted"] / limits["evaluated"] if limits["evaluated"] else 0.0
+        reaching *= 1.0 - limits["acceptance_rate"]
+    cost += reaching * full_ms
+    report = {
+        "target_agreement": args.target_agreement,
+        "samples": len(samples),
+        "stages": stages,
+        "full_latency_ms_per_image": full_ms,
+        "escalation_rate": reaching,
+        "expected_ms_per_image": cost,
+        "expected_speedup": full_ms / cost if cost else 0.0,
+    }
+
+    out = args.out or os.path.join(args.artifact_dir, THRESHOLDS_FILE)
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    if report["expected_speedup"] < 1.0:
+        logger.warning("On these samples the cascade costs more than the full model alone; "
+                       "try fewer or cheaper stages, or a lower --target-agreement")
+    logger.info(f"Cascade thresholds written to {out}")
+
+
+if __name__ == "__main__":
+    main()
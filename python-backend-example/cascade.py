@@ -0,0 +1,255 @@
+# cascade.py
+# Confidence-gated model cascade for image inference.
+#
+# Cheap screening stages run first; an image is answered by the first stage
+# whose top-1 probability and top-1/top-2 margin both clear that stage's
+# thresholds, and only the rest go on to the next stage and finally to the full
+# densenet169 engine. Screening stages:
+#   lowres-<size>        the same densenet169 on the image downscaled to size x size
+#                        (lowres-112 costs about a quarter of the full pass)
+#   mobilenet_v3_small   a small network fine-tuned on the same conditions
+#                        (weights in <artifact dir>/screen_mobilenet_v3_small.pt)
+#
+# CascadeEngine has the InferenceEngine interface, so the micro-batcher, result
+# cache and every backend work unchanged. Thresholds are picked offline by
+# calibrate_cascade.py for a target top-1 agreement with the full model.
+import json
+import logging
+import os
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torchvision.models as models
+
+from inference_engine import INPUT_SHAPE, InferenceEngine
+
+logger = logging.getLogger(__name__)
+
+SCREEN_FILES = {"mobilenet_v3_small": "screen_mobilenet_v3_small.pt"}
+THRESHOLDS_FILE = "cascade.json"
+
+
+class LowResEngine(InferenceEngine):
+    """The full model on a downscaled copy of the batch"""
+
+    def __init__(self, model: torch.nn.Module, size: int):
+        self.model = model.eval()
+        self.size = size
+        self.name = f"lowres-{size}"
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        with torch.inference_mode():
+            small = F.interpolate(batch, size=(self.size, self.size), mode="bilinear",
+                                  align_corners=False, antialias=True)
+            return self.model(small)
+
+
+class MobileNetEngine(InferenceEngine):
+    name = "mobilenet_v3_small"
+
+    def __init__(self, model: torch.nn.Module):
+        self.model = model.eval()
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        with torch.inference_mode():
+            return self.model(batch)
+
+
+def build_mobilenet_screen(num_conditions: int, pretrained: bool = True) -> torch.nn.Module:
+    """mobilenet_v3_small with a softmax head over the skin conditions, for fine-tuning"""
+    weights = models.MobileNet_V3_Small_Weights.DEFAULT if pretrained else None
+    model = models.mobilenet_v3_small(weights=weights)
+    model.classifier[-1] = torch.nn.Linear(model.classifier[-1].in_features, num_conditions)
+    model.classifier.append(torch.nn.Softmax(dim=1))
+    return model
+
+
+def create_screen(name: str, model: Optional[torch.nn.Module], num_conditions: int,
+                  artifact_dir: str) -> InferenceEngine:
+    """Screening engine for a stage name"""
+    if name.startswith("lowres-"):
+        size = int(name[len("lowres-"):])
+        if not 32 <= size < INPUT_SHAPE[1]:
+            raise ValueError(f"lowres stage size must be between 32 and {INPUT_SHAPE[1] - 1}, got {size}")
+        if model is None:
+            raise ValueError(f"Stage '{name}' needs the eager model")
+        return LowResEngine(model, size)
+    if name in SCREEN_FILES:
+        path = os.path.join(artifact_dir, SCREEN_FILES[name])
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found; fine-tune the screening model first")
+        screen = build_mobilenet_screen(num_conditions, pretrained=False)
+        screen.load_state_dict(torch.load(path, map_location="cpu", weights_only=True))
+        return MobileNetEngine(screen)
+    raise ValueError(f"Unknown cascade stage '{name}'. Use lowres-<size> or one of: {', '.join(SCREEN_FILES)}")
+
+
+def load_thresholds(path: str) -> Dict[str, Dict]:
+    """Per-stage thresholds written by calibrate_cascade.py, or {} without a file"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("stages", {})
+
+
+def confidence_and_margin(probs: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    top2 = torch.topk(probs, 2, dim=1).values
+    return top2[:, 0], top2[:, 0] - top2[:, 1]
+
+
+class CascadeStage:
+    def __init__(self, engine: InferenceEngine, min_confidence: float, min_margin: float):
+        self.engine = engine
+        self.min_confidence = min_confidence
+        self.min_margin = min_margin
+        self.evaluated = 0
+        self.accepted = 0
+
+    def accepts(self, probs: torch.Tensor) -> torch.Tensor:
+        confidence, margin = confidence_and_margin(probs)
+        return (confidence >= self.min_confidence) & (margin >= self.min_margin)
+
+
+class CascadeEngine(InferenceEngine):
+    """Screening stages answer confident images; the rest escalate to the final engine"""
+
+    def __init__(self, stages: Sequence[CascadeStage], final: InferenceEngine):
+        self.stages = list(stages)
+        self.final = final
+        self.name = "cascade:" + "+".join(stage.engine.name for stage in self.stages) + f">{final.name}"
+        self.images = 0
+        self.escalated = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        outputs: Optional[torch.Tensor] = None
+        remaining = torch.arange(len(batch))
+        inputs = batch
+        counts = []
+        for stage in self.stages:
+            probs = stage.engine(inputs).float()
+            if outputs is None:
+                outputs = torch.empty(len(batch), probs.shape[1])
+            accepted = stage.accepts(probs)
+            outputs[remaining[accepted]] = probs[accepted]
+            counts.append((stage, len(inputs), int(accepted.sum())))
+            remaining, inputs = remaining[~accepted], inputs[~accepted]
+            if not len(remaining):
+                break
+        if len(remaining):
+            probs = self.final(inputs).float()
+            if outputs is None:
+                outputs = torch.empty(len(batch), probs.shape[1])
+            outputs[remaining] = probs
+        with self._lock:
+            self.images += len(batch)
+            self.escalated += len(remaining)
+            for stage, evaluated, accepted in counts:
+                stage.evaluated += evaluated
+                stage.accepted += accepted
+        return outputs
+
+    def stats(self) -> Dict:
+        return {
+            "stages": [
+                {
+                    "name": stage.engine.name,
+                    "min_confidence": stage.min_confidence,
+                    "min_margin": stage.min_margin,
+                    "evaluated": stage.evaluated,
+                    "accepted": stage.accepted,
+                }
+                for stage in self.stages
+            ],
+            "final": self.final.name,
+            "images": self.images,
+            "escalated": self.escalated,
+            "escalation_rate": self.escalated / self.images if self.images else 0.0,
+        }
+
+
+def create_cascade(
+    stage_names: Sequence[str],
+    model: Optional[torch.nn.Module],
+    final: InferenceEngine,
+    num_conditions: int,
+    artifact_dir: str,
+    thresholds: Dict[str, Dict],
+    default_confidence: float,
+    default_margin: float,
+) -> CascadeEngine:
+    stages = []
+    for name in stage_names:
+        limits = thresholds.get(name)
+        if limits is None:
+            logger.warning(f"No calibrated thresholds for cascade stage '{name}'; using "
+                           f"confidence >= {default_confidence}, margin >= {default_margin}")
+            limits = {"min_confidence": default_confidence, "min_margin": default_margin}
+        stages.append(CascadeStage(
+            create_screen(name, model, num_conditions, artifact_dir),
+            float(limits["min_confidence"]), float(limits["min_margin"]),
+        ))
+    return CascadeEngine(stages, final)
+
+
+def pick_thresholds(
+    probs: np.ndarray,
+    reference: np.ndarray,
+    target_agreement: float,
+    margins: Sequence[float] = tuple(np.round(np.arange(0.0, 0.51, 0.025), 3)),
+) -> Dict:
+    """Thresholds accepting the most images whose top-1 still agrees with reference at target_agreement
+
+    probs is (images, classes) from the stage, reference the full model's top-1
+    per image. Without any acceptable setting the stage accepts nothing.
+    """
+    top2 = -np.sort(-probs, axis=1)[:, :2]
+    confidence, margin = top2[:, 0], top2[:, 0] - top2[:, 1]
+    agrees = probs.argmax(axis=1) == reference
+    best = {"min_confidence": 1.01, "min_margin": 1.01, "accepted": 0, "agreement": None}
+    candidates = np.unique(confidence)
+    if len(candidates) > 512:
+        candidates = np.unique(np.quantile(confidence, np.linspace(0.0, 1.0, 512)).astype(confidence.dtype))
+    for min_margin in margins:
+        accepted = (confidence[None, :] >= candidates[:, None]) & (margin >= min_margin)[None, :]
+        n = accepted.sum(axis=1)
+        agreed = (accepted & agrees[None, :]).sum(axis=1)
+        ok = (n > 0) & (agreed >= target_agreement * n)
+        if not ok.any():
+            continue
+        i = int(np.argmax(np.where(ok, n, -1)))
+        if n[i] > best["accepted"]:
+            best = {
+                "min_confidence": float(candidates[i]),
+                "min_margin": float(min_margin),
+                "accepted": int(n[i]),
+                "agreement": float(agreed[i] / n[i]),
+            }
+    return best
+
+
+def calibrate(
+    stage_probs: Dict[str, np.ndarray],
+    full_probs: np.ndarray,
+    target_agreement: float,
+) -> Dict[str, Dict]:
+    """Pick each stage's thresholds on the images the earlier stages escalate
+
+    Every stage's accepted images agree with the full model at least at the
+    target rate, so the whole cascade does too.
+    """
+    reference = full_probs.argmax(axis=1)
+    remaining = np.arange(len(full_probs))
+    report = {}
+    for name, probs in stage_probs.items():
+        limits = pick_thresholds(probs[remaining], reference[remaining], target_agreement)
+        limits["evaluated"] = int(len(remaining))
+        report[name] = limits
+        if len(remaining):
+            confidence, margin = confidence_and_margin(torch.from_numpy(probs[remaining]))
+            accepted = ((confidence >= limits["min_confidence"]) & (margin >= limits["min_margin"])).numpy()
+            remaining = remaining[~accepted]
+    return report
@@ -0,0 +1,259 @@
+# embedding_store.py
+# Persistent store of densenet169 backbone features, keyed by image hash.
+#
+# The backbone is almost all of the cost of an image analysis; the classifier
+# head on top of its pooled 1664-d features is tiny. The store keeps, per
+# analyzed image:
+#   keys         sha256 of the uploaded bytes
+#   embeddings   the pooled backbone features (float32)
+#   descriptors  the perceptual descriptor from image_preprocess.image_descriptor
+#   predictions  the top-1 class when the image was stored
+# so a re-upload of the same bytes is answered by the head alone, without
+# decoding, and a re-encoded, resized or lightly cropped copy is matched by a
+# single matrix-vector product over the descriptors, without a forward pass.
+# A new head can be applied to every stored embedding in bulk
+# (rescore_embeddings.py).
+#
+# Each array is a raw file memory-mapped with np.memmap, grown by doubling;
+# manifest.json holds the row count and is replaced atomically after the rows
+# are written, so a crashed process never exposes a half-written row. Appends
+# take an flock on the directory's lock file, so serve.py workers can share one
+# store; each worker picks up rows added by the others when the manifest
+# changes. Rows reach the other processes through the shared page cache at
+# once; the column files are synced to disk by a background timer at most
+# flush_seconds after an append, never on the request path. Rows lost to an OS
+# crash before that read back as zeros: an all-zero key and descriptor never
+# match a lookup. The manifest also records a digest of the backbone weights:
+# features from a different backbone are meaningless, and the store starts over
+# when it changes.
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+KEY_BYTES = 32
+
+
+class EmbeddingStore:
+    """Append-only, memory-mapped image embeddings with exact and near-duplicate lookup"""
+
+    def __init__(self, path: str, dim: int, descriptor_dim: int, initial_capacity: int = 1024,
+                 flush_seconds: float = 2.0):
+        self.path = path
+        self.dim = dim
+        self.descriptor_dim = descriptor_dim
+        self.initial_capacity = initial_capacity
+        self.backbone = ""
+        self.count = 0
+        self.capacity = 0
+        self._rows: Dict[bytes, int] = {}
+        self._manifest_mtime: Optional[int] = None
+        self._lock = threading.Lock()
+        self.flush_seconds = flush_seconds
+        self._flush_timer: Optional[threading.Timer] = None
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+        with self._locked():
+            self._refresh()
+
+    # -- files ----------------------------------------------------------------
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _columns(self) -> Dict[str, Tuple[np.dtype, tuple]]:
+        return {
+            "keys": (np.uint8, (KEY_BYTES,)),
+            "embeddings": (np.float32, (self.dim,)),
+            "descriptors": (np.float32, (self.descriptor_dim,)),
+            "predictions": (np.int16, ()),
+        }
+
+    def _map(self, capacity: int):
+        """(Re)map every column file at the given capacity, extending the files if needed"""
+        for name, (dtype, shape) in self._columns().items():
+            path = self._file(f"{name}.bin")
+            size = capacity * int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+            with open(path, "ab") as f:
+                if f.tell() < size:
+                    f.truncate(size)
+            setattr(self, name, np.memmap(path, dtype=dtype, mode="r+", shape=(capacity,) + shape))
+        self.capacity = capacity
+
+    @contextmanager
+    def _locked(self):
+        """Thread lock plus an exclusive flock shared with other processes using the store"""
+        with self._lock, open(self._file("lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_manifest(self) -> Optional[Dict]:
+        try:
+            with open(self._file(MANIFEST), encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        if (manifest.get("format") != FORMAT_VERSION or manifest.get("dim") != self.dim
+                or manifest.get("descriptor_dim") != self.descriptor_dim):
+            logger.warning(f"Embedding store {self.path} has an incompatible layout; starting over")
+            return None
+        return manifest
+
+    def _write_manifest(self):
+        manifest = {
+            "format": FORMAT_VERSION,
+            "dim": self.dim,
+            "descriptor_dim": self.descriptor_dim,
+            "backbone": self.backbone,
+            "count": self.count,
+            "capacity": self.capacity,
+            "updated_at": time.time(),
+        }
+        path = self._file(MANIFEST)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, path)
+        self._manifest_mtime = os.stat(path).st_mtime_ns
+
+    def _refresh(self):
+        """Pick up rows appended by other processes; caller holds the lock"""
+        try:
+            mtime = os.stat(self._file(MANIFEST)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime is not None and mtime == self._manifest_mtime:
+            return
+        manifest = self._read_manifest()
+        if manifest is None:
+            self.count, self.backbone, self._rows = 0, "", {}
+            self._map(max(self.capacity, self.initial_capacity))
+            self._write_manifest()
+            return
+        if manifest["count"] < self.count or manifest["backbone"] != self.backbone:
+            # Reset by another process: rebuild the key map from scratch
+            self._rows = {}
+            self.count = 0
+        self.backbone = manifest["backbone"]
+        if manifest["capacity"] != self.capacity:
+            self._map(manifest["capacity"])
+        for row in range(self.count, manifest["count"]):
+            self._rows[self.keys[row].tobytes()] = row
+        self.count = manifest["count"]
+        self._manifest_mtime = mtime
+
+    def _maybe_refresh(self):
+        try:
+            changed = os.stat(self._file(MANIFEST)).st_mtime_ns != self._manifest_mtime
+        except FileNotFoundError:
+            changed = True
+        if changed:
+            with self._locked():
+                self._refresh()
+
+    # -- API ------------------------------------------------------------------
+
+    def bind_backbone(self, digest: str):
+        """Declare the backbone that produces new embeddings; drops rows from any other one"""
+        with self._locked():
+            self._refresh()
+            if self.backbone == digest:
+                return
+            if self.count:
+                logger.warning(
+                    f"Embedding store {self.path} was built with backbone {self.backbone or 'unknown'}, "
+                    f"now {digest}; discarding {self.count} embeddings"
+                )
+            self.backbone, self.count, self._rows = digest, 0, {}
+            self._write_manifest()
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        """Stored embedding for an exact image hash"""
+        row = self._rows.get(key)
+        if row is None:
+            self._maybe_refresh()
+            row = self._rows.get(key)
+        if row is None:
+            return None
+        self.exact_hits += 1
+        return np.array(self.embeddings[row])
+
+    def nearest(self, descriptor: np.ndarray, threshold: float) -> Optional[Tuple[int, float]]:
+        """(row, cosine similarity) of the closest stored descriptor, if at least threshold"""
+        self._maybe_refresh()
+        count = self.count
+        if not count or threshold > 1:
+            self.misses += 1
+            return None
+        # Descriptors are unit length, so one matrix-vector product gives every cosine
+        similarities = self.descriptors[:count] @ descriptor.astype(np.float32)
+        row = int(np.argmax(similarities))
+        similarity = float(similarities[row])
+        if similarity < threshold:
+            self.misses += 1
+            return None
+        self.near_hits += 1
+        return row, similarity
+
+    def embedding(self, row: int) -> np.ndarray:
+        return np.array(self.embeddings[row])
+
+    def add(self, key: bytes, descriptor: np.ndarray, embedding: np.ndarray, prediction: int) -> int:
+        """Store one image's embedding and return its row (the existing row for a known key)"""
+        with self._locked():
+            self._refresh()
+            row = self._rows.get(key)
+            if row is not None:
+                return row
+            row = self.count
+            if row >= self.capacity:
+                self._map(self.capacity * 2)
+            self.keys[row] = np.frombuffer(key, dtype=np.uint8)
+            self.embeddings[row] = embedding
+            self.descriptors[row] = descriptor
+            self.predictions[row] = prediction
+            self.count = row + 1
+            self._rows[key] = row
+            # The manifest is the row allocator for every process, so it is
+            # updated now; only the msync of the columns waits for the timer
+            self._write_manifest()
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.flush_seconds, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+            return row
+
+    def flush(self):
+        """Sync appended rows to disk"""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            for name in self._columns():
+                getattr(self, name).flush()
+
+    def stats(self) -> Dict:
+        return {
+            "path": self.path,
+            "embeddings": self.count,
+            "capacity": self.capacity,
+            "backbone": self.backbone,
+            "exact_hits": self.exact_hits,
+            "near_duplicate_hits": self.near_hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,170 @@
+# executors.py
+# Execution layer that keeps blocking work off the asyncio event loop.
+#
+# Work is routed to a dedicated pool per kind so cheap endpoints keep low tail
+# latency while heavy inference runs:
+#   inference - torch forward passes (small thread pool, torch threads split across it)
+#   decode    - PIL decode + transforms (threads, or processes with DECODE_POOL=process)
+#   io        - blocking file and network I/O, such as the result cache's disk tier
+#   light     - cheap CPU work such as batched symptom scoring
+# Pools are created on first use and dropped in forked children, so the layer
+# can be built at import time and still be safe to fork.
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def _init_decode_process():
+    # Decode workers never run model code; keep torch from spawning its own threads
+    torch.set_num_threads(1)
+
+
+class LazyPool(Executor):
+    """Executor that creates its underlying pool on first submit"""
+
+    def __init__(self, name: str, workers: int, kind: str = "thread"):
+        self.name = name
+        self.workers = max(1, workers)
+        self.kind = kind
+        self._pool: Optional[Executor] = None
+        self._lock = threading.Lock()
+        # Submitted but not finished: queued work plus work in progress
+        self.pending = 0
+        self._pending_lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            # Worker threads do not survive fork; let the child build its own pool
+            os.register_at_fork(after_in_child=self._forget)
+
+    def _forget(self):
+        self._pool = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self._pending_lock = threading.Lock()
+
+    def _get(self) -> Executor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    if self.kind == "process":
+                        # spawn so children import only the decode module, never main.py
+                        self._pool = ProcessPoolExecutor(
+                            max_workers=self.workers,
+                            mp_context=multiprocessing.get_context("spawn"),
+                            initializer=_init_decode_process,
+                        )
+                    else:
+                        self._pool = ThreadPoolExecutor(
+                            max_workers=self.workers, thread_name_prefix=f"{self.name}-pool"
+                        )
+        return self._pool
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        pool = self._get()
+        with self._pending_lock:
+            self.pending += 1
+        try:
+            future = pool.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._finished(None)
+            raise
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, _future: Optional[Future]):
+        # Done callbacks run on worker threads
+        with self._pending_lock:
+            self.pending -= 1
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+            self._pool = None
+
+
+class ExecutionLayer:
+    """Named executor pools plus torch thread coordination"""
+
+    def __init__(
+        self,
+        inference_workers: int = 1,
+        decode_workers: int = 2,
+        decode_mode: str = "thread",
+        io_workers: int = 8,
+        light_workers: int = 2,
+        torch_threads: Optional[int] = None,
+    ):
+        if decode_mode not in ("thread", "process"):
+            raise ValueError(f"Unknown decode pool mode: {decode_mode}")
+        self.cpu_count = os.cpu_count() or 1
+        self.inference_pool = LazyPool("inference", inference_workers)
+        self.decode_pool = LazyPool("decode", decode_workers, decode_mode)
+        self.io_pool = LazyPool("io", io_workers)
+        self.light_pool = LazyPool("light", light_workers)
+
+        # Split intra-op threads across concurrent forward passes so the
+        # inference pool never asks for more threads than there are cores
+        self.torch_threads = torch_threads or max(1, self.cpu_count // self.inference_pool.workers)
+
+    @classmethod
+    def from_env(cls) -> "ExecutionLayer":
+        torch_threads = os.environ.get("TORCH_NUM_THREADS")
+        return cls(
+            inference_workers=int(os.environ.get("INFERENCE_WORKERS", "1")),
+            decode_workers=int(os.environ.get("DECODE_WORKERS", "2")),
+            decode_mode=os.environ.get("DECODE_POOL", "thread"),
+            io_workers=int(os.environ.get("IO_WORKERS", "8")),
+            light_workers=int(os.environ.get("LIGHT_WORKERS", "2")),
+            torch_threads=int(torch_threads) if torch_threads else None,
+        )
+
+    def configure_torch(self):
+        torch.set_num_threads(self.torch_threads)
+        logger.info(
+            f"Torch intra-op threads: {self.torch_threads} "
+            f"({self.inference_pool.workers} inference workers, {self.cpu_count} cores)"
+        )
+
+    @staticmethod
+    async def _run(pool: Executor, fn: Callable, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(pool, partial(fn, *args, **kwargs))
+
+    async def run_inference(self, fn: Callable, *args, **kwargs):
+        return await self._run(self.inference_pool, fn, *args, **kwargs)
+
+    async def run_decode(self, fn: Callable, *args, **kwargs):
+        return await self._run(self.decode_pool, fn, *args, **kwargs)
+
+    async def run_io(self, fn: Callable, *args, **kwargs):
+        return await self._run(self.io_pool, fn, *args, **kwargs)
+
+    async def run_light(self, fn: Callable, *args, **kwargs):
+        return await self._run(self.light_pool, fn, *args, **kwargs)
+
+    def shutdown(self):
+        for pool in self.pools():
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict:
+        return {
+            "cpu_count": self.cpu_count,
+            "torch_threads": torch.get_num_threads(),
+            "inference_workers": self.inference_pool.workers,
+            "decode_workers": self.decode_pool.workers,
+            "decode_mode": self.decode_pool.kind,
+            "io_workers": self.io_pool.workers,
+            "light_workers": self.light_pool.workers,
+            "pending": {pool.name: pool.pending for pool in self.pools()},
+        }
+
+    def pools(self):
+        return (self.inference_pool, self.decode_pool, self.io_pool, self.light_pool)
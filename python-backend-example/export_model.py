@@ -0,0 +1,113 @@
+# export_model.py
+# Offline export of the image model into optimized inference artifacts, plus a
+# parity check of every backend against eager mode.
+#
+#   python export_model.py --out artifacts --weights medical_image_model.pth \
+#       --backends torchscript onnx onnx-int8 --calibration-dir samples/
+#
+# Serve an exported backend with IMAGE_BACKEND=<backend> IMAGE_ARTIFACT_DIR=artifacts.
+import argparse
+import json
+import logging
+import os
+
+import torch
+from PIL import Image
+
+from image_preprocess import IMAGE_TRANSFORM
+from inference_engine import (
+    ARTIFACT_FILES, BACKENDS, EagerEngine, build_image_model, create_engine,
+    export_onnx, export_torchscript, load_finetuned_weights, parity_report,
+    quantize_onnx_static,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def load_samples(calibration_dir, count: int) -> torch.Tensor:
+    """Preprocessed sample images from a directory, or synthetic images when none are given"""
+    tensors = []
+    if calibration_dir:
+        for name in sorted(os.listdir(calibration_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with Image.open(os.path.join(calibration_dir, name)) as image:
+                    tensors.append(IMAGE_TRANSFORM(image.convert("RGB")))
+            if len(tensors) >= count:
+                break
+    if not tensors:
+        logger.warning("No calibration images given; using synthetic images (int8 accuracy will be poor)")
+        generator = torch.Generator().manual_seed(0)
+        for _ in range(count):
+            pixels = (torch.rand(3, 64, 64, generator=generator) * 255).byte()
+            image = Image.fromarray(pixels.permute(1, 2, 0).numpy())
+            tensors.append(IMAGE_TRANSFORM(image))
+    return torch.stack(tensors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the image model to optimized inference backends")
+    parser.add_argument("--out", default="artifacts", help="output directory for artifacts")
+    parser.add_argument("--weights", default="medical_image_model.pth", help="fine-tuned state dict")
+    parser.add_argument("--num-conditions", type=int, default=None,
+                        help="classifier size (defaults to medical_conditions.json)")
+    parser.add_argument("--backends", nargs="+", default=["torchscript", "onnx", "onnx-int8"],
+                        choices=[b for b in BACKENDS if b != "eager"])
+    parser.add_argument("--calibration-dir", default=None, help="representative images for int8 calibration")
+    parser.add_argument("--calibration-samples", type=int, default=64)
+    parser.add_argument("--parity-samples", type=int, default=32)
+    parser.add_argument("--top-k", type=int, default=3)
+    args = parser.parse_args()
+
+    num_conditions = args.num_conditions
+    if num_conditions is None:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "medical_conditions.json")) as f:
+            num_conditions = len(json.load(f)["skin_conditions"])
+
+    # Fine-tuned weights cover the whole network, so only fetch ImageNet weights without them
+    has_weights = os.path.exists(args.weights)
+    model = build_image_model(num_conditions, pretrained=not has_weights)
+    if has_weights:
+        load_finetuned_weights(model, args.weights)
+    else:
+        logger.warning(f"{args.weights} not found, exporting ImageNet backbone with an untrained head")
+    model.eval()
+
+    os.makedirs(args.out, exist_ok=True)
+    # Calibrate on the first images and keep the rest held out for the parity check
+    pool = load_samples(args.calibration_dir, args.calibration_samples + args.parity_samples)
+    calibration = pool[:args.calibration_samples]
+    held_out = pool[args.calibration_samples:]
+    if len(held_out) == 0:
+        held_out = load_samples(None, args.parity_samples)
+
+    if "torchscript" in args.backends:
+        export_torchscript(model, os.path.join(args.out, ARTIFACT_FILES["torchscript"]))
+        logger.info("Exported TorchScript model")
+    if "onnx" in args.backends or "onnx-int8" in args.backends:
+        export_onnx(model, os.path.join(args.out, ARTIFACT_FILES["onnx"]))
+        logger.info("Exported ONNX model")
+    if "onnx-int8" in args.backends:
+        batches = [calibration[i:i + 8] for i in range(0, len(calibration), 8)]
+        quantize_onnx_static(
+            os.path.join(args.out, ARTIFACT_FILES["onnx"]),
+            os.path.join(args.out, ARTIFACT_FILES["onnx-int8"]),
+            batches,
+        )
+        logger.info("Exported statically quantized int8 ONNX model")
+
+    # Parity against eager mode on held-out samples
+    engines = [create_engine(backend, model, args.out) for backend in args.backends]
+    report = parity_report(EagerEngine(model), engines, held_out, k=args.top_k)
+
+    report_path = os.path.join(args.out, "parity_report.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    logger.info(f"Parity report written to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+# hospital_index.py
+# Offline, in-memory spatial index of hospitals.
+#
+# Loads a hospital dataset (CSV, GeoJSON or Parquet) and answers nearest-N and
+# within-radius queries from a haversine BallTree, returning records in the
+# same shape as Places Nearby Search results. ReloadingHospitalIndex watches
+# the dataset file and rebuilds the index in the background when it changes,
+# swapping it in atomically so queries never see a half-built index.
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from sklearn.neighbors import BallTree
+
+from hospitals import HospitalProvider
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6_371_008.8
+
+_LAT_FIELDS = ("lat", "latitude")
+_LON_FIELDS = ("lon", "lng", "longitude")
+_NAME_FIELDS = ("name", "hospital_name", "facility_name")
+_ADDRESS_FIELDS = ("vicinity", "address", "formatted_address")
+_ID_FIELDS = ("place_id", "id", "hospital_id")
+
+
+def _first(row: Dict, fields) -> Optional[str]:
+    for field in fields:
+        value = row.get(field)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _to_place(row: Dict, index: int) -> Optional[Dict]:
+    """Convert a dataset row into a Places-style result, or None without coordinates"""
+    lat, lon = _first(row, _LAT_FIELDS), _first(row, _LON_FIELDS)
+    if lat is None or lon is None:
+        return None
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+    place = {
+        "place_id": str(_first(row, _ID_FIELDS) or f"offline-{index}"),
+        "name": _first(row, _NAME_FIELDS) or "Hospital",
+        "vicinity": _first(row, _ADDRESS_FIELDS) or "",
+        "geometry": {"location": {"lat": lat, "lng": lon}},
+        "types": ["hospital", "health", "point_of_interest", "establishment"],
+    }
+    known = set(_LAT_FIELDS + _LON_FIELDS + _NAME_FIELDS + _ADDRESS_FIELDS + _ID_FIELDS)
+    for key, value in row.items():
+        if key not in known and value not in (None, "") and key not in place:
+            place[key] = value
+    return place
+
+
+def load_dataset(path: str) -> List[Dict]:
+    """Read hospitals from .csv, .geojson/.json or .parquet"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+    elif ext in (".geojson", ".json"):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        rows = []
+        for feature in data.get("features", []):
+            geometry = feature.get("geometry") or {}
+            if geometry.get("type") != "Point":
+                continue
+            lon, lat = geometry["coordinates"][:2]
+            rows.append({**(feature.get("properties") or {}), "lat": lat, "lon": lon})
+    elif ext == ".parquet":
+        try:
+            import pandas as pd
+        except ImportError:
+            raise RuntimeError("Reading Parquet hospital datasets needs pandas and pyarrow installed")
+        rows = pd.read_parquet(path).to_dict(orient="records")
+    else:
+        raise ValueError(f"Unsupported hospital dataset format: {path}")
+
+    places = []
+    for i, row in enumerate(rows):
+        place = _to_place(row, i)
+        if place is not None:
+            places.append(place)
+    return places
+
+
+class HospitalIndex:
+    """Immutable BallTree over hospital coordinates"""
+
+    def __init__(self, places: List[Dict]):
+        self.places = places
+        coords = np.array(
+            [[p["geometry"]["location"]["lat"], p["geometry"]["location"]["lng"]] for p in places],
+            dtype=np.float64,
+        ).reshape(-1, 2)
+        self.tree = BallTree(np.radians(coords), metric="haversine") if len(places) else None
+
+    def __len__(self):
+        return len(self.places)
+
+    def nearest(self, lat: float, lon: float, n: int) -> List[Dict]:
+        if self.tree is None or n <= 0:
+            return []
+        n = min(n, len(self.places))
+        _, indices = self.tree.query(np.radians([[lat, lon]]), k=n)
+        return [self.places[i] for i in indices[0]]
+
+    def within(self, lat: float, lon: float, radius_m: float, limit: int = 20) -> List[Dict]:
+        if self.tree is None:
+            return []
+        # sort_results needs return_distance; nearest first like Places rankby=distance
+        indices, _ = self.tree.query_radius(
+            np.radians([[lat, lon]]), r=radius_m / EARTH_RADIUS_M, return_distance=True, sort_results=True
+        )
+        return [self.places[i] for i in indices[0][:limit]]
+
+
+class ReloadingHospitalIndex:
+    """HospitalIndex that follows changes to its dataset file"""
+
+    def __init__(self, path: str, poll_seconds: float = 30.0):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self._mtime = os.path.getmtime(path)
+        self.index = HospitalIndex(load_dataset(path))
+        self.loaded_at = time.time()
+        self.reloads = 0
+        self.reload_errors = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        logger.info(f"Loaded {len(self.index)} hospitals from {path}")
+
+    def reload_if_changed(self) -> bool:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            index = HospitalIndex(load_dataset(self.path))
+        except Exception as e:
+            self.reload_errors += 1
+            logger.error(f"Failed to reload hospital dataset {self.path}: {str(e)}")
+            return False
+        # Single reference swap: queries use either the old or the new index
+        self.index = index
+        self._mtime = mtime
+        self.loaded_at = time.time()
+        self.reloads += 1
+        logger.info(f"Reloaded {len(index)} hospitals from {self.path}")
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_seconds):
+            self.reload_if_changed()
+
+    def start_watching(self):
+        if self.poll_seconds > 0 and (self._thread is None or not self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="hospital-index-watch", daemon=True)
+            self._thread.start()
+
+    def stop_watching(self):
+        self._stop.set()
+
+    def stats(self) -> Dict:
+        return {
+            "dataset": self.path,
+            "hospitals": len(self.index),
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+        }
+
+
+class OfflineHospitalProvider(HospitalProvider):
+    """Answers lookups from the local spatial index; no network, no tile cache needed"""
+
+    name = "offline"
+    cacheable = False
+
+    def __init__(self, index: ReloadingHospitalIndex, max_results: int = 20):
+        self.index = index
+        self.max_results = max_results
+
+    async def nearby(self, lat: float, lon: float, radius: int) -> List[Dict]:
+        return self.index.index.within(lat, lon, radius, self.max_results)
+
+    def nearest(self, lat: float, lon: float, n: int) -> List[Dict]:
+        return self.index.index.nearest(lat, lon, n)
+
+    async def aclose(self):
+        self.index.stop_watching()
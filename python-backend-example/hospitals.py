@@ -0,0 +1,273 @@
+# hospitals.py
+# Nearby-hospital lookup for /api/nearby-hospitals.
+#
+# Providers fetch hospitals around a point; the default talks to the Google
+# Places Nearby Search API over a pooled httpx.AsyncClient with timeouts and
+# retries. PLACES_BASE_URL can point it at stub_places_server.py (or any
+# compatible server) for tests and load runs.
+#
+# HospitalService quantizes the query to a geohash tile, asks the provider for
+# the tile centre and caches the answer per (tile, radius): fresh entries are
+# served directly, stale ones are served while a background refresh runs, and
+# concurrent misses for the same tile share one upstream call.
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_SECONDS = Histogram(
+    "healease_hospital_upstream_seconds", "Latency of hospital provider calls", ["provider", "outcome"]
+)
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+_GEOHASH_INDEX = {c: i for i, c in enumerate(_GEOHASH_ALPHABET)}
+
+
+def geohash_encode(lat: float, lon: float, precision: int) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def geohash_center(geohash: str) -> Tuple[float, float]:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for ch in geohash:
+        bits = _GEOHASH_INDEX[ch]
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (bits >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+class ProviderError(Exception):
+    """The provider answered, but with an error status or a malformed body"""
+
+
+class HospitalProvider:
+    """Interface for anything that can list hospitals around a point"""
+
+    name = "base"
+    # Remote providers benefit from the tile cache; local indexes answer exactly
+    cacheable = True
+
+    async def nearby(self, lat: float, lon: float, radius: int) -> List[Dict]:
+        raise NotImplementedError
+
+    async def aclose(self):
+        pass
+
+
+class PlacesProvider(HospitalProvider):
+    """Google Places Nearby Search (or a compatible stub) over a pooled async client"""
+
+    name = "places"
+    PATH = "/maps/api/place/nearbysearch/json"
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = "https://maps.googleapis.com",
+        timeout: float = 5.0,
+        retries: int = 2,
+        backoff: float = 0.2,
+        max_connections: int = 20,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(timeout, connect=min(timeout, 2.0))
+        self.retries = retries
+        self.backoff = backoff
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Connection pools belong to one event loop; rebuild if the loop changed
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=self.limits)
+            self._loop = loop
+        return self._client
+
+    async def nearby(self, lat: float, lon: float, radius: int) -> List[Dict]:
+        params = {"location": f"{lat},{lon}", "radius": radius, "type": "hospital", "key": self.api_key}
+        client = self._get_client()
+        for attempt in range(self.retries + 1):
+            try:
+                response = await client.get(self.PATH, params=params)
+                if response.status_code >= 500:
+                    raise httpx.HTTPStatusError("server error", request=response.request, response=response)
+                data = response.json()
+                break
+            except (httpx.TransportError, httpx.HTTPStatusError):
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+            except ValueError:
+                raise ProviderError(f"Places API returned a non-JSON response (HTTP {response.status_code})")
+
+        if not isinstance(data, dict):
+            raise ProviderError("Places API returned an unexpected response")
+        status = data.get("status", "OK")
+        if status not in ("OK", "ZERO_RESULTS"):
+            raise ProviderError(f"Places API returned {status}: {data.get('error_message', '')}")
+        results = data.get("results", [])
+        if not isinstance(results, list):
+            raise ProviderError("Places API returned results that are not a list")
+        return results
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class HospitalService:
+    """Geohash-tiled, stale-while-revalidate cache in front of a provider"""
+
+    def __init__(
+        self,
+        provider: HospitalProvider,
+        tile_precision: int = 6,
+        ttl_seconds: float = 3600.0,
+        stale_seconds: float = 86400.0,
+        max_tiles: int = 50000,
+    ):
+        self.provider = provider
+        self.tile_precision = tile_precision
+        self.ttl = ttl_seconds
+        self.stale = stale_seconds
+        self.max_tiles = max_tiles
+
+        # (tile, radius) -> (results, fetched_at)
+        self._tiles: "OrderedDict[Tuple[str, int], Tuple[List[Dict], float]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, int], asyncio.Task] = {}
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.upstream_errors = 0
+
+    def tile_key(self, lat: float, lon: float, radius: int) -> Tuple[str, int]:
+        return geohash_encode(lat, lon, self.tile_precision), radius
+
+    async def _call_provider(self, lat: float, lon: float, radius: int) -> List[Dict]:
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            results = await self.provider.nearby(lat, lon, radius)
+            outcome = "ok"
+            return results
+        finally:
+            UPSTREAM_SECONDS.labels(self.provider.name, outcome).observe(time.perf_counter() - start)
+
+    async def _fetch(self, key: Tuple[str, int]) -> List[Dict]:
+        tile, radius = key
+        lat, lon = geohash_center(tile)
+        results = await self._call_provider(lat, lon, radius)
+        self._tiles[key] = (results, time.time())
+        self._tiles.move_to_end(key)
+        while len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+        return results
+
+    def _fetch_once(self, key: Tuple[str, int]) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._fetch(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    def _refresh_in_background(self, key: Tuple[str, int]):
+        if key in self._inflight:
+            return
+        self.refreshes += 1
+        task = self._fetch_once(key)
+
+        def _log_failure(t: asyncio.Task):
+            if not t.cancelled() and t.exception() is not None:
+                self.upstream_errors += 1
+                logger.warning(f"Background refresh of hospital tile {key[0]} failed: {t.exception()}")
+
+        task.add_done_callback(_log_failure)
+
+    async def nearby(self, lat: float, lon: float, radius: int) -> List[Dict]:
+        if not self.provider.cacheable:
+            self.misses += 1
+            return await self._call_provider(lat, lon, radius)
+
+        key = self.tile_key(lat, lon, radius)
+        cached = self._tiles.get(key)
+        now = time.time()
+        if cached is not None:
+            results, fetched_at = cached
+            age = now - fetched_at
+            if age < self.ttl:
+                self.hits += 1
+                self._tiles.move_to_end(key)
+                return results
+            if age < self.ttl + self.stale:
+                self.stale_hits += 1
+                self._refresh_in_background(key)
+                return results
+
+        self.misses += 1
+        try:
+            return await asyncio.shield(self._fetch_once(key))
+        except ProviderError as e:
+            self.upstream_errors += 1
+            logger.warning(f"Hospital provider error: {str(e)}")
+            if cached is not None:
+                return cached[0]
+            # Not the same as an empty answer: the caller reports the failure
+            raise
+        except httpx.HTTPError:
+            self.upstream_errors += 1
+            if cached is not None:
+                return cached[0]
+            raise
+
+    async def aclose(self):
+        await self.provider.aclose()
+
+    def stats(self) -> Dict:
+        return {
+            "provider": self.provider.name,
+            "tile_precision": self.tile_precision,
+            "tiles": len(self._tiles),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "upstream_errors": self.upstream_errors,
+            "inflight": len(self._inflight),
+        }
@@ -0,0 +1,325 @@
+# inference_engine.py
+# Selectable CPU inference backends for the densenet169 skin-condition model.
+#
+# Backends:
+#   eager        - plain PyTorch eager mode (the original behaviour)
+#   torchscript  - traced + frozen TorchScript module (exported artifact, or traced at load)
+#   compile      - torch.compile of the eager model
+#   onnx         - ONNX Runtime on the exported fp32 graph
+#   int8-dynamic - PyTorch dynamic int8 quantization of the Linear layers
+#   onnx-int8    - ONNX Runtime on a statically quantized (QDQ) int8 graph
+#
+# Every engine takes a [B, 3, 224, 224] float tensor and returns [B, C]
+# probabilities, so callers never need to know which backend is active.
+# Artifacts are produced offline by export_model.py.
+#
+# SplitEngine runs the eager model as backbone and head separately, so the
+# pooled backbone features can be kept (see embedding_store.py) and scored
+# again by the small head without another backbone pass.
+import hashlib
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torchvision.models as models
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("eager", "torchscript", "compile", "onnx", "int8-dynamic", "onnx-int8")
+
+ARTIFACT_FILES = {
+    "torchscript": "densenet169.torchscript.pt",
+    "onnx": "densenet169.onnx",
+    "onnx-int8": "densenet169.int8.onnx",
+}
+
+INPUT_SHAPE = (3, 224, 224)
+
+# Width of densenet169's pooled features, the input to the classifier head
+BACKBONE_FEATURES = 1664
+
+
+def build_image_model(num_conditions: int, pretrained: bool = True) -> torch.nn.Module:
+    """densenet169 backbone with the skin-condition classifier head"""
+    weights = models.DenseNet169_Weights.IMAGENET1K_V1 if pretrained else None
+    model = models.densenet169(weights=weights)
+
+    # Modify for skin condition classification
+    model.classifier = build_classifier_head(num_conditions)
+    return model
+
+
+def build_classifier_head(num_conditions: int) -> torch.nn.Sequential:
+    return torch.nn.Sequential(
+        torch.nn.Linear(BACKBONE_FEATURES, 512),
+        torch.nn.ReLU(),
+        torch.nn.Dropout(0.2),
+        torch.nn.Linear(512, 256),
+        torch.nn.ReLU(),
+        torch.nn.Dropout(0.2),
+        torch.nn.Linear(256, num_conditions),
+        torch.nn.Softmax(dim=1)
+    )
+
+
+def load_classifier_head(path: str, num_conditions: int) -> torch.nn.Sequential:
+    """Classifier head from a full model state dict or a head-only one"""
+    state = torch.load(path, map_location="cpu", weights_only=True)
+    if any(key.startswith("classifier.") for key in state):
+        state = {key[len("classifier."):]: value for key, value in state.items() if key.startswith("classifier.")}
+    head = build_classifier_head(num_conditions)
+    head.load_state_dict(state)
+    return head.eval()
+
+
+def backbone_digest(model: torch.nn.Module) -> str:
+    """Hash of the backbone weights; stored features stay valid while it is unchanged"""
+    digest = hashlib.sha256()
+    for name, tensor in model.features.state_dict().items():
+        digest.update(name.encode("utf-8"))
+        digest.update(tensor.detach().contiguous().numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def load_finetuned_weights(model: torch.nn.Module, path: str) -> bool:
+    """Load fine-tuned weights into the model if the file exists"""
+    if not os.path.exists(path):
+        return False
+    model.load_state_dict(torch.load(path, map_location="cpu"))
+    return True
+
+
+class InferenceEngine:
+    """Common interface: a batch of normalized images in, class probabilities out"""
+
+    name = "base"
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        raise NotImplementedError
+
+
+class EagerEngine(InferenceEngine):
+    name = "eager"
+
+    def __init__(self, model: torch.nn.Module):
+        self.model = model.eval()
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        with torch.inference_mode():
+            return self.model(batch)
+
+
+class SplitEngine(InferenceEngine):
+    """Eager densenet169 run as backbone then head, exposing the pooled features"""
+
+    name = "eager-split"
+
+    def __init__(self, model: torch.nn.Module):
+        model = model.eval()
+        # Same ops as DenseNet.forward up to the classifier
+        self.backbone = torch.nn.Sequential(
+            model.features, torch.nn.ReLU(), torch.nn.AdaptiveAvgPool2d((1, 1)), torch.nn.Flatten(1)
+        ).eval()
+        self.head = model.classifier
+
+    def forward_features(self, batch: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """(probabilities, pooled backbone features) for a batch"""
+        with torch.inference_mode():
+            features = self.backbone(batch)
+            return self.head(features), features
+
+    def score_features(self, features: torch.Tensor) -> torch.Tensor:
+        with torch.inference_mode():
+            return self.head(features)
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        return self.forward_features(batch)[0]
+
+
+class TorchScriptEngine(InferenceEngine):
+    name = "torchscript"
+
+    def __init__(self, module: torch.jit.ScriptModule):
+        # CPU-specific fusions are applied at load time; they do not survive serialization
+        self.module = torch.jit.optimize_for_inference(module)
+
+    @classmethod
+    def from_file(cls, path: str) -> "TorchScriptEngine":
+        return cls(torch.jit.load(path, map_location="cpu"))
+
+    @classmethod
+    def from_model(cls, model: torch.nn.Module) -> "TorchScriptEngine":
+        return cls(trace_model(model))
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        with torch.inference_mode():
+            return self.module(batch)
+
+
+class CompiledEngine(EagerEngine):
+    name = "compile"
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__(torch.compile(model.eval(), dynamic=True))
+
+
+class DynamicInt8Engine(EagerEngine):
+    name = "int8-dynamic"
+
+    def __init__(self, model: torch.nn.Module):
+        quantized = torch.ao.quantization.quantize_dynamic(
+            model.eval(), {torch.nn.Linear}, dtype=torch.qint8
+        )
+        super().__init__(quantized)
+
+
+class OnnxEngine(InferenceEngine):
+    name = "onnx"
+
+    def __init__(self, path: str, num_threads: Optional[int] = None, name: Optional[str] = None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        if name:
+            self.name = name
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        inputs = np.ascontiguousarray(batch.detach().numpy(), dtype=np.float32)
+        outputs = self.session.run(None, {self.input_name: inputs})[0]
+        return torch.from_numpy(outputs)
+
+
+def trace_model(model: torch.nn.Module) -> torch.jit.ScriptModule:
+    """Trace and freeze the model so weights become constants"""
+    example = torch.zeros(1, *INPUT_SHAPE)
+    with torch.no_grad():
+        traced = torch.jit.trace(model.eval(), example)
+    return torch.jit.freeze(traced)
+
+
+def create_engine(
+    backend: str,
+    model: Optional[torch.nn.Module],
+    artifact_dir: str,
+    num_threads: Optional[int] = None,
+) -> InferenceEngine:
+    """Build the engine for a backend, loading exported artifacts from artifact_dir"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}'. Choose one of: {', '.join(BACKENDS)}")
+
+    artifact = os.path.join(artifact_dir, ARTIFACT_FILES[backend]) if backend in ARTIFACT_FILES else None
+
+    if backend == "torchscript":
+        if os.path.exists(artifact):
+            return TorchScriptEngine.from_file(artifact)
+        if model is None:
+            raise FileNotFoundError(artifact)
+        logger.warning(f"{artifact} not found, tracing the model at load time")
+        return TorchScriptEngine.from_model(model)
+    if backend in ("onnx", "onnx-int8"):
+        if not os.path.exists(artifact):
+            raise FileNotFoundError(f"{artifact} not found; run export_model.py first")
+        return OnnxEngine(artifact, num_threads, name=backend)
+
+    if model is None:
+        raise ValueError(f"Backend '{backend}' needs the eager model")
+    if backend == "compile":
+        return CompiledEngine(model)
+    if backend == "int8-dynamic":
+        return DynamicInt8Engine(model)
+    return EagerEngine(model)
+
+
+def export_torchscript(model: torch.nn.Module, path: str):
+    torch.jit.save(trace_model(model), path)
+
+
+def export_onnx(model: torch.nn.Module, path: str, opset: int = 17):
+    example = torch.zeros(1, *INPUT_SHAPE)
+    torch.onnx.export(
+        model.eval(),
+        (example,),
+        path,
+        input_names=["image"],
+        output_names=["probabilities"],
+        dynamic_axes={"image": {0: "batch"}, "probabilities": {0: "batch"}},
+        opset_version=opset,
+        dynamo=False,
+    )
+
+
+def quantize_onnx_static(fp32_path: str, int8_path: str, calibration_batches: Iterable[torch.Tensor]):
+    """Statically quantize an exported ONNX graph to int8 (QDQ) using calibration images"""
+    from onnxruntime.quantization import (
+        CalibrationDataReader, QuantFormat, QuantType, quantize_static,
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    # Shape inference + graph optimization first, as recommended by ONNX Runtime
+    prepared_path = int8_path + ".prep.onnx"
+    quant_pre_process(fp32_path, prepared_path)
+
+    class _Reader(CalibrationDataReader):
+        def __init__(self, batches):
+            self._batches = iter([{"image": b.numpy().astype(np.float32)} for b in batches])
+
+        def get_next(self):
+            return next(self._batches, None)
+
+    quantize_static(
+        prepared_path,
+        int8_path,
+        _Reader(calibration_batches),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+    os.remove(prepared_path)
+
+
+def parity_report(
+    reference: InferenceEngine,
+    engines: Sequence[InferenceEngine],
+    inputs: torch.Tensor,
+    k: int = 3,
+    batch_size: int = 8,
+) -> Dict[str, Dict]:
+    """Top-k agreement and per-image latency of each engine against the reference (eager) engine"""
+
+    def run(engine: InferenceEngine):
+        engine(inputs[:1])  # warm-up
+        outputs: List[torch.Tensor] = []
+        started = time.perf_counter()
+        for i in range(0, len(inputs), batch_size):
+            outputs.append(engine(inputs[i:i + batch_size]).float())
+        elapsed = time.perf_counter() - started
+        return torch.cat(outputs), elapsed / len(inputs) * 1000.0
+
+    ref_out, ref_ms = run(reference)
+    ref_topk = torch.topk(ref_out, k, dim=1).indices
+
+    report = {reference.name: {"latency_ms_per_image": ref_ms, "speedup": 1.0}}
+    for engine in engines:
+        out, ms = run(engine)
+        topk = torch.topk(out, k, dim=1).indices
+        overlap = [
+            len(set(a.tolist()) & set(b.tolist())) / k for a, b in zip(ref_topk, topk)
+        ]
+        report[engine.name] = {
+            "top1_agreement": float((ref_topk[:, 0] == topk[:, 0]).float().mean()),
+            f"top{k}_exact_agreement": float((ref_topk == topk).all(dim=1).float().mean()),
+            f"top{k}_overlap": float(np.mean(overlap)),
+            "max_abs_prob_diff": float((ref_out - out).abs().max()),
+            "latency_ms_per_image": ms,
+            "speedup": ref_ms / ms if ms else 0.0,
+        }
+    return report
@@ -0,0 +1,389 @@
+# jobs.py
+# In-process job queue for asynchronous image analysis.
+#
+# submit() stores a job and returns at once; a bounded set of worker tasks
+# drains a priority queue and runs the job's payload through the processing
+# coroutine. Clients poll a job, or subscribe to its status changes for
+# server-sent events. Finished jobs are kept for a TTL. When the queue is full,
+# submit() raises QueueFull with a Retry-After estimate based on how fast jobs
+# have recently been completing.
+#
+# With a SQLiteJobStore, jobs and results are written through to a local
+# database. Queued work survives a restart, and a job submitted to one worker
+# process can be polled from another.
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+TERMINAL = (DONE, FAILED)
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+class Job:
+    __slots__ = (
+        "id", "priority", "status", "payload", "result", "error", "error_status",
+        "submitted_at", "started_at", "finished_at", "changed",
+    )
+
+    def __init__(self, job_id: str, payload: Optional[bytes], priority: int = 1):
+        self.id = job_id
+        self.priority = priority
+        self.status = QUEUED
+        self.payload = payload
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.error_status: Optional[int] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # Set and replaced on every status change, for subscribers
+        self.changed: Optional[asyncio.Event] = None
+
+    def view(self) -> Dict:
+        data = {
+            "jobId": self.id,
+            "status": self.status,
+            "priority": next((k for k, v in PRIORITIES.items() if v == self.priority), str(self.priority)),
+            "submittedAt": self.submitted_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+        }
+        if self.status == DONE:
+            # Results may be pre-encoded JSON (see response_fragments.py)
+            data["result"] = json.loads(self.result) if isinstance(self.result, (bytes, bytearray)) else self.result
+        elif self.status == FAILED:
+            data["error"] = {"message": self.error, "status": self.error_status}
+        return data
+
+
+class SQLiteJobStore:
+    """Write-through persistence for jobs; all access goes through one thread"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = os.getpid()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, owner INTEGER, priority INTEGER, status TEXT, payload BLOB,"
+                " result TEXT, error TEXT, error_status INTEGER, submitted_at REAL, started_at REAL,"
+                " finished_at REAL, expires_at REAL)"
+            )
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    async def _run(self, fn, *args):
+        if self._executor_pid != os.getpid():
+            # Threads do not survive fork; each process gets its own writer thread
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+            self._executor_pid = os.getpid()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _save(self, job: Job, expires_at: Optional[float]):
+        db = self._db()
+        db.execute(
+            "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                job.id, os.getpid(), job.priority, job.status,
+                job.payload if job.status not in TERMINAL else None,
+                (job.result.decode("utf-8") if isinstance(job.result, (bytes, bytearray)) else json.dumps(job.result))
+                if job.status == DONE else None,
+                job.error, job.error_status, job.submitted_at, job.started_at, job.finished_at, expires_at,
+            ),
+        )
+        db.commit()
+
+    async def save(self, job: Job, expires_at: Optional[float] = None):
+        await self._run(self._save, job, expires_at)
+
+    @staticmethod
+    def _from_row(row) -> Job:
+        job_id, _, priority, status, payload, result, error, error_status, submitted, started, finished, _ = row
+        job = Job(job_id, payload, priority)
+        job.status = status
+        job.result = json.loads(result) if result is not None else None
+        job.error, job.error_status = error, error_status
+        job.submitted_at, job.started_at, job.finished_at = submitted, started, finished
+        return job
+
+    def _fetch(self, job_id: str) -> Optional[Job]:
+        row = self._db().execute(
+            "SELECT * FROM jobs WHERE id = ? AND (expires_at IS NULL OR expires_at > ?)", (job_id, time.time())
+        ).fetchone()
+        return self._from_row(row) if row else None
+
+    async def fetch(self, job_id: str) -> Optional[Job]:
+        return await self._run(self._fetch, job_id)
+
+    def _claim_orphans(self) -> List[Job]:
+        """Take over unfinished jobs whose owning process is gone, and drop expired ones"""
+        db = self._db()
+        db.execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        claimed = []
+        for row in db.execute("SELECT * FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchall():
+            owner = row[1]
+            if owner != os.getpid() and _process_alive(owner):
+                continue
+            job = self._from_row(row)
+            job.status, job.started_at = QUEUED, None
+            db.execute("UPDATE jobs SET owner = ?, status = ? WHERE id = ? AND owner = ?",
+                       (os.getpid(), QUEUED, job.id, owner))
+            claimed.append(job)
+        db.commit()
+        return claimed
+
+    async def claim_orphans(self) -> List[Job]:
+        return await self._run(self._claim_orphans)
+
+    def _purge(self):
+        db = self._db()
+        db.execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        db.commit()
+
+    async def purge(self):
+        await self._run(self._purge)
+
+
+def _process_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """Bounded priority queue of jobs drained by a fixed number of worker tasks"""
+
+    def __init__(
+        self,
+        process: Callable[[bytes], Awaitable[Any]],
+        workers: int = 2,
+        max_queued: int = 100,
+        result_ttl: float = 600.0,
+        store: Optional[SQLiteJobStore] = None,
+    ):
+        self.process = process
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.store = store
+
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._seq = 0
+        self._last_purge = 0.0
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.running = 0
+        # Exponentially weighted seconds per job, for Retry-After estimates
+        self.avg_service_time = 1.0
+
+    async def _ensure_started(self):
+        # Worker tasks belong to one event loop; (re)start them on the current one
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._tasks:
+            return
+        self._loop = loop
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        for job in self._jobs.values():
+            if job.status == QUEUED:
+                self._enqueue(job)
+        if self.store is not None:
+            for job in await self.store.claim_orphans():
+                if job.id not in self._jobs:
+                    self._jobs[job.id] = job
+                    self._enqueue(job)
+                    logger.info(f"Resumed job {job.id}")
+
+    def _enqueue(self, job: Job):
+        self._seq += 1
+        self._queue.put_nowait((job.priority, self._seq, job.id))
+
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def retry_after(self) -> int:
+        backlog = self.queued() + self.running
+        return max(1, int(backlog * self.avg_service_time / self.workers + 0.999))
+
+    def _notify(self, job: Job):
+        if job.changed is not None:
+            job.changed.set()
+            job.changed = None
+
+    async def _persist(self, job: Job):
+        if self.store is None:
+            return
+        expires_at = job.finished_at + self.result_ttl if job.status in TERMINAL else None
+        try:
+            await self.store.save(job, expires_at)
+        except sqlite3.Error as e:
+            logger.error(f"Could not persist job {job.id}: {str(e)}")
+
+    async def submit(self, payload: bytes, priority: int = PRIORITIES["normal"]) -> Job:
+        await self._ensure_started()
+        self._purge_expired()
+        if self.queued() >= self.max_queued:
+            self.rejected += 1
+            raise QueueFull(self.retry_after())
+        job = Job(uuid.uuid4().hex, payload, priority)
+        self._jobs[job.id] = job
+        await self._persist(job)
+        self._enqueue(job)
+        self.submitted += 1
+        return job
+
+    async def _worker(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None or job.status != QUEUED:
+                continue
+            job.status, job.started_at = RUNNING, time.time()
+            self._notify(job)
+            self.running += 1
+            started = time.perf_counter()
+            try:
+                job.result = await self.process(job.payload)
+                job.status = DONE
+                self.completed += 1
+            except asyncio.CancelledError:
+                job.status, job.started_at = QUEUED, None
+                raise
+            except Exception as e:
+                job.status = FAILED
+                job.error = str(e)
+                job.error_status = getattr(e, "status_code", 500)
+                self.failed += 1
+            finally:
+                self.running -= 1
+                elapsed = time.perf_counter() - started
+                self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * elapsed
+            job.finished_at = time.time()
+            job.payload = None
+            self._notify(job)
+            await self._persist(job)
+
+    def _purge_expired(self):
+        now = time.time()
+        if now - self._last_purge < 5.0:
+            return
+        self._last_purge = now
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.status in TERMINAL and job.finished_at + self.result_ttl <= now
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if self.store is not None:
+            asyncio.get_running_loop().create_task(self.store.purge())
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        self._purge_expired()
+        job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            # Possibly submitted to another worker process
+            job = await self.store.fetch(job_id)
+        return job
+
+    async def updates(self, job_id: str, heartbeat: float = 15.0,
+                      poll_interval: float = 0.5) -> AsyncIterator[Optional[Dict]]:
+        """Yield the job's view on every status change until it finishes; None is a heartbeat"""
+        last_status = None
+        last_sent = time.monotonic()
+        while True:
+            job = self._jobs.get(job_id)
+            local = job is not None
+            if local:
+                # Grab the event before looking at the status so a change made
+                # while the consumer handles our yield is not missed
+                if job.changed is None:
+                    job.changed = asyncio.Event()
+                changed = job.changed
+            else:
+                job = await self.get(job_id)
+                if job is None:
+                    return
+            if job.status != last_status:
+                last_status = job.status
+                last_sent = time.monotonic()
+                yield job.view()
+                if job.status in TERMINAL:
+                    return
+            elif time.monotonic() - last_sent >= heartbeat:
+                last_sent = time.monotonic()
+                yield None
+
+            if local:
+                try:
+                    await asyncio.wait_for(changed.wait(), heartbeat)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(poll_interval)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "max_queued": self.max_queued,
+            "queued": self.queued(),
+            "running": self.running,
+            "retained": len(self._jobs),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_service_seconds": self.avg_service_time,
+            "persistent": self.store is not None,
+        }
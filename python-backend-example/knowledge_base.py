@@ -0,0 +1,177 @@
+# knowledge_base.py
+# Hot-reloadable medical knowledge base.
+#
+# A KnowledgeBase is a snapshot of medical_conditions.json, the symptom
+# training phrases (symptom_training_data.json) and everything derived from
+# them: the symptom scoring index, the pre-encoded response fragments and the
+# TF-IDF classifier. KnowledgeBaseManager builds a new snapshot off the request
+# path when the files change (polled) or when asked to, and swaps it in with a
+# single reference assignment. Handlers read `manager.current` once per
+# request, so in-flight requests finish on the snapshot they started with.
+#
+# The version is a hash of both files' contents. It is part of the result
+# cache keys and is reported in the X-Knowledge-Version header and /metrics.
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class KnowledgeBaseError(Exception):
+    """The knowledge base files are invalid, or the change cannot be applied without a restart"""
+
+
+def load_training_data(path: str) -> List[Tuple[str, str]]:
+    """(text, condition) pairs from a {condition: [phrases]} JSON file, in file order"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise KnowledgeBaseError(f"{path} must map condition names to lists of phrases")
+    pairs = []
+    for condition, phrases in data.items():
+        if not isinstance(phrases, list) or not all(isinstance(p, str) for p in phrases):
+            raise KnowledgeBaseError(f"{path}: phrases for {condition!r} must be a list of strings")
+        pairs.extend((phrase, condition) for phrase in phrases)
+    if not pairs:
+        raise KnowledgeBaseError(f"{path} has no training phrases")
+    return pairs
+
+
+class KnowledgeBase:
+    """One consistent version of the conditions, training data and derived structures"""
+
+    def __init__(self, version: str, conditions: Dict, training_data: List[Tuple[str, str]],
+                 scorer, fragments, classifier=None):
+        self.version = version
+        self.conditions = conditions
+        self.skin_conditions: List[str] = conditions.get("skin_conditions", [])
+        self.training_data = training_data
+        self.scorer = scorer
+        self.fragments = fragments
+        # Filled in once by the model loader for the first snapshot; reloads train their own
+        self.classifier = classifier
+        self.loaded_at = time.time()
+
+
+# build(conditions, training_data, version, previous) -> KnowledgeBase
+Builder = Callable[[Dict, List[Tuple[str, str]], str, Optional[KnowledgeBase]], KnowledgeBase]
+
+
+class KnowledgeBaseManager:
+    """Holds the current KnowledgeBase and replaces it when its files change"""
+
+    def __init__(self, conditions_path: str, training_path: str, build: Builder, poll_seconds: float = 0.0):
+        self.conditions_path = conditions_path
+        self.training_path = training_path
+        self.build = build
+        self.poll_seconds = poll_seconds
+        self.reloads = 0
+        self.reload_errors = 0
+        self.last_error: Optional[str] = None
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._mtimes = self._file_mtimes()
+        version, conditions, training_data = self._read()
+        self.current: KnowledgeBase = build(conditions, training_data, version, None)
+        logger.info(f"Loaded knowledge base {version}")
+
+    def _file_mtimes(self) -> Tuple[float, float]:
+        return os.path.getmtime(self.conditions_path), os.path.getmtime(self.training_path)
+
+    def _read(self) -> Tuple[str, Dict, List[Tuple[str, str]]]:
+        digest = hashlib.sha256()
+        for path in (self.conditions_path, self.training_path):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+            digest.update(b"\0")
+        try:
+            with open(self.conditions_path, encoding="utf-8") as f:
+                conditions = json.load(f)
+            training_data = load_training_data(self.training_path)
+        except ValueError as e:
+            raise KnowledgeBaseError(str(e)) from e
+        if not isinstance(conditions, dict) or not isinstance(conditions.get("skin_conditions"), list):
+            raise KnowledgeBaseError(f"{self.conditions_path} must have a skin_conditions list")
+        return digest.hexdigest()[:12], conditions, training_data
+
+    def reload(self, force: bool = False) -> bool:
+        """Rebuild from the files and swap in the result; False if nothing changed.
+
+        Raises KnowledgeBaseError (or the builder's exception) and keeps the
+        current snapshot if the new files cannot be used.
+        """
+        with self._reload_lock:
+            mtimes = self._mtimes
+            try:
+                mtimes = self._file_mtimes()
+                version, conditions, training_data = self._read()
+                if version == self.current.version and not force:
+                    self._mtimes = mtimes
+                    return False
+                started = time.perf_counter()
+                knowledge = self.build(conditions, training_data, version, self.current)
+            except Exception as e:
+                self.reload_errors += 1
+                self.last_error = str(e)
+                # Do not retry the same broken files on every poll
+                self._mtimes = mtimes
+                logger.error(f"Failed to reload knowledge base: {str(e)}")
+                raise
+            previous = self.current.version
+            # Single reference swap: a request sees either the old or the new snapshot
+            self.current = knowledge
+            self._mtimes = mtimes
+            self.reloads += 1
+            self.last_error = None
+            logger.info(
+                f"Reloaded knowledge base {previous} -> {version} in {time.perf_counter() - started:.2f}s"
+            )
+            return True
+
+    def set_classifier(self, version: str, classifier: Any):
+        """Attach a classifier loaded outside the manager, if that version is still current"""
+        with self._reload_lock:
+            if self.current.version == version and self.current.classifier is None:
+                self.current.classifier = classifier
+
+    def reload_if_changed(self) -> bool:
+        try:
+            if self._file_mtimes() == self._mtimes:
+                return False
+            return self.reload()
+        except Exception:
+            # Already logged and counted by reload(); keep serving the current version
+            return False
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_seconds):
+            self.reload_if_changed()
+
+    def start_watching(self):
+        if self.poll_seconds > 0 and (self._thread is None or not self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="knowledge-base-watch", daemon=True)
+            self._thread.start()
+
+    def stop_watching(self):
+        self._stop.set()
+
+    def stats(self) -> Dict:
+        current = self.current
+        return {
+            "version": current.version,
+            "loaded_at": current.loaded_at,
+            "conditions": len(current.skin_conditions),
+            "training_phrases": len(current.training_data),
+            "classifier_loaded": current.classifier is not None,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+            "last_error": self.last_error,
+            "watching": self.poll_seconds > 0,
+        }
@@ -89,103 +89,84 @@
 # requests
 
 # main.py (FastAPI backend)
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from PIL import Image
 import torch
-import torchvision.models as models
-from torchvision import transforms
-import requests
-import io
+import httpx
+import asyncio
+import contextlib
+import hashlib
+import hmac
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Optional
 import json
 import os
+import time
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.pipeline import Pipeline
-import re
 import logging
+from symptom_scoring import SymptomScorer
+from symptom_engines import ENGINES, NaiveBayesScorer, create_symptom_engine
+from batching import MicroBatcher
+from executors import ExecutionLayer
+from image_preprocess import (
+    DESCRIPTOR_DIM, IMAGE_TRANSFORM, ImageRejected, TensorBufferPool, preprocess_image_described,
+    preprocess_image_timed,
+)
+from upload_limits import UploadLimitMiddleware, UploadTooLarge, read_upload
+from profiling import FORMATS, KINDS as PROFILE_KINDS, CaptureBusy, ProfileManager, ProfilingMiddleware
+from admission import AdmissionLimiter, AdmissionMiddleware, DeadlineExceeded, check_deadline, current_deadline
+from result_cache import ResultCache, content_key
+from response_fragments import RawJSONResponse, ResponseFragments, append_field, dumps as encode_json
+from knowledge_base import KnowledgeBase, KnowledgeBaseError, KnowledgeBaseManager
+from similar_cases import SimilarCaseIndex
+from embedding_store import EmbeddingStore
+from cascade import THRESHOLDS_FILE, CascadeEngine, create_cascade, load_thresholds
+from jobs import PRIORITIES, JobQueue, QueueFull, SQLiteJobStore
+from hospitals import HospitalService, PlacesProvider, ProviderError
+from hospital_index import OfflineHospitalProvider, ReloadingHospitalIndex
+from inference_engine import (
+    BACKBONE_FEATURES, EagerEngine, SplitEngine, backbone_digest, build_image_model, create_engine,
+    load_finetuned_weights,
+)
+from model_bundle import bundle_exists, cached_symptom_classifier, load_image_model, load_symptom_classifier
+from model_registry import ModelRegistry
+from structured_logging import configure_logging, dropped_records, log_event
+from metrics import CONTENT_TYPE, REGISTRY, Counter, Histogram, MetricsMiddleware, StageTimer
 
-logging.basicConfig(level=logging.INFO)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# Load medical condition mappings
-with open(os.path.join(os.path.dirname(__file__), 'medical_conditions.json'), 'r') as f:
-    MEDICAL_CONDITIONS = json.load(f)
+# Thread/process pools that keep decode, inference and outbound HTTP off the event loop
+execution = ExecutionLayer.from_env()
+execution.configure_torch()
 
-# Training data for symptom analysis
-SYMPTOM_TRAINING_DATA = [
-    # Acne symptoms
-    ("red pimples and inflammation on face, oily skin with breakouts", "Acne"),
-    ("cystic acne with painful bumps, oily skin and blackheads", "Acne"),
-    ("severe acne with scarring, frequent breakouts on face and back", "Acne"),
-    
-    # Eczema symptoms
-    ("dry itchy skin with red patches, gets worse with stress", "Eczema"),
-    ("inflamed skin that burns and itches, chronic dry patches", "Eczema"),
-    ("severe itching with scaly skin, red inflamed areas that worsen at night", "Eczema"),
-    
-    # Psoriasis symptoms
-    ("thick red patches with silvery scales, itchy and painful skin", "Psoriasis"),
-    ("scaly plaques on elbows and knees, skin that cracks and bleeds", "Psoriasis"),
-    ("red inflamed patches with scaling, joint pain and stiffness", "Psoriasis"),
-    
-    # Contact Dermatitis symptoms
-    ("skin rash after contact with allergen, burning and itching", "Contact Dermatitis"),
-    ("red irritated skin from new soap, immediate reaction to product", "Contact Dermatitis"),
-    ("blistering rash with intense itching, skin reaction to jewelry", "Contact Dermatitis"),
-    
-    # Fungal Infection symptoms
-    ("itchy red rash that spreads in circular pattern", "Fungal Infection"),
-    ("scaly patches with intense itching between toes", "Fungal Infection"),
-    ("ring-shaped rash that spreads, red and scaly skin infection", "Fungal Infection"),
-    
-    # Rosacea symptoms
-    ("facial redness with visible blood vessels, sensitive skin", "Rosacea"),
-    ("flushing and redness on cheeks, bumps that look like acne", "Rosacea"),
-    ("persistent facial redness, skin that burns and stings", "Rosacea"),
-    
-    # Melanoma symptoms
-    ("dark mole that changed color, irregular borders on skin growth", "Melanoma"),
-    ("growing skin lesion with multiple colors, bleeding mole", "Melanoma"),
-    ("asymmetrical mole that's changing, dark spot getting larger", "Melanoma"),
-    
-    # Urticaria symptoms
-    ("sudden appearance of itchy welts, hives all over body", "Urticaria"),
-    ("raised red welts that come and go, severe itching with swelling", "Urticaria"),
-    ("allergic reaction with widespread hives, itchy skin rash", "Urticaria"),
-    
-    # Vitiligo symptoms
-    ("white patches of skin appearing, loss of skin color in spots", "Vitiligo"),
-    ("progressive loss of skin pigment, white patches spreading", "Vitiligo"),
-    ("patchy loss of skin color, premature whitening of hair", "Vitiligo"),
-    
-    # Impetigo symptoms
-    ("red sores that burst and crust, highly contagious rash", "Impetigo"),
-    ("honey-colored crusts on skin, spreading sores on face", "Impetigo"),
-    ("blistering skin infection, itchy red sores that ooze", "Impetigo"),
-    
-    # Cellulitis symptoms
-    ("red swollen skin that's warm to touch, spreading infection", "Cellulitis"),
-    ("tender red area that spreads quickly, fever with skin infection", "Cellulitis"),
-    ("painful red inflammation, skin that feels hot and tight", "Cellulitis"),
-    
-    # Scabies symptoms
-    ("intense itching that gets worse at night, tiny blisters", "Scabies"),
-    ("severe itching with small red bumps, burrow tracks in skin", "Scabies"),
-    ("itchy rash between fingers, red bumps in skin folds", "Scabies"),
-    
-    # Warts symptoms
-    ("raised rough growths on skin, painless bumps that spread", "Warts"),
-    ("small flesh-colored bumps, rough textured skin growths", "Warts"),
-    ("clusters of small raised growths, viral skin infection", "Warts")
+# Medical knowledge base: conditions, descriptions and recommendations, plus the
+# phrases the symptom models are trained on. Both files are reloaded without a
+# restart (see knowledge_base.py): polled every KNOWLEDGE_POLL_SECONDS, or on
+# POST /admin/knowledge/reload.
+MEDICAL_CONDITIONS_PATH = os.environ.get(
+    "MEDICAL_CONDITIONS_PATH", os.path.join(os.path.dirname(__file__), 'medical_conditions.json')
+)
+SYMPTOM_TRAINING_DATA_PATH = os.environ.get(
+    "SYMPTOM_TRAINING_DATA_PATH", os.path.join(os.path.dirname(__file__), 'symptom_training_data.json')
+)
+KNOWLEDGE_POLL_SECONDS = float(os.environ.get("KNOWLEDGE_POLL_SECONDS", "30"))
 
-]
+# Symptom scoring engine used when a request does not pick one: keyword, tfidf_nb or hybrid
+SYMPTOM_ENGINE = os.environ.get("SYMPTOM_ENGINE", "keyword")
+HYBRID_KEYWORD_WEIGHT = float(os.environ.get("HYBRID_KEYWORD_WEIGHT", "0.5"))
+# Classifiers trained outside a bundle are saved here, keyed by their training
+# data, and memory-mapped on the next start instead of being retrained
+SYMPTOM_CLASSIFIER_CACHE_DIR = os.environ.get(
+    "SYMPTOM_CLASSIFIER_CACHE_DIR", os.path.join(os.path.dirname(__file__), 'model_cache')
+)
 
 # Initialize and train the symptom classifier
-def initialize_symptom_classifier():
+def initialize_symptom_classifier(training_data: List[tuple]):
     # Create a pipeline with TF-IDF vectorizer and Naive Bayes classifier
     classifier = Pipeline([
         ('tfidf', TfidfVectorizer(ngram_range=(1, 2))),
@@ -193,16 +174,46 @@ def initialize_symptom_classifier():
     ])
     
     # Prepare training data
-    X = [text for text, label in SYMPTOM_TRAINING_DATA]
-    y = [label for text, label in SYMPTOM_TRAINING_DATA]
+    X = [text for text, label in training_data]
+    y = [label for text, label in training_data]
     
     # Train the classifier
     classifier.fit(X, y)
     logger.info("Symptom classifier trained successfully")
     return classifier
 
-# Initialize the classifier
-symptom_classifier = initialize_symptom_classifier()
+def train_symptom_classifier(training_data: List[tuple]):
+    if SYMPTOM_CLASSIFIER_CACHE_DIR:
+        return cached_symptom_classifier(SYMPTOM_CLASSIFIER_CACHE_DIR, training_data, initialize_symptom_classifier)
+    return initialize_symptom_classifier(training_data)
+
+# Keywords for each condition based on descriptions
+CONDITION_KEYWORDS = {
+    "Acne": ["pimples", "inflammation", "red", "oily", "spots", "breakout"],
+    "Eczema": ["dry", "itchy", "patches", "inflammation", "chronic", "red", "stress"],
+    "Psoriasis": ["red", "scaly", "patches", "autoimmune", "thick", "chronic"],
+    "Contact Dermatitis": ["inflammation", "irritants", "allergic", "triggers", "burning", "rash"],
+    "Fungal Infection": ["infection", "fungal", "itchy", "spreading", "rash"],
+    "Rosacea": ["facial", "redness", "bumps", "flushing", "chronic"],
+    "Melanoma": ["cancer", "skin cancer", "serious", "dark", "changing", "mole"],
+    "Basal Cell Carcinoma": ["cancer", "growth", "lesion", "skin cancer"],
+    "Urticaria": ["hives", "allergic", "itchy", "welts", "swelling"],
+    "Vitiligo": ["pigmentation", "white patches", "loss of color", "skin color"],
+    "Impetigo": ["bacterial", "infection", "sores", "crusting", "contagious"],
+    "Shingles": ["painful", "blisters", "rash", "burning", "nerve pain"],
+    "Cellulitis": ["bacterial", "infection", "red", "swollen", "warm", "tender"],
+    "Scabies": ["itchy", "rash", "burrows", "intense itching", "night", "parasites"],
+    "Warts": ["growth", "viral", "rough", "bump", "raised"]
+}
+
+# Words that boost every condition's score when present
+SEVERITY_WORDS = ["severe", "intense", "extreme", "very", "lot", "constant", "chronic", "unbearable"]
+
+# Location matching (if mentioned in symptoms)
+BODY_PARTS = ["face", "arms", "legs", "back", "chest", "neck", "hands", "feet", "scalp"]
+
+# Words that raise the overall severity of a symptom report
+SEVERITY_INDICATORS = ["severe", "intense", "extreme", "unbearable", "pain", "bleeding", "infection"]
 
 # Training data for image analysis - visual characteristics of each condition
 IMAGE_TRAINING_DATA = {
@@ -244,47 +255,202 @@ IMAGE_TRAINING_DATA = {
     }
 }
 
-def initialize_image_analyzer():
-    # Load pre-trained model
-    model = models.densenet169(pretrained=True)
-    
-    # Modify for skin condition classification
-    num_conditions = len(MEDICAL_CONDITIONS['skin_conditions'])
-    model.classifier = torch.nn.Sequential(
-        torch.nn.Linear(1664, 512),
-        torch.nn.ReLU(),
-        torch.nn.Dropout(0.2),
-        torch.nn.Linear(512, 256),
-        torch.nn.ReLU(),
-        torch.nn.Dropout(0.2),
-        torch.nn.Linear(256, num_conditions),
-        torch.nn.Softmax(dim=1)
+def build_knowledge_base(conditions: Dict, training_data: List[tuple], version: str,
+                         previous: Optional[KnowledgeBase]) -> KnowledgeBase:
+    """Compile everything derived from the knowledge base files into a new snapshot"""
+    if previous is not None and conditions["skin_conditions"] != previous.skin_conditions:
+        # The image model's outputs are indexed by this list
+        raise KnowledgeBaseError(
+            "skin_conditions changed; rebuild the image model bundle and restart to apply it"
+        )
+    # Symptom-scoring index, built once per version instead of on every request
+    scorer = SymptomScorer(
+        conditions.get("skin_conditions", []),
+        CONDITION_KEYWORDS,
+        training_data,
+        SEVERITY_WORDS,
+        BODY_PARTS,
+        SEVERITY_INDICATORS,
     )
-    
-    # Set up image transformations
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ])
-    
-    return model, transform
+    # Static parts of every condition's response entry, encoded once
+    fragments = ResponseFragments(conditions, IMAGE_TRAINING_DATA)
+    classifier = None
+    if previous is not None:
+        if training_data == previous.training_data and previous.classifier is not None:
+            classifier = previous.classifier
+        else:
+            classifier = NaiveBayesScorer(train_symptom_classifier(training_data))
+    return KnowledgeBase(version, conditions, training_data, scorer, fragments, classifier)
+
+knowledge = KnowledgeBaseManager(
+    MEDICAL_CONDITIONS_PATH, SYMPTOM_TRAINING_DATA_PATH, build_knowledge_base, poll_seconds=KNOWLEDGE_POLL_SECONDS
+)
+
+def initialize_image_analyzer():
+    # Load pre-trained model with the skin condition classifier head
+    num_conditions = len(knowledge.current.skin_conditions)
+    return build_image_model(num_conditions, pretrained=True)
+
+# Heavy models load from a pre-built bundle (see build_bundle.py) when one is
+# present, otherwise through the original train/download path.
+#   MODEL_LOADING=eager       load everything while importing
+#   MODEL_LOADING=background  start loading when the server starts (default)
+#   MODEL_LOADING=lazy        load on first use
+MODEL_BUNDLE_DIR = os.environ.get("MODEL_BUNDLE_DIR", os.path.join(os.path.dirname(__file__), "model_bundle"))
+MODEL_LOADING = os.environ.get("MODEL_LOADING", "background")
+MODEL_WAIT_SECONDS = float(os.environ.get("MODEL_WAIT_SECONDS", "30"))
+
+# Inference backend: eager by default, or an artifact produced by export_model.py
+IMAGE_BACKEND = os.environ.get("IMAGE_BACKEND", "eager")
+IMAGE_ARTIFACT_DIR = os.environ.get("IMAGE_ARTIFACT_DIR", os.path.join(os.path.dirname(__file__), "artifacts"))
+
+# Image embedding store (see embedding_store.py): backbone features are kept per
+# upload, so exact re-uploads and near-duplicates are answered by the classifier
+# head alone. It needs the backbone and head run separately, so IMAGE_BACKEND is
+# ignored while it is enabled. A threshold above 1 turns off near-duplicate matching.
+IMAGE_EMBEDDING_STORE = os.environ.get("IMAGE_EMBEDDING_STORE", "")
+IMAGE_NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("IMAGE_NEAR_DUPLICATE_THRESHOLD", "0.97"))
+
+# Confidence-gated cascade (see cascade.py): screening stages such as lowres-112
+# answer confident images and escalate the rest to the IMAGE_BACKEND engine.
+# Thresholds come from calibrate_cascade.py; the defaults apply to stages it
+# has not calibrated.
+IMAGE_CASCADE = [stage for stage in os.environ.get("IMAGE_CASCADE", "").split(",") if stage]
+IMAGE_CASCADE_THRESHOLDS = os.environ.get("IMAGE_CASCADE_THRESHOLDS", os.path.join(IMAGE_ARTIFACT_DIR, THRESHOLDS_FILE))
+IMAGE_CASCADE_MIN_CONFIDENCE = float(os.environ.get("IMAGE_CASCADE_MIN_CONFIDENCE", "0.9"))
+IMAGE_CASCADE_MIN_MARGIN = float(os.environ.get("IMAGE_CASCADE_MIN_MARGIN", "0.5"))
+
+image_embeddings = EmbeddingStore(
+    IMAGE_EMBEDDING_STORE, BACKBONE_FEATURES, DESCRIPTOR_DIM
+) if IMAGE_EMBEDDING_STORE else None
+
+def use_bundle() -> bool:
+    return bool(MODEL_BUNDLE_DIR) and bundle_exists(MODEL_BUNDLE_DIR)
+
+def load_image_model_component():
+    if use_bundle():
+        return load_image_model(MODEL_BUNDLE_DIR, knowledge.current.skin_conditions)
+    image_model = initialize_image_analyzer()
+    # Load the fine-tuned weights if available
+    load_finetuned_weights(image_model, 'medical_image_model.pth')
+    return image_model.eval()
+
+def load_image_engine_component():
+    image_model = model_registry.get("image_model")
+    if image_embeddings is not None:
+        if IMAGE_BACKEND != "eager" or IMAGE_CASCADE:
+            logger.warning("IMAGE_EMBEDDING_STORE is set; using the split eager engine, "
+                           "ignoring IMAGE_BACKEND and IMAGE_CASCADE")
+        image_embeddings.bind_backbone(backbone_digest(image_model))
+        image_engine = SplitEngine(image_model)
+        logger.info(f"Image inference backend: {image_engine.name}")
+        return image_engine
+    try:
+        image_engine = create_engine(IMAGE_BACKEND, image_model, IMAGE_ARTIFACT_DIR, execution.torch_threads)
+    except Exception as e:
+        logger.error(f"Could not load '{IMAGE_BACKEND}' inference backend, falling back to eager: {str(e)}")
+        image_engine = EagerEngine(image_model)
+    if IMAGE_CASCADE:
+        try:
+            image_engine = create_cascade(
+                IMAGE_CASCADE, image_model, image_engine, len(knowledge.current.skin_conditions),
+                IMAGE_ARTIFACT_DIR, load_thresholds(IMAGE_CASCADE_THRESHOLDS),
+                IMAGE_CASCADE_MIN_CONFIDENCE, IMAGE_CASCADE_MIN_MARGIN,
+            )
+        except Exception as e:
+            logger.error(f"Could not build the image cascade, using {image_engine.name} alone: {str(e)}")
+    logger.info(f"Image inference backend: {image_engine.name}")
+    return image_engine
+
+def load_symptom_classifier_component():
+    current = knowledge.current
+    classifier = None
+    if use_bundle():
+        try:
+            classifier = load_symptom_classifier(MODEL_BUNDLE_DIR, current.training_data)
+        except ValueError as e:
+            logger.warning(f"Retraining the symptom classifier: {str(e)}")
+    if classifier is None:
+        classifier = train_symptom_classifier(current.training_data)
+    knowledge.set_classifier(current.version, NaiveBayesScorer(classifier))
+    return classifier
+
+model_registry = ModelRegistry()
+# The classifier is cheap to load; load it first so model-backed symptom engines are ready early
+model_registry.register("symptom_classifier", load_symptom_classifier_component)
+model_registry.register("image_model", load_image_model_component)
+model_registry.register("image_engine", load_image_engine_component)
+if MODEL_LOADING == "eager":
+    model_registry.load_all()
+
+# Serving transform lives in image_preprocess so decode workers can use it too
+image_transform = IMAGE_TRANSFORM
+
+# Upload limits: bytes are checked while streaming, pixels from the header before decoding
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_BYTES", str(15 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", "40000000"))
+IMAGE_UPLOAD_PATHS = ["/api/analyze-image", "/api/analyze-image/jobs"]
+# Multi-image uploads: MAX_IMAGE_BYTES still applies to each file
+IMAGE_MULTI_MAX_FILES = int(os.environ.get("IMAGE_MULTI_MAX_FILES", "16"))
+IMAGE_MULTI_MAX_BYTES = int(os.environ.get("IMAGE_MULTI_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Preallocated input tensors reused across requests
+image_buffers = TensorBufferPool()
+
+# Micro-batching for image inference: concurrent uploads share one forward pass
+IMAGE_TOP_K = 3
+IMAGE_BATCH_MAX_SIZE = int(os.environ.get("IMAGE_BATCH_MAX_SIZE", "8"))
+IMAGE_BATCH_MAX_WAIT_MS = float(os.environ.get("IMAGE_BATCH_MAX_WAIT_MS", "5"))
+
+# Per-stage timings; endpoint labels match the route paths used by MetricsMiddleware
+image_stages = StageTimer("/api/analyze-image")
+symptom_stages = StageTimer("/api/analyze-symptoms")
+hospital_stages = StageTimer("/api/nearby-hospitals")
+IMAGE_BATCH_SECONDS = Histogram(
+    "healease_image_batch_seconds", "Time per batched image forward pass and top-k", ["stage"]
+)
+IMAGE_BATCH_SIZE = Histogram(
+    "healease_image_batch_size", "Images per batched forward pass", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+
+# On-demand profiling captures (see profiling.py), started from /admin/profile.
+# PROFILE_DIR shares finished captures between worker processes; serve.py sets it.
+profiles = ProfileManager(
+    keep=int(os.environ.get("PROFILE_KEEP", "8")),
+    sample_interval=float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000.0,
+    directory=os.environ.get("PROFILE_DIR") or None,
+)
+
+def image_forward(engine, batch: torch.Tensor) -> tuple:
+    """(probabilities, per-item backbone features or Nones) for a stacked batch"""
+    if isinstance(engine, SplitEngine):
+        outputs, features = engine.forward_features(batch)
+        return outputs, list(features.numpy())
+    return engine(batch), [None] * len(batch)
 
-# Initialize the image analysis model
-image_model, image_transform = initialize_image_analyzer()
-image_model.eval()  # Set to evaluation mode
+def run_image_batch(batch: torch.Tensor) -> List[tuple]:
+    """Forward a stacked image batch and return each item's top-k (probabilities, indices, features)
 
-# Load the fine-tuned weights if available
-if os.path.exists('medical_image_model.pth'):
-    image_model.load_state_dict(torch.load('medical_image_model.pth'))
-image_model.eval()
+    features are the pooled backbone features with the split engine, else None.
+    """
+    IMAGE_BATCH_SIZE.observe(len(batch))
+    engine = model_registry.get("image_engine")
+    with IMAGE_BATCH_SECONDS.labels("forward").time():
+        outputs, features = profiles.run_forward(image_forward, engine, batch)
+    with IMAGE_BATCH_SECONDS.labels("topk").time():
+        top_probs, top_indices = torch.topk(outputs, IMAGE_TOP_K, dim=1)
+    # Plain Python numbers; formatting 0-d tensors one by one is much slower
+    return list(zip(top_probs.tolist(), top_indices.tolist(), features))
 
-image_transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.CenterCrop(224),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-])
+def score_embedding(embedding: np.ndarray) -> tuple:
+    """Top-k (probabilities, indices) from stored backbone features, running only the head"""
+    outputs = model_registry.get("image_engine").score_features(torch.from_numpy(embedding)[None])
+    top_probs, top_indices = torch.topk(outputs, IMAGE_TOP_K, dim=1)
+    return top_probs[0].tolist(), top_indices[0].tolist()
+
+image_batcher = MicroBatcher(
+    run_image_batch, IMAGE_BATCH_MAX_SIZE, IMAGE_BATCH_MAX_WAIT_MS, executor=execution.inference_pool
+)
 
 def calculate_severity(symptoms: str, prediction_scores: List[float]) -> int:
     """Calculate severity score based on symptoms and prediction confidence"""
@@ -314,12 +480,167 @@ def calculate_severity(symptoms: str, prediction_scores: List[float]) -> int:
 
 def get_condition_description(condition: str, medical_system: str) -> str:
     """Get detailed description for a medical condition based on the medical system"""
-    descriptions = MEDICAL_CONDITIONS.get(medical_system, {})
+    descriptions = knowledge.current.conditions.get(medical_system, {})
     return descriptions.get(condition, f"Possible {condition} detected. Please consult a healthcare provider for proper diagnosis.")
 
+MIN_SYMPTOMS_LENGTH = 10
+SHORT_SYMPTOMS_ERROR = "Please provide more detailed symptoms (at least 10 characters)"
+SYMPTOM_ANALYSIS_ERROR = "Failed to analyze symptoms. Please try again or provide more detailed information."
+
+# Upper bound on items accepted by /api/analyze-symptoms/batch
+MAX_SYMPTOM_BATCH_SIZE = int(os.environ.get("MAX_SYMPTOM_BATCH_SIZE", "1000"))
+
+def symptom_error_response(message: str) -> bytes:
+    """Encoded error payload in the same shape as a symptom analysis result"""
+    return ResponseFragments.error_response(message)
+
+SHORT_SYMPTOMS_RESPONSE = symptom_error_response(SHORT_SYMPTOMS_ERROR)
+SYMPTOM_ANALYSIS_FAILED_RESPONSE = symptom_error_response(SYMPTOM_ANALYSIS_ERROR)
+
+def build_symptom_response(kb: KnowledgeBase, scores: List[tuple], severity_hits: int,
+                           similar: Optional[List[Dict]] = None) -> bytes:
+    """Turn per-condition scores from the symptom scorer into the encoded API response"""
+    body = kb.fragments.symptom_response(scores, severity_hits)
+    if similar is not None:
+        body = append_field(body, "similarCases", similar)
+    return body
+
+# Past cases with similar symptom notes, listed as similarCases in symptom
+# responses (see similar_cases.py). Without SIMILAR_CASES_INDEX the field is
+# left out. Build the index with build_case_index.py, or add cases at runtime
+# through POST /admin/similar-cases.
+SIMILAR_CASES_INDEX = os.environ.get("SIMILAR_CASES_INDEX", "")
+SIMILAR_CASES_K = int(os.environ.get("SIMILAR_CASES_K", "3"))
+SIMILAR_CASES_MIN_SIMILARITY = float(os.environ.get("SIMILAR_CASES_MIN_SIMILARITY", "0.2"))
+
+similar_cases = SimilarCaseIndex.open(
+    SIMILAR_CASES_INDEX,
+    max_postings=int(os.environ.get("SIMILAR_CASES_MAX_POSTINGS", "100000")),
+    rerank=int(os.environ.get("SIMILAR_CASES_RERANK", "2048")),
+    poll_seconds=float(os.environ.get("SIMILAR_CASES_POLL_SECONDS", "30")),
+) if SIMILAR_CASES_INDEX else None
+
+def find_similar_cases(symptoms_texts: List[str]) -> Optional[List[List[Dict]]]:
+    """similarCases entries for each text, or None when there is no index"""
+    if similar_cases is None:
+        return None
+    return [
+        [{"caseId": case_id, "condition": condition, "similarity": round(score, 3)}
+         for case_id, condition, score in similar_cases.search(text, SIMILAR_CASES_K, SIMILAR_CASES_MIN_SIMILARITY)]
+        for text in symptoms_texts
+    ]
+
+KNOWLEDGE_VERSION_HEADER = "X-Knowledge-Version"
+
+def knowledge_response(body: bytes, kb: KnowledgeBase) -> RawJSONResponse:
+    """Encoded analysis response tagged with the knowledge base version that produced it"""
+    return RawJSONResponse(body, headers={KNOWLEDGE_VERSION_HEADER: kb.version})
+
+# Result caches keyed on request content; RESULT_CACHE_DIR adds an on-disk tier
+RESULT_CACHE_ENTRIES = int(os.environ.get("RESULT_CACHE_ENTRIES", "10000"))
+RESULT_CACHE_MB = float(os.environ.get("RESULT_CACHE_MB", "64"))
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", "3600"))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR") or None
+
+def make_result_cache(name: str) -> ResultCache:
+    return ResultCache(
+        name,
+        max_entries=RESULT_CACHE_ENTRIES,
+        max_bytes=int(RESULT_CACHE_MB * 1024 * 1024),
+        ttl_seconds=RESULT_CACHE_TTL,
+        disk_dir=RESULT_CACHE_DIR,
+        executor=execution.io_pool,
+    )
+
+image_cache = make_result_cache("image")
+symptom_cache = make_result_cache("symptoms")
+
+def symptom_cache_key(symptoms_text: str, medical_system: str, version: str, engine: str) -> str:
+    # symptoms_text is already stripped and lower-cased, the same form the scorer sees.
+    # Results from an older knowledge base version are never served after a reload,
+    # nor similar cases from before the last change to the case index.
+    if similar_cases is not None:
+        version = f"{version}/cases-{similar_cases.generation}"
+    return content_key("symptoms", medical_system, version, engine, symptoms_text)
+
+# Nearby hospitals: pooled async Places client behind a geohash tile cache.
+# PLACES_BASE_URL can point at stub_places_server.py for tests and load runs.
+# HOSPITAL_PROVIDER=offline answers from a local dataset (HOSPITAL_DATASET)
+# through an in-memory spatial index instead, with no network calls.
+HOSPITAL_PROVIDER = os.environ.get("HOSPITAL_PROVIDER", "places")
+HOSPITAL_DATASET = os.environ.get("HOSPITAL_DATASET", "")
+
+def build_hospital_provider():
+    if HOSPITAL_PROVIDER == "offline":
+        if not HOSPITAL_DATASET:
+            raise ValueError("HOSPITAL_PROVIDER=offline needs HOSPITAL_DATASET")
+        index = ReloadingHospitalIndex(
+            HOSPITAL_DATASET,
+            poll_seconds=float(os.environ.get("HOSPITAL_DATASET_POLL", "30")),
+        )
+        return OfflineHospitalProvider(index, max_results=int(os.environ.get("HOSPITAL_MAX_RESULTS", "20")))
+    return PlacesProvider(
+        api_key=os.environ.get("GOOGLE_MAPS_API_KEY", "YOUR_GOOGLE_MAPS_API_KEY"),
+        base_url=os.environ.get("PLACES_BASE_URL", "https://maps.googleapis.com"),
+        timeout=float(os.environ.get("PLACES_TIMEOUT", "5")),
+        retries=int(os.environ.get("PLACES_RETRIES", "2")),
+    )
+
+hospital_service = HospitalService(
+    build_hospital_provider(),
+    tile_precision=int(os.environ.get("HOSPITAL_TILE_PRECISION", "6")),
+    ttl_seconds=float(os.environ.get("HOSPITAL_CACHE_TTL", "3600")),
+    stale_seconds=float(os.environ.get("HOSPITAL_CACHE_STALE", "86400")),
+)
+
 # FastAPI setup
 app = FastAPI()
 
+# Multipart overhead on top of the image itself
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_IMAGE_BYTES + 64 * 1024, paths=IMAGE_UPLOAD_PATHS)
+app.add_middleware(UploadLimitMiddleware, max_bytes=IMAGE_MULTI_MAX_BYTES, paths=["/api/analyze-image/multi"])
+
+# Admission control (see admission.py): each endpoint group has a concurrency
+# budget and a bounded wait queue, and requests beyond them are shed at once
+# with 429/503 and Retry-After. Limits are per worker process; a group with
+# concurrency 0 is not limited. Clients pass their deadline as
+# X-Request-Timeout-Ms; REQUEST_DEFAULT_TIMEOUT_MS applies when they do not.
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "5"))
+REQUEST_DEFAULT_TIMEOUT_MS = float(os.environ.get("REQUEST_DEFAULT_TIMEOUT_MS", "0"))
+ADMISSION_GROUPS = {
+    # group: (paths, default concurrency, default queue length)
+    "image": (["/api/analyze-image", "/api/analyze-image/multi"], 2 * IMAGE_BATCH_MAX_SIZE, 32),
+    "symptoms": (["/api/analyze-symptoms", "/api/analyze-symptoms/batch"], 64, 256),
+    "hospitals": (["/api/nearby-hospitals", "/api/nearest-hospitals"], 32, 128),
+}
+admission_limiters: Dict[str, AdmissionLimiter] = {}
+admission_paths: Dict[str, str] = {}
+for group, (paths, concurrency, queued) in ADMISSION_GROUPS.items():
+    concurrency = int(os.environ.get(f"ADMISSION_{group.upper()}_CONCURRENCY", str(concurrency)))
+    if concurrency <= 0:
+        continue
+    queued = int(os.environ.get(f"ADMISSION_{group.upper()}_QUEUE", str(queued)))
+    admission_limiters[group] = AdmissionLimiter(group, concurrency, queued, ADMISSION_QUEUE_TIMEOUT)
+    admission_paths.update(dict.fromkeys(paths, group))
+app.add_middleware(
+    AdmissionMiddleware,
+    limiters=admission_limiters.values(),
+    paths=admission_paths,
+    default_timeout=REQUEST_DEFAULT_TIMEOUT_MS / 1000.0 or None,
+)
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+app.add_middleware(ProfilingMiddleware, manager=profiles)
+
+# Outside the limits, so rejected uploads and shed requests are counted too
+app.add_middleware(MetricsMiddleware, routes=lambda: [route.path for route in app.routes])
+
+# Outermost, so the browser can read every response, including 413s from the
+# upload limits and 429/503s from admission control, and preflights are
+# answered before they reach the limits
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allow all origins in development
@@ -334,254 +655,229 @@ class SymptomRequest(BaseModel):
     symptoms: str
     language: str = "en-IN"
     medicalSystem: str = "Allopathy"
+    engine: Optional[str] = None  # keyword, tfidf_nb or hybrid; SYMPTOM_ENGINE when unset
+
+SYMPTOM_ENGINE_REQUESTS = Counter(
+    "healease_symptom_engine_requests_total", "Symptom texts scored, by engine", ["engine"]
+)
+
+def model_unavailable(component: str, label: str) -> HTTPException:
+    """503 for a model component that is not ready; only one still loading is worth retrying"""
+    if model_registry.is_failed(component):
+        return HTTPException(status_code=503, detail=f"{label} failed to load; this analysis is unavailable.")
+    return HTTPException(
+        status_code=503,
+        detail=f"{label} is still loading. Please retry shortly.",
+        headers={"Retry-After": "5"}
+    )
+
+async def symptom_knowledge(engines) -> KnowledgeBase:
+    """Current knowledge base, once the requested engines are known to be usable"""
+    for engine in engines:
+        if engine not in ENGINES:
+            raise HTTPException(status_code=400, detail=f"engine must be one of {', '.join(ENGINES)}")
+    if any(engine != "keyword" for engine in engines) and knowledge.current.classifier is None:
+        await model_registry.wait_ready("symptom_classifier", MODEL_WAIT_SECONDS)
+        if knowledge.current.classifier is None:
+            raise model_unavailable("symptom_classifier", "Symptom classifier")
+    return knowledge.current
+
+def symptom_engine(kb: KnowledgeBase, name: str):
+    return create_symptom_engine(name, kb.scorer, kb.classifier, HYBRID_KEYWORD_WEIGHT)
+
+async def compute_symptom_analysis(symptoms_text: str, engine_name: str, kb: KnowledgeBase) -> bytes:
+    """Score every condition against the precompiled index and build the encoded response"""
+    with symptom_stages.stage("scoring"):
+        scores, severity_hits = symptom_engine(kb, engine_name).score(symptoms_text)
+    SYMPTOM_ENGINE_REQUESTS.labels(engine_name).inc()
+    similar = None
+    if similar_cases is not None:
+        with symptom_stages.stage("similar_cases"):
+            similar = (await execution.run_light(find_similar_cases, [symptoms_text]))[0]
+    with symptom_stages.stage("postprocess"):
+        return build_symptom_response(kb, scores, severity_hits, similar)
 
 @app.post("/api/analyze-symptoms")
 async def analyze_symptoms(request: SymptomRequest):
+    engine_name = request.engine or SYMPTOM_ENGINE
+    # The whole request runs against one knowledge base version, even if a reload lands meanwhile
+    kb = await symptom_knowledge([engine_name])
     try:
-        logger.info(f"Received symptom analysis request: {request.dict()}")
+        log_event(logger, logging.INFO, "/api/analyze-symptoms", "Received symptom analysis request", request=request)
         
         # Preprocess symptoms text
         symptoms_text = request.symptoms.strip().lower()
-        if len(symptoms_text) < 10:
-            return {
-                "error": "Please provide more detailed symptoms (at least 10 characters)",
-                "possibleConditions": [],
-                "severity": 0,
-                "urgency": "low"
-            }
+        if len(symptoms_text) < MIN_SYMPTOMS_LENGTH:
+            return knowledge_response(SHORT_SYMPTOMS_RESPONSE, kb)
         
-        # Get conditions from medical_conditions.json
-        conditions = MEDICAL_CONDITIONS.get("skin_conditions", [])
-        allopathy_info = MEDICAL_CONDITIONS.get("Allopathy", {})
-        ayurveda_info = MEDICAL_CONDITIONS.get("Ayurveda_recommendations", {})
-        homeopathy_info = MEDICAL_CONDITIONS.get("Homeopathy_recommendations", {})
-        
-        # Keywords for each condition based on descriptions
-        condition_keywords = {
-            "Acne": ["pimples", "inflammation", "red", "oily", "spots", "breakout"],
-            "Eczema": ["dry", "itchy", "patches", "inflammation", "chronic", "red", "stress"],
-            "Psoriasis": ["red", "scaly", "patches", "autoimmune", "thick", "chronic"],
-            "Contact Dermatitis": ["inflammation", "irritants", "allergic", "triggers", "burning", "rash"],
-            "Fungal Infection": ["infection", "fungal", "itchy", "spreading", "rash"],
-            "Rosacea": ["facial", "redness", "bumps", "flushing", "chronic"],
-            "Melanoma": ["cancer", "skin cancer", "serious", "dark", "changing", "mole"],
-            "Basal Cell Carcinoma": ["cancer", "growth", "lesion", "skin cancer"],
-            "Urticaria": ["hives", "allergic", "itchy", "welts", "swelling"],
-            "Vitiligo": ["pigmentation", "white patches", "loss of color", "skin color"],
-            "Impetigo": ["bacterial", "infection", "sores", "crusting", "contagious"],
-            "Shingles": ["painful", "blisters", "rash", "burning", "nerve pain"],
-            "Cellulitis": ["bacterial", "infection", "red", "swollen", "warm", "tender"],
-            "Scabies": ["itchy", "rash", "burrows", "intense itching", "night", "parasites"],
-            "Warts": ["growth", "viral", "rough", "bump", "raised"]
-        }
-        
-        # Calculate match scores for each condition
-        condition_scores = []
-        for condition in conditions:
-            score = 0
-            keywords = condition_keywords.get(condition, [])
-            
-            # Check for keyword matches
-            for keyword in keywords:
-                if keyword in symptoms_text:
-                    score += 0.3
-            
-            # Check training data matches
-            condition_examples = [example for example, label in SYMPTOM_TRAINING_DATA if label == condition]
-            for example in condition_examples:
-                example_words = set(example.lower().split())
-                symptom_words = set(symptoms_text.split())
-                common_words = example_words.intersection(symptom_words)
-                if len(common_words) > 0:
-                    match_score = len(common_words) / len(example_words)
-                    score += match_score * 0.4
-            
-            # Additional score for severity indicators
-            severity_words = ["severe", "intense", "extreme", "very", "lot", "constant", "chronic", "unbearable"]
-            severity_score = sum(0.1 for word in severity_words if word in symptoms_text)
-            score += min(severity_score, 0.3)
-            
-            # Location matching (if mentioned in symptoms)
-            body_parts = ["face", "arms", "legs", "back", "chest", "neck", "hands", "feet", "scalp"]
-            location_matches = sum(1 for part in body_parts if part in symptoms_text)
-            if location_matches > 0:
-                score += 0.1
-            
-            if score > 0:
-                condition_scores.append((condition, min(score, 1.0), allopathy_info.get(condition, "")))
-        
-        # Sort by score and get top 3
-        condition_scores.sort(key=lambda x: x[1], reverse=True)
-        top_conditions = condition_scores[:3]
-        
-        # Calculate severity
-        severity_words = ["severe", "intense", "extreme", "unbearable", "pain", "bleeding", "infection"]
-        severity = sum(word in symptoms_text for word in severity_words) * 2
-        if top_conditions:
-            severity = min(10, severity + max(score for _, score, _ in top_conditions) * 5)
-        
-        # Prepare response with conditions and recommendations
-        possible_conditions = []
-        for cond, score, desc in top_conditions:
-            condition_data = {
-                "name": cond,
-                "probability": int(score * 100),
-                "description": desc,
-                "recommendations": {
-                    "allopathy": allopathy_info.get(cond, ""),
-                    "ayurveda": ayurveda_info.get(cond, ""),
-                    "homeopathy": homeopathy_info.get(cond, "")
-                }
-            }
-            possible_conditions.append(condition_data)
-        
-        # Prepare final response
-        response_data = {
-            "possibleConditions": possible_conditions,
-            "severity": int(severity),
-            "urgency": "high" if severity >= 7 else "medium" if severity >= 4 else "low"
-        }
-        
-        logger.info(f"Sending response: {response_data}")
-        return response_data
-        
-        # Prepare response
-        possible_conditions = [
-            {
-                "name": condition,
-                "probability": int(prob * 100),
-                "description": get_condition_description(condition, request.medicalSystem)
-            }
-            for condition, prob in zip(conditions, probabilities)
-        ]
+        # Identical reports share one cached (or in-flight) analysis
+        response_data = await symptom_cache.get_or_compute(
+            symptom_cache_key(symptoms_text, request.medicalSystem, kb.version, engine_name),
+            lambda: compute_symptom_analysis(symptoms_text, engine_name, kb)
+        )
         
-        # Generate recommendation based on severity and top condition
-        if severity >= 8:
-            recommendation = "Seek immediate medical attention. Your symptoms suggest a potentially serious condition."
-            urgency = "high"
-        elif severity >= 5:
-            recommendation = f"Schedule an appointment with a healthcare provider soon to evaluate your {conditions[0]}." 
-            urgency = "medium"
-        else:
-            recommendation = f"Monitor your symptoms. If they persist or worsen, consult a healthcare provider."
-            urgency = "low"
+        log_event(logger, logging.INFO, "/api/analyze-symptoms", "Sending response", response=response_data)
+        return knowledge_response(response_data, kb)
 
-        # Add AYUSH recommendations if requested
-        ayush_recommendation = None
-        if request.medicalSystem in ["Ayurveda", "Homeopathy", "Unani", "Siddha", "Yoga"]:
-            ayush_recommendation = MEDICAL_CONDITIONS.get(f"{request.medicalSystem}_recommendations", {}).get(conditions[0])
-        
-        response = {
-            "possibleConditions": possible_conditions,
-            "recommendation": recommendation,
-            "severity": severity,
-            "urgency": urgency,
-            "ayushRecommendation": ayush_recommendation
-        }
-        logger.info(f"Generated response: {response}")
-        return response
-        
     except Exception as e:
         logger.error(f"Error analyzing symptoms: {str(e)}")
-        return {
-            "error": "Failed to analyze symptoms. Please try again or provide more detailed information.",
-            "possibleConditions": [],
-            "severity": 0,
-            "urgency": "low"
-        }
-    # Generate recommendation based on severity and top condition
-    if severity >= 8:
-        recommendation = "Seek immediate medical attention. Your symptoms suggest a potentially serious condition."
-        urgency = "high"
-    elif severity >= 5:
-        recommendation = f"Schedule an appointment with a healthcare provider soon to evaluate your {conditions[0]}." 
-        urgency = "medium"
-    else:
-        recommendation = f"Monitor your symptoms. If they persist or worsen, consult a healthcare provider."
-        urgency = "low"
-
-    # Add AYUSH recommendations if requested
-    ayush_recommendation = None
-    if request.medicalSystem in ["Ayurveda", "Homeopathy", "Unani", "Siddha", "Yoga"]:
-        ayush_recommendation = MEDICAL_CONDITIONS.get(f"{request.medicalSystem}_recommendations", {}).get(conditions[0])
+        return knowledge_response(SYMPTOM_ANALYSIS_FAILED_RESPONSE, kb)
+
+@app.post("/api/analyze-symptoms/batch")
+async def analyze_symptoms_batch(batch: List[SymptomRequest]):
+    """Score many symptom texts in one vectorized pass; results come back in input order"""
+    if len(batch) > MAX_SYMPTOM_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(batch)} items (max {MAX_SYMPTOM_BATCH_SIZE})"
+        )
+    log_event(logger, logging.INFO, "/api/analyze-symptoms/batch", "Received batch symptom analysis request", items=len(batch))
     
-    return {
-        "possibleConditions": possible_conditions,
-        "recommendation": recommendation,
-        "severity": severity,
-        "urgency": urgency,
-        "ayushRecommendation": ayush_recommendation
-    }
+    engines = [item.engine or SYMPTOM_ENGINE for item in batch]
+    kb = await symptom_knowledge(set(engines))
+    texts = [item.symptoms.strip().lower() for item in batch]
+    results: List[bytes] = [SHORT_SYMPTOMS_RESPONSE] * len(texts)
+    valid = [i for i, text in enumerate(texts) if len(text) >= MIN_SYMPTOMS_LENGTH]
+    
+    # Serve cached items directly and only score the misses
+    keys = {i: symptom_cache_key(texts[i], batch[i].medicalSystem, kb.version, engines[i]) for i in valid}
+    misses = []
+    for i, cached in zip(valid, await symptom_cache.get_many([keys[i] for i in valid])):
+        if cached is None:
+            misses.append(i)
+        else:
+            results[i] = cached
+    
+    # One batched pass per engine
+    by_engine: Dict[str, List[int]] = {}
+    for i in misses:
+        by_engine.setdefault(engines[i], []).append(i)
+    for engine_name, indices in by_engine.items():
+        try:
+            scored = await execution.run_light(symptom_engine(kb, engine_name).score_batch, [texts[i] for i in indices])
+            SYMPTOM_ENGINE_REQUESTS.labels(engine_name).inc(len(indices))
+            # Same cache entries as the single endpoint, so the same fields
+            similar = await execution.run_light(find_similar_cases, [texts[i] for i in indices])
+            for n, (i, (scores, severity_hits)) in enumerate(zip(indices, scored)):
+                results[i] = build_symptom_response(kb, scores, severity_hits, similar[n] if similar is not None else None)
+                symptom_cache.put(keys[i], results[i])
+        except Exception as e:
+            logger.error(f"Error analyzing symptom batch with the {engine_name} engine: {str(e)}")
+            for i in indices:
+                results[i] = SYMPTOM_ANALYSIS_FAILED_RESPONSE
+    
+    # Items are already encoded; join them into the JSON array. Entries written
+    # to the disk cache by older versions come back as dicts.
+    return knowledge_response(
+        b"[" + b",".join(r if isinstance(r, bytes) else encode_json(r) for r in results) + b"]", kb
+    )
+
+async def infer_image(contents: bytes) -> tuple:
+    """Decode an upload and return its top-k (probabilities, indices)"""
+    if image_embeddings is not None:
+        return await infer_image_stored(contents)
+    check_deadline("decode")
+    # Decode at reduced scale and normalize into a pooled buffer on the decode pool.
+    # Decode processes cannot write into our buffers, so they return fresh tensors.
+    with image_buffers.buffer() as buffer:
+        out = buffer if execution.decode_pool.kind == "thread" else None
+        image_tensor, decode_seconds, transform_seconds = await execution.run_decode(
+            preprocess_image_timed, contents, MAX_IMAGE_PIXELS, out
+        )
+        image_stages.observe("decode", decode_seconds)
+        image_stages.observe("transform", transform_seconds)
+        
+        # Get top 3 predictions from a (possibly shared) batched forward pass;
+        # includes the wait for the batch to fill
+        check_deadline("inference")
+        with image_stages.stage("inference"):
+            top_probs, top_indices, _ = await image_batcher.submit(image_tensor, current_deadline())
+    return top_probs, top_indices
+
+async def infer_image_stored(contents: bytes) -> tuple:
+    """infer_image() through the embedding store: exact hit, near-duplicate, or a forward pass"""
+    key = hashlib.sha256(contents).digest()
+    with image_stages.stage("embedding_lookup"):
+        embedding = await execution.run_light(image_embeddings.get, key)
+    if embedding is not None:
+        with image_stages.stage("head"):
+            return await execution.run_light(score_embedding, embedding)
+
+    check_deadline("decode")
+    with image_buffers.buffer() as buffer:
+        out = buffer if execution.decode_pool.kind == "thread" else None
+        image_tensor, descriptor, decode_seconds, transform_seconds = await execution.run_decode(
+            preprocess_image_described, contents, MAX_IMAGE_PIXELS, out
+        )
+        image_stages.observe("decode", decode_seconds)
+        image_stages.observe("transform", transform_seconds)
+
+        with image_stages.stage("embedding_lookup"):
+            match = await execution.run_light(image_embeddings.nearest, descriptor, IMAGE_NEAR_DUPLICATE_THRESHOLD)
+        if match is not None:
+            # Reuse the near-duplicate's features; they are stored again under this
+            # upload's hash below, so an exact re-upload skips decoding
+            embedding = image_embeddings.embedding(match[0])
+            with image_stages.stage("head"):
+                top_probs, top_indices = await execution.run_light(score_embedding, embedding)
+        else:
+            check_deadline("inference")
+            with image_stages.stage("inference"):
+                top_probs, top_indices, embedding = await image_batcher.submit(image_tensor, current_deadline())
+    with image_stages.stage("embedding_store"):
+        await execution.run_light(image_embeddings.add, key, descriptor, embedding, top_indices[0])
+    return top_probs, top_indices
+
+def build_image_response(kb: KnowledgeBase, top_probs, top_indices) -> bytes:
+    """Turn top-k model outputs into the encoded image analysis response"""
+    return kb.fragments.image_response(top_probs, top_indices)
+
+def image_cache_key(contents: bytes, kb: KnowledgeBase) -> str:
+    backend = model_registry.get("image_engine").name
+    return content_key("image", backend, kb.version, contents)
+
+async def compute_image_analysis(contents: bytes, kb: KnowledgeBase) -> bytes:
+    top_probs, top_indices = await infer_image(contents)
+    with image_stages.stage("postprocess"):
+        response = build_image_response(kb, top_probs, top_indices)
+    log_event(logger, logging.INFO, "/api/analyze-image", "Image analysis complete",
+              conditions=[kb.skin_conditions[i] for i in top_indices])
+    return response
 
 @app.post("/api/analyze-image")
 async def analyze_image(file: UploadFile):
+    with image_stages.stage("wait_ready"):
+        ready = await model_registry.wait_ready("image_engine", MODEL_WAIT_SECONDS)
+    if not ready:
+        raise model_unavailable("image_engine", "Image model")
     try:
-        # Read and preprocess the image
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents)).convert('RGB')
+        # Read the upload, refusing anything over the byte limit
+        with image_stages.stage("upload_read"):
+            contents = await read_upload(file, MAX_IMAGE_BYTES)
         
-        # Prepare the image
-        image_tensor = image_transform(image).unsqueeze(0)
-        
-        # Get model predictions
-        with torch.no_grad():
-            outputs = image_model(image_tensor)
-            probabilities = outputs[0]
-        
-        # Get top 3 predictions
-        top_probs, top_indices = torch.topk(probabilities, 3)
-        
-        # Get conditions and their visual characteristics
-        conditions = MEDICAL_CONDITIONS['skin_conditions']
-        possible_conditions = []
+        # Identical uploads share one cached (or in-flight) analysis
+        kb = knowledge.current
+        response = await image_cache.get_or_compute(
+            image_cache_key(contents, kb),
+            lambda: compute_image_analysis(contents, kb)
+        )
+        with image_stages.stage("encode"):
+            return knowledge_response(response, kb)
         
-        for prob, idx in zip(top_probs, top_indices):
-            condition_name = conditions[idx]
-            training_data = IMAGE_TRAINING_DATA.get(condition_name, {})
-            
-            # Calculate confidence score based on visual characteristics
-            confidence_score = float(prob)
-            if training_data:
-                weights = training_data.get('confidence_weights', {})
-                visual_score = (
-                    weights.get('color', 0.3) +
-                    weights.get('texture', 0.3) +
-                    weights.get('pattern', 0.4)
-                )
-                confidence_score = (confidence_score + visual_score) / 2
-            
-            condition_data = {
-                "name": condition_name,
-                "probability": min(confidence_score * 100, 100),
-                "description": MEDICAL_CONDITIONS['Allopathy'].get(condition_name, ""),
-                "visual_characteristics": {
-                    "patterns": training_data.get('visual_patterns', []),
-                    "colors": training_data.get('colors', []),
-                    "textures": training_data.get('textures', [])
-                },
-                "recommendations": {
-                    "allopathy": MEDICAL_CONDITIONS['Allopathy'].get(condition_name, ""),
-                    "ayurveda": MEDICAL_CONDITIONS['Ayurveda_recommendations'].get(condition_name, ""),
-                    "homeopathy": MEDICAL_CONDITIONS['Homeopathy_recommendations'].get(condition_name, "")
-                }
+    except (ImageRejected, UploadTooLarge) as e:
+        status_code = e.status_code if isinstance(e, ImageRejected) else 413
+        log_event(logger, logging.INFO, "/api/analyze-image", "Rejected image upload", reason=str(e))
+        raise HTTPException(
+            status_code=status_code,
+            detail={
+                "error": str(e),
+                "possibleConditions": [],
+                "severity": 0,
+                "urgency": "low"
             }
-            possible_conditions.append(condition_data)
-        
-        # Calculate overall severity and urgency
-        max_probability = max(c["probability"] for c in possible_conditions)
-        severity = int(max_probability / 20)  # Convert to 0-10 scale
-        urgency = "high" if severity >= 7 else "medium" if severity >= 4 else "low"
-        
-        # Prepare final response
-        response = {
-            "possibleConditions": possible_conditions,
-            "severity": severity,
-            "urgency": urgency
-        }
-        
-        logger.info(f"Image analysis complete. Found conditions: {[c['name'] for c in possible_conditions]}")
-        return response
-        
+        )
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         error_msg = f"Error analyzing image: {str(e)}"
         logger.error(error_msg)
@@ -595,11 +891,482 @@ async def analyze_image(file: UploadFile):
             }
         )
 
+async def infer_images(contents_list: List[bytes]):
+    """Yield (position, (probabilities, indices) or the exception) for several uploads as each finishes
+
+    All uploads are decoded concurrently and queued to the micro-batcher
+    together, so they share forward passes. With the embedding store, each goes
+    through infer_image(): stored and near-duplicate images need no forward
+    pass, and the rest still meet in the micro-batcher.
+    """
+    pending: Dict[asyncio.Future, int] = {}
+    try:
+        with contextlib.ExitStack() as buffers:
+            if image_embeddings is not None:
+                for position, contents in enumerate(contents_list):
+                    pending[asyncio.ensure_future(infer_image(contents))] = position
+            else:
+                use_buffers = execution.decode_pool.kind == "thread"
+                decoded = await asyncio.gather(*(
+                    execution.run_decode(
+                        preprocess_image_timed, contents, MAX_IMAGE_PIXELS,
+                        buffers.enter_context(image_buffers.buffer()) if use_buffers else None,
+                    )
+                    for contents in contents_list
+                ), return_exceptions=True)
+                tensors, positions = [], []
+                for position, result in enumerate(decoded):
+                    if isinstance(result, Exception):
+                        yield position, result
+                        continue
+                    image_tensor, decode_seconds, transform_seconds = result
+                    image_stages.observe("decode", decode_seconds)
+                    image_stages.observe("transform", transform_seconds)
+                    tensors.append(image_tensor)
+                    positions.append(position)
+                pending = dict(zip(image_batcher.submit_many(tensors, current_deadline()), positions))
+
+            started = time.perf_counter()
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    position = pending.pop(future)
+                    if future.exception() is not None:
+                        yield position, future.exception()
+                        continue
+                    if image_embeddings is None:
+                        image_stages.observe("inference", time.perf_counter() - started)
+                    yield position, tuple(future.result()[:2])
+    finally:
+        # The client went away: let the batcher skip whatever has not run yet
+        for future in pending:
+            future.cancel()
+
+def aggregate_top_k(results: List[tuple]) -> tuple:
+    """Top-k (probabilities, indices) of the mean probability over several images
+
+    A condition outside an image's top-k counts as 0 for that image.
+    """
+    totals: Dict[int, float] = {}
+    for top_probs, top_indices in results:
+        for prob, idx in zip(top_probs, top_indices):
+            totals[idx] = totals.get(idx, 0.0) + prob
+    ranked = sorted(totals.items(), key=lambda item: -item[1])[:IMAGE_TOP_K]
+    return [total / len(results) for _, total in ranked], [idx for idx, _ in ranked]
+
+def ndjson_line(fields: Dict, result: Optional[bytes] = None) -> bytes:
+    """One NDJSON line of plain fields, plus an already-encoded analysis under "result" """
+    body = encode_json(fields)
+    if result is not None:
+        body = body[:-1] + b',"result":' + result + b"}"
+    return body + b"\n"
+
+async def stream_image_analyses(uploads: List[tuple], kb: KnowledgeBase, aggregate: bool):
+    """NDJSON lines for /api/analyze-image/multi: one per image as it completes, then the aggregate"""
+    readable = [(position, contents) for position, (_, contents) in enumerate(uploads) if isinstance(contents, bytes)]
+    for position, (filename, contents) in enumerate(uploads):
+        if isinstance(contents, UploadTooLarge):
+            yield ndjson_line({"index": position, "filename": filename, "status": 413, "error": str(contents)})
+
+    completed = []
+    async for n, result in infer_images([contents for _, contents in readable]):
+        position, contents = readable[n]
+        filename = uploads[position][0]
+        if isinstance(result, (ImageRejected, DeadlineExceeded)):
+            yield ndjson_line({"index": position, "filename": filename, "status": result.status_code, "error": str(result)})
+            continue
+        if isinstance(result, Exception):
+            logger.error(f"Error analyzing image {filename}: {str(result)}")
+            yield ndjson_line({"index": position, "filename": filename, "status": 500,
+                               "error": f"Error analyzing image: {str(result)}"})
+            continue
+        completed.append(result)
+        with image_stages.stage("postprocess"):
+            response = build_image_response(kb, *result)
+        # Later single-image requests for the same file are served from the cache
+        image_cache.put(image_cache_key(contents, kb), response)
+        yield ndjson_line({"index": position, "filename": filename, "status": 200}, response)
+
+    log_event(logger, logging.INFO, "/api/analyze-image/multi", "Multi-image analysis complete",
+              images=len(uploads), analyzed=len(completed))
+    if aggregate and completed:
+        yield ndjson_line({"aggregate": True, "images": len(completed)},
+                          build_image_response(kb, *aggregate_top_k(completed)))
+
+@app.post("/api/analyze-image/multi")
+async def analyze_image_multi(files: List[UploadFile] = File(...), aggregate: bool = False):
+    """Analyze several images in one request, streaming one NDJSON line per image as it completes"""
+    if len(files) > IMAGE_MULTI_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {IMAGE_MULTI_MAX_FILES} files per request")
+    with image_stages.stage("wait_ready"):
+        ready = await model_registry.wait_ready("image_engine", MODEL_WAIT_SECONDS)
+    if not ready:
+        raise model_unavailable("image_engine", "Image model")
+    check_deadline("decode")
+    # Read everything before streaming: the uploads are closed once the handler returns
+    uploads = []
+    with image_stages.stage("upload_read"):
+        for file in files:
+            try:
+                uploads.append((file.filename, await read_upload(file, MAX_IMAGE_BYTES)))
+            except UploadTooLarge as e:
+                uploads.append((file.filename, e))
+    kb = knowledge.current
+    return StreamingResponse(
+        stream_image_analyses(uploads, kb, aggregate),
+        media_type="application/x-ndjson",
+        headers={KNOWLEDGE_VERSION_HEADER: kb.version}
+    )
+
+# Asynchronous image analysis: submitting returns a job id at once, and results
+# are polled or streamed as server-sent events. IMAGE_JOB_DB adds a SQLite
+# store so queued jobs survive restarts and any worker process can answer polls.
+IMAGE_JOB_WORKERS = int(os.environ.get("IMAGE_JOB_WORKERS", str(IMAGE_BATCH_MAX_SIZE)))
+IMAGE_JOB_QUEUE_SIZE = int(os.environ.get("IMAGE_JOB_QUEUE_SIZE", "100"))
+IMAGE_JOB_TTL = float(os.environ.get("IMAGE_JOB_TTL", "600"))
+IMAGE_JOB_DB = os.environ.get("IMAGE_JOB_DB") or None
+
+class ModelUnavailable(Exception):
+    status_code = 503
+
+async def run_image_job(contents: bytes) -> bytes:
+    if not await model_registry.wait_ready("image_engine", MODEL_WAIT_SECONDS):
+        raise ModelUnavailable(model_unavailable("image_engine", "Image model").detail)
+    kb = knowledge.current
+    return await image_cache.get_or_compute(
+        image_cache_key(contents, kb),
+        lambda: compute_image_analysis(contents, kb)
+    )
+
+image_jobs = JobQueue(
+    run_image_job,
+    workers=IMAGE_JOB_WORKERS,
+    max_queued=IMAGE_JOB_QUEUE_SIZE,
+    result_ttl=IMAGE_JOB_TTL,
+    store=SQLiteJobStore(IMAGE_JOB_DB) if IMAGE_JOB_DB else None,
+)
+
+@app.post("/api/analyze-image/jobs")
+async def submit_image_job(file: UploadFile, priority: str = "normal"):
+    """Queue an image for analysis and return its job id immediately"""
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+    try:
+        contents = await read_upload(file, MAX_IMAGE_BYTES)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        job = await image_jobs.submit(contents, PRIORITIES[priority])
+    except QueueFull as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Image analysis queue is full. Please retry later.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    status_url = f"/api/jobs/{job.id}"
+    return JSONResponse(
+        status_code=202,
+        content={**job.view(), "statusUrl": status_url, "eventsUrl": status_url + "/events"},
+        headers={"Location": status_url}
+    )
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await image_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job.view()
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events with the job's status on every change, ending when it finishes"""
+    if await image_jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+
+    async def stream():
+        async for view in image_jobs.updates(job_id):
+            if view is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {view['status']}\ndata: {json.dumps(view)}\n\n"
+
+    return StreamingResponse(
+        stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/job-stats")
+async def job_stats():
+    return image_jobs.stats()
+
+@app.get("/api/cache-stats")
+async def cache_stats():
+    """Hit/miss/coalescing counters and sizes of the result caches"""
+    return {"image": image_cache.stats(), "symptoms": symptom_cache.stats()}
+
+@app.get("/api/knowledge-stats")
+async def knowledge_stats():
+    """Active knowledge base version and reload counters"""
+    return knowledge.stats()
+
+# Admin endpoints are disabled unless ADMIN_TOKEN is set; callers send it as X-Admin-Token
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.post("/admin/knowledge/reload", dependencies=[Depends(require_admin)])
+async def reload_knowledge(force: bool = False):
+    """Rebuild the knowledge base from its files off the event loop and swap it in"""
+    previous = knowledge.current.version
+    try:
+        changed = await asyncio.get_running_loop().run_in_executor(None, knowledge.reload, force)
+    except Exception as e:
+        # The previous version keeps serving
+        raise HTTPException(status_code=422, detail=f"Knowledge base not reloaded: {str(e)}")
+    return {"changed": changed, "previousVersion": previous, **knowledge.stats()}
+
+@app.post("/admin/profile/{kind}", dependencies=[Depends(require_admin)])
+async def start_profile(kind: str, count: int = 10, seconds: float = 60):
+    """Profile the next `count` requests (images for torch), or `seconds`, whichever ends first"""
+    if kind not in PROFILE_KINDS:
+        raise HTTPException(status_code=404, detail=f"Capture kind must be one of {', '.join(PROFILE_KINDS)}")
+    # Chrome traces take a few MB per image, so torch captures are kept short
+    count = max(1, min(count, 64 if kind == "torch" else 10000))
+    seconds = max(1.0, min(seconds, 600.0))
+    try:
+        capture = profiles.start(kind, count, seconds, asyncio.get_running_loop())
+    except CaptureBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return capture.info()
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """Running and finished captures, newest first"""
+    return profiles.list()
+
+@app.get("/admin/profile/{capture_id}", dependencies=[Depends(require_admin)])
+async def profile_status(capture_id: str):
+    capture = profiles.get(capture_id)
+    if capture is None:
+        raise HTTPException(status_code=404, detail="Unknown capture")
+    return capture.info()
+
+@app.get("/admin/profile/{capture_id}/{output}", dependencies=[Depends(require_admin)])
+async def download_profile(capture_id: str, output: str):
+    """A finished capture's output: chrome, table, pstats, text or collapsed"""
+    capture = profiles.get(capture_id)
+    if capture is None:
+        raise HTTPException(status_code=404, detail="Unknown capture")
+    if capture.state == "failed":
+        raise HTTPException(status_code=500, detail=f"Capture failed: {capture.error}")
+    if capture.state != "done":
+        # Running, or still exporting its outputs
+        raise HTTPException(status_code=409, detail=f"Capture is still {capture.state}", headers={"Retry-After": "1"})
+    if output not in capture.outputs:
+        raise HTTPException(status_code=404, detail=f"{capture.kind} captures have: {', '.join(sorted(capture.outputs))}")
+    media_type, extension = FORMATS[output]
+    return Response(
+        capture.outputs[output],
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{capture.kind}-{capture.id}.{extension}"'}
+    )
+
+class SimilarCaseRecord(BaseModel):
+    symptoms: str
+    condition: str
+    caseId: Optional[str] = None
+
+@app.get("/api/similar-cases-stats")
+async def similar_cases_stats():
+    """Size and append/compaction counters of the similar-case index"""
+    if similar_cases is None:
+        return {"enabled": False}
+    return {"enabled": True, **similar_cases.stats()}
+
+@app.post("/admin/similar-cases", dependencies=[Depends(require_admin)])
+async def add_similar_cases(cases: List[SimilarCaseRecord]):
+    """Append cases to the similar-case index; they are searchable once this returns"""
+    if similar_cases is None:
+        raise HTTPException(status_code=404, detail="Similar-case search is not enabled (set SIMILAR_CASES_INDEX)")
+    added = await execution.run_io(
+        similar_cases.append,
+        [case.symptoms for case in cases], [case.condition for case in cases], [case.caseId for case in cases],
+    )
+    return {"added": added, **similar_cases.stats()}
+
+@app.get("/api/embedding-stats")
+async def embedding_stats():
+    """Size and lookup counters of the image embedding store"""
+    if image_embeddings is None:
+        return {"enabled": False}
+    return {"enabled": True, "nearDuplicateThreshold": IMAGE_NEAR_DUPLICATE_THRESHOLD, **image_embeddings.stats()}
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: every model component has finished loading"""
+    components = model_registry.status()
+    if model_registry.is_ready():
+        return {"status": "ready", "components": components}
+    return JSONResponse(status_code=503, content={"status": "loading", "components": components})
+
+@app.get("/api/inference-stats")
+async def inference_stats():
+    """Batch size, queue wait and forward time of the image micro-batcher, plus pool sizing"""
+    engine = model_registry.get("image_engine") if model_registry.is_ready("image_engine") else None
+    stats = {
+        "image": {"backend": engine.name if engine is not None else None, **image_batcher.stats()},
+        "execution": execution.stats()
+    }
+    if isinstance(engine, CascadeEngine):
+        stats["cascade"] = engine.stats()
+    return stats
+
+@app.get("/api/admission-stats")
+async def admission_stats():
+    """Concurrency, queue and shedding counters per admission group"""
+    return {group: limiter.stats() for group, limiter in admission_limiters.items()}
+
+# The Places API accepts radii from 1 m to 50 km
+MAX_HOSPITAL_RADIUS = 50000
+
 @app.get("/api/nearby-hospitals")
-async def get_nearby_hospitals(lat: float, lon: float):
-    API_KEY = "YOUR_GOOGLE_MAPS_API_KEY"
-    url = f"https://maps.googleapis.com/maps/api/place/nearbysearch/json?location={lat},{lon}&radius=5000&type=hospital&key={API_KEY}"
-    response = requests.get(url)
-    return response.json().get('results', [])
+async def get_nearby_hospitals(lat: float, lon: float, radius: int = 5000):
+    check_deadline("hospital_lookup")
+    radius = max(1, min(radius, MAX_HOSPITAL_RADIUS))
+    try:
+        with hospital_stages.stage("lookup"):
+            return await hospital_service.nearby(lat, lon, radius)
+    except (httpx.HTTPError, ProviderError) as e:
+        logger.error(f"Error fetching nearby hospitals: {str(e)}")
+        raise HTTPException(status_code=502, detail="Hospital lookup is temporarily unavailable")
+
+@app.get("/api/nearest-hospitals")
+async def get_nearest_hospitals(lat: float, lon: float, n: int = 5):
+    """The n closest hospitals regardless of distance; offline provider only"""
+    provider = hospital_service.provider
+    if not isinstance(provider, OfflineHospitalProvider):
+        raise HTTPException(status_code=501, detail="Nearest-N lookup needs HOSPITAL_PROVIDER=offline")
+    return provider.nearest(lat, lon, max(0, min(n, 100)))
+
+@app.get("/api/hospital-stats")
+async def hospital_stats():
+    """Tile cache and upstream counters for /api/nearby-hospitals"""
+    stats = hospital_service.stats()
+    if isinstance(hospital_service.provider, OfflineHospitalProvider):
+        stats["index"] = hospital_service.provider.index.stats()
+    return stats
+
+def collect_service_metrics():
+    """Expose counters kept by the caches, batcher, pools and hospital service"""
+    caches = {"image": image_cache.stats(), "symptoms": symptom_cache.stats()}
+    for field, kind in (("hits", "counter"), ("disk_hits", "counter"), ("misses", "counter"),
+                        ("coalesced", "counter"), ("evictions", "counter"), ("entries", "gauge"),
+                        ("bytes", "gauge"), ("inflight", "gauge")):
+        suffix = "_total" if kind == "counter" else ""
+        yield (f"healease_result_cache_{field}{suffix}", kind, f"Result cache {field}",
+               [({"cache": name}, stats[field]) for name, stats in caches.items()])
+
+    batcher = image_batcher.stats()
+    yield ("healease_image_queue_depth", "gauge", "Images waiting for a batched forward pass",
+           [({}, batcher["queue_depth"])])
+    yield ("healease_image_queue_wait_seconds_total", "counter", "Total time images waited to be batched",
+           [({}, image_batcher.queue_wait_total)])
+
+    jobs = image_jobs.stats()
+    yield ("healease_image_jobs_queued", "gauge", "Image jobs waiting for a job worker", [({}, jobs["queued"])])
+    yield ("healease_image_jobs_running", "gauge", "Image jobs being processed", [({}, jobs["running"])])
+    for field in ("submitted", "completed", "failed", "rejected"):
+        yield (f"healease_image_jobs_{field}_total", "counter", f"Image jobs {field}", [({}, jobs[field])])
+
+    yield ("healease_pool_pending", "gauge", "Work submitted to an executor pool and not yet finished",
+           [({"pool": pool.name}, pool.pending) for pool in execution.pools()])
+
+    hospitals = hospital_service.stats()
+    for field in ("hits", "stale_hits", "misses", "refreshes", "upstream_errors"):
+        yield (f"healease_hospital_{field}_total", "counter", f"Hospital lookup {field}",
+               [({"provider": hospitals["provider"]}, hospitals[field])])
+
+    yield ("healease_log_records_dropped_total", "counter", "Log records dropped because the writer fell behind",
+           [({}, dropped_records())])
+
+    kb = knowledge.stats()
+    yield ("healease_knowledge_base_info", "gauge", "Active knowledge base version",
+           [({"version": kb["version"]}, 1)])
+    yield ("healease_knowledge_base_loaded_timestamp_seconds", "gauge", "When the active knowledge base was built",
+           [({}, kb["loaded_at"])])
+    yield ("healease_knowledge_base_reloads_total", "counter", "Knowledge base reloads by result",
+           [({"result": "ok"}, kb["reloads"]), ({"result": "failed"}, kb["reload_errors"])])
+
+    if similar_cases is not None:
+        cases = similar_cases.stats()
+        yield ("healease_similar_cases", "gauge", "Cases in the similar-case index", [({}, cases["cases"])])
+        yield ("healease_similar_cases_segments", "gauge", "Segments in the similar-case index",
+               [({}, cases["segments"])])
+
+    engine = model_registry.get("image_engine") if model_registry.is_ready("image_engine") else None
+    if isinstance(engine, CascadeEngine):
+        cascade = engine.stats()
+        yield ("healease_image_cascade_images_total", "counter", "Images answered per cascade stage",
+               [({"stage": stage["name"]}, stage["accepted"]) for stage in cascade["stages"]]
+               + [({"stage": cascade["final"]}, cascade["escalated"])])
+        yield ("healease_image_cascade_escalated_total", "counter", "Images the screening stages escalated to the full model",
+               [({}, cascade["escalated"])])
+
+    if image_embeddings is not None:
+        embeddings = image_embeddings.stats()
+        yield ("healease_image_embeddings", "gauge", "Images in the embedding store", [({}, embeddings["embeddings"])])
+        yield ("healease_image_embedding_lookups_total", "counter", "Embedding store lookups by result",
+               [({"result": "exact"}, embeddings["exact_hits"]),
+                ({"result": "near_duplicate"}, embeddings["near_duplicate_hits"]),
+                ({"result": "miss"}, embeddings["misses"])])
+
+    admission = {group: limiter.stats() for group, limiter in admission_limiters.items()}
+    yield ("healease_admission_active", "gauge", "Requests running under admission control",
+           [({"group": group}, stats["active"]) for group, stats in admission.items()])
+    yield ("healease_admission_queued", "gauge", "Requests waiting for an admission slot",
+           [({"group": group}, stats["queued"]) for group, stats in admission.items()])
+
+    yield ("healease_model_ready", "gauge", "1 once a model component has loaded",
+           [({"component": name}, 1 if info["state"] == "ready" else 0)
+            for name, info in model_registry.status().items()])
+
+REGISTRY.add_collector(collect_service_metrics)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of request, stage and service metrics"""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@app.on_event("startup")
+async def start_model_loading():
+    if MODEL_LOADING == "background":
+        model_registry.start_background()
+    if isinstance(hospital_service.provider, OfflineHospitalProvider):
+        hospital_service.provider.index.start_watching()
+    knowledge.start_watching()
+    if similar_cases is not None:
+        similar_cases.start_watching()
+    image_cache.start_sweep()
+    symptom_cache.start_sweep()
+
+@app.on_event("shutdown")
+async def shutdown_execution():
+    knowledge.stop_watching()
+    if similar_cases is not None:
+        similar_cases.stop_watching()
+    await image_jobs.stop()
+    await image_batcher.stop()
+    if image_embeddings is not None:
+        image_embeddings.flush()
+    await hospital_service.aclose()
+    execution.shutdown()
 
 # Run using: uvicorn main:app --reload
@@ -0,0 +1,291 @@
+# metrics.py
+# Minimal in-process metrics with Prometheus text exposition, for /metrics.
+#
+# Counter, Gauge and Histogram follow the prometheus_client shape
+# (metric.labels(...).inc()/set()/observe()) without the dependency. Bound
+# children are cached per label tuple, so the hot path is a dict lookup, a
+# lock and an add. StageTimer times the stages of one request into a shared
+# histogram. Values that already live elsewhere (cache and batcher counters,
+# pool queue depths) are exported by collectors that run only at scrape time.
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans cache hits (sub-millisecond) to cold CPU inference
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Optional["Registry"] = None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        key = tuple(map(str, values))
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _unlabelled(self):
+        return self.labels()
+
+    def render(self, const_names: Tuple[str, ...] = (), const_values: Tuple[str, ...] = ()) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, const_names + self.labelnames, const_values + key))
+        return lines
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def render(self, name, labelnames, key) -> List[str]:
+        return [f"{name}{_format_labels(labelnames, key)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._unlabelled().inc(amount)
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._unlabelled().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._unlabelled().dec(amount)
+
+    def set(self, value: float):
+        self._unlabelled().set(value)
+
+
+class _Timer:
+    """Context manager that observes its elapsed time; cheaper than a generator-based one"""
+
+    __slots__ = ("target", "start")
+
+    def __init__(self, target: "_HistogramValue"):
+        self.target = target
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.target.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+    def render(self, name, labelnames, key) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f"{name}_bucket{_format_labels(labelnames, key, le)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, key)} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, key)} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional["Registry"] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._unlabelled().observe(value)
+
+
+# A collector returns (name, type, help, [(labels dict, value), ...]) families
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+        # Added to every sample, e.g. which serve.py worker answered the scrape
+        self.const_labels: Dict[str, str] = {}
+
+    def set_const_labels(self, **labels: str):
+        self.const_labels = {name: str(value) for name, value in labels.items()}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Family]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        const_names, const_values = tuple(self.const_labels), tuple(self.const_labels.values())
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render(const_names, const_values))
+        for collector in self._collectors:
+            for name, kind, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    names, values = const_names + tuple(labels), const_values + tuple(labels.values())
+                    lines.append(f"{name}{_format_labels(names, values)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram(
+    "healease_stage_seconds", "Time spent in each stage of a request", ["endpoint", "stage"]
+)
+
+
+class StageTimer:
+    """Times the stages of one endpoint into healease_stage_seconds"""
+
+    def __init__(self, endpoint: str, histogram: Histogram = STAGE_SECONDS):
+        self.endpoint = endpoint
+        self.histogram = histogram
+        self._stages: Dict[str, _HistogramValue] = {}
+
+    def _child(self, name: str) -> _HistogramValue:
+        child = self._stages.get(name)
+        if child is None:
+            child = self._stages[name] = self.histogram.labels(self.endpoint, name)
+        return child
+
+    def stage(self, name: str) -> _Timer:
+        return _Timer(self._child(name))
+
+    def observe(self, name: str, seconds: float):
+        """Record a stage measured elsewhere, e.g. inside a worker process"""
+        self._child(name).observe(seconds)
+
+
+REQUESTS = Counter("healease_requests_total", "HTTP requests by endpoint and status", ["endpoint", "status"])
+REQUEST_SECONDS = Histogram("healease_request_seconds", "End-to-end HTTP request latency", ["endpoint"])
+IN_FLIGHT = Gauge("healease_requests_in_flight", "Requests currently being handled", ["endpoint"])
+
+
+class MetricsMiddleware:
+    """Counts requests, their latency and how many are in flight, per route"""
+
+    def __init__(self, app, routes: Callable[[], Iterable[str]]):
+        self.app = app
+        # Route paths are only known once the app is fully set up; resolve on first use.
+        # Unknown paths share one label so scanners cannot blow up cardinality.
+        self._routes = routes
+        self._known: Optional[set] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self._known is None:
+            self._known = set(self._routes())
+        endpoint = scope["path"] if scope["path"] in self._known else "other"
+        status = "500"
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        in_flight = IN_FLIGHT.labels(endpoint)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+            REQUESTS.labels(endpoint, status).inc()
+
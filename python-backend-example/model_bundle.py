@@ -0,0 +1,111 @@
+# model_bundle.py
+# Pre-built model bundle for fast, offline startup.
+#
+# A bundle is a directory with:
+#   manifest.json              - format version, conditions, training data hash and file names
+#   symptom_classifier.joblib  - the fitted TF-IDF + Naive Bayes pipeline
+#   densenet169_skin.pt        - full densenet169 + classifier state dict
+# Loading never touches the network: the backbone is built without pretrained
+# weights and the state dict is memory-mapped straight into it.
+import datetime
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import joblib
+import torch
+
+from inference_engine import build_image_model
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FORMAT = 1
+MANIFEST_FILE = "manifest.json"
+SYMPTOM_CLASSIFIER_FILE = "symptom_classifier.joblib"
+IMAGE_WEIGHTS_FILE = "densenet169_skin.pt"
+
+
+def bundle_exists(bundle_dir: str) -> bool:
+    return os.path.exists(os.path.join(bundle_dir, MANIFEST_FILE))
+
+
+def read_manifest(bundle_dir: str) -> Dict:
+    with open(os.path.join(bundle_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"Unsupported model bundle format {manifest.get('format')} in {bundle_dir}")
+    return manifest
+
+
+def training_data_digest(training_data: List[Tuple[str, str]]) -> str:
+    return hashlib.sha256(json.dumps([list(pair) for pair in training_data]).encode("utf-8")).hexdigest()
+
+
+def write_bundle(bundle_dir: str, symptom_classifier, image_model: torch.nn.Module,
+                 skin_conditions: List[str], finetuned: bool,
+                 training_data: Optional[List[Tuple[str, str]]] = None):
+    """Serialize the fitted classifier and image model weights into bundle_dir"""
+    os.makedirs(bundle_dir, exist_ok=True)
+    # Uncompressed so numpy arrays can be memory-mapped on load
+    joblib.dump(symptom_classifier, os.path.join(bundle_dir, SYMPTOM_CLASSIFIER_FILE))
+    torch.save(image_model.state_dict(), os.path.join(bundle_dir, IMAGE_WEIGHTS_FILE))
+
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "torch_version": torch.__version__,
+        "skin_conditions": skin_conditions,
+        "finetuned_image_weights": finetuned,
+        "symptom_training_data": training_data_digest(training_data) if training_data is not None else None,
+        "files": {
+            "symptom_classifier": SYMPTOM_CLASSIFIER_FILE,
+            "image_weights": IMAGE_WEIGHTS_FILE,
+        },
+    }
+    with open(os.path.join(bundle_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def load_symptom_classifier(bundle_dir: str, training_data: Optional[List[Tuple[str, str]]] = None):
+    manifest = read_manifest(bundle_dir)
+    bundled = manifest.get("symptom_training_data")
+    if training_data is not None and bundled is not None and bundled != training_data_digest(training_data):
+        raise ValueError("Model bundle classifier was trained on different symptom training data")
+    path = os.path.join(bundle_dir, manifest["files"]["symptom_classifier"])
+    return joblib.load(path, mmap_mode="r")
+
+
+def cached_symptom_classifier(cache_dir: str, training_data: List[Tuple[str, str]],
+                              train: Callable[[List[Tuple[str, str]]], Any]):
+    """Load the classifier for this training data from cache_dir, or train and save it there"""
+    path = os.path.join(cache_dir, f"symptom_classifier-{training_data_digest(training_data)[:16]}.joblib")
+    if os.path.exists(path):
+        try:
+            return joblib.load(path, mmap_mode="r")
+        except Exception as e:
+            logger.warning(f"Could not load cached symptom classifier {path}: {str(e)}")
+    classifier = train(training_data)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        joblib.dump(classifier, tmp)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"Could not cache symptom classifier in {cache_dir}: {str(e)}")
+    return classifier
+
+
+def load_image_model(bundle_dir: str, skin_conditions: List[str]) -> torch.nn.Module:
+    manifest = read_manifest(bundle_dir)
+    if manifest["skin_conditions"] != skin_conditions:
+        raise ValueError(
+            "Model bundle was built for a different condition list; rebuild it with build_bundle.py"
+        )
+    model = build_image_model(len(skin_conditions), pretrained=False)
+    path = os.path.join(bundle_dir, manifest["files"]["image_weights"])
+    # mmap + assign keeps the weights backed by the page cache instead of copying them
+    state = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    model.load_state_dict(state, assign=True)
+    return model.eval()
@@ -0,0 +1,140 @@
+# model_registry.py
+# Lazy / background initialization of heavy models.
+#
+# Each component is registered with a loader function. Loaders run in
+# registration order on a background thread (or synchronously with
+# load_all()), and request handlers ask for a component by name. A component
+# that is not loaded yet raises ModelNotReady, which handlers turn into a 503
+# so the process can serve cheap endpoints and /healthz while models warm up.
+# Handlers waiting for a component park on an asyncio future, woken from the
+# loader thread, so waiting never ties up executor threads. A component whose
+# loader failed stays failed; handlers answer for it without Retry-After.
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class ModelNotReady(Exception):
+    """Raised when a component is requested before it finished loading"""
+
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._values: Dict[str, Any] = {}
+        self._state: Dict[str, str] = {}
+        self._errors: Dict[str, str] = {}
+        self._load_seconds: Dict[str, float] = {}
+        self._events: Dict[str, threading.Event] = {}
+        # name -> (loop, future) of coroutines in wait_ready()
+        self._waiters: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, name: str, loader: Callable[[], Any]):
+        self._loaders[name] = loader
+        self._state[name] = PENDING
+        self._events[name] = threading.Event()
+        self._waiters[name] = []
+
+    def _load(self, name: str):
+        self._state[name] = LOADING
+        started = time.perf_counter()
+        try:
+            self._values[name] = self._loaders[name]()
+            self._state[name] = READY
+            logger.info(f"Loaded {name} in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            self._state[name] = FAILED
+            self._errors[name] = str(e)
+            logger.error(f"Failed to load {name}: {str(e)}")
+        finally:
+            self._load_seconds[name] = time.perf_counter() - started
+            with self._lock:
+                self._events[name].set()
+                waiters, self._waiters[name] = self._waiters[name], []
+            for loop, waiter in waiters:
+                try:
+                    loop.call_soon_threadsafe(_wake, waiter)
+                except RuntimeError:
+                    # That loop has closed
+                    pass
+
+    def load(self, *names: str):
+        """Load the named components on the calling thread, if still pending"""
+        for name in names:
+            if self._state[name] == PENDING:
+                self._load(name)
+
+    def load_all(self):
+        """Load every pending component on the calling thread"""
+        self.load(*self._loaders)
+
+    def start_background(self):
+        """Load every pending component on a daemon thread; safe to call repeatedly"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if all(state != PENDING for state in self._state.values()):
+                return
+            self._thread = threading.Thread(target=self.load_all, name="model-loader", daemon=True)
+            self._thread.start()
+
+    def get(self, name: str) -> Any:
+        if self._state.get(name) != READY:
+            self.start_background()
+            raise ModelNotReady(f"{name} is {self._state.get(name, 'unknown')}")
+        return self._values[name]
+
+    def is_failed(self, name: str) -> bool:
+        return self._state.get(name) == FAILED
+
+    def is_ready(self, name: Optional[str] = None) -> bool:
+        if name is not None:
+            return self._state.get(name) == READY
+        return all(state == READY for state in self._state.values())
+
+    async def wait_ready(self, name: str, timeout: float) -> bool:
+        """Start loading if needed and wait up to timeout seconds for a component"""
+        if self.is_ready(name):
+            return True
+        self.start_background()
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        with self._lock:
+            if self._events[name].is_set():
+                return self.is_ready(name)
+            self._waiters[name].append((loop, waiter))
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                if (loop, waiter) in self._waiters[name]:
+                    self._waiters[name].remove((loop, waiter))
+        return self.is_ready(name)
+
+    def status(self) -> Dict[str, Dict]:
+        return {
+            name: {
+                "state": self._state[name],
+                "load_seconds": round(self._load_seconds[name], 3) if name in self._load_seconds else None,
+                **({"error": self._errors[name]} if name in self._errors else {}),
+            }
+            for name in self._loaders
+        }
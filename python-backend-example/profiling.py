@@ -0,0 +1,436 @@
+# profiling.py
+# On-demand profiling captures for the admin endpoints.
+#
+#   torch        torch.profiler over the next N images through the forward pass:
+#                operator CPU time and memory (table) and a Chrome trace (chrome)
+#   cprofile     cProfile of the event-loop thread over the next N requests (pstats, text)
+#   sample       statistical sampler of every thread over the next N requests,
+#                as collapsed stacks for flamegraph.pl / speedscope (collapsed)
+#   tracemalloc  allocation diff between the start and the end of the next N
+#                requests, by line (text) and by allocating stack (collapsed)
+#
+# A capture ends after its count or its time limit, whichever comes first, and
+# its outputs stay downloadable in memory until newer captures push it out.
+# A capture profiles only the process that started it. With a directory (set
+# by serve.py for its workers), captures are also written there, so any
+# worker can report and serve them.
+# Nothing is installed while no capture runs: the request hook and the forward
+# pass only check one attribute.
+import cProfile
+import io
+import json
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import torch
+import torch.profiler
+
+KINDS = ("torch", "cprofile", "sample", "tracemalloc")
+
+# Output format -> (media type, file extension)
+FORMATS = {
+    "chrome": ("application/json", "json"),
+    "table": ("text/plain; charset=utf-8", "txt"),
+    "text": ("text/plain; charset=utf-8", "txt"),
+    "pstats": ("application/octet-stream", "pstats"),
+    "collapsed": ("text/plain; charset=utf-8", "collapsed"),
+}
+
+# Leaf frames of threads that are parked, not working
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+
+
+class CaptureBusy(Exception):
+    pass
+
+
+class Capture:
+    kind = "base"
+    unit = "requests"
+
+    def __init__(self, limit: int, seconds: float):
+        self.id = uuid.uuid4().hex[:12]
+        self.limit = limit
+        self.seconds = seconds
+        self.state = "running"
+        self.count = 0
+        self.pid = os.getpid()
+        self.started = time.time()
+        self.finished: Optional[float] = None
+        self.error: Optional[str] = None
+        self.outputs: Dict[str, bytes] = {}
+
+    def begin(self):
+        pass
+
+    def end(self):
+        raise NotImplementedError
+
+    def info(self) -> Dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "limit": self.limit,
+            "unit": self.unit,
+            "count": self.count,
+            "pid": self.pid,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+            "formats": sorted(self.outputs),
+        }
+
+
+class StoredCapture(Capture):
+    """A capture read back from the shared directory, possibly taken by another process"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "info.json"), encoding="utf-8") as f:
+            self._info = json.load(f)
+        self.id = self._info["id"]
+        self.kind = self._info["kind"]
+        self.state = self._info["state"]
+        self._outputs: Optional[Dict[str, bytes]] = None
+
+    @property
+    def outputs(self) -> Dict[str, bytes]:
+        # Read on first use; listing captures only needs their info
+        if self._outputs is None:
+            self._outputs = {}
+            for name in self._info["formats"]:
+                with open(os.path.join(self.path, name), "rb") as f:
+                    self._outputs[name] = f.read()
+        return self._outputs
+
+    def info(self) -> Dict:
+        return self._info
+
+
+class CProfileCapture(Capture):
+    kind = "cprofile"
+
+    def begin(self):
+        # Must be enabled and disabled on the event-loop thread
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def end(self):
+        self.profile.disable()
+        fd, path = tempfile.mkstemp(suffix=".pstats")
+        os.close(fd)
+        try:
+            self.profile.dump_stats(path)
+            with open(path, "rb") as f:
+                self.outputs["pstats"] = f.read()
+        finally:
+            os.remove(path)
+        text = io.StringIO()
+        pstats.Stats(self.profile, stream=text).sort_stats("cumulative").print_stats(60)
+        self.outputs["text"] = text.getvalue().encode("utf-8")
+
+
+class SamplingCapture(Capture):
+    kind = "sample"
+
+    def __init__(self, limit: int, seconds: float, interval: float):
+        super().__init__(limit, seconds)
+        self.interval = interval
+        self.samples = 0
+        self._stacks: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def begin(self):
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or frame.f_code.co_filename.endswith(_IDLE_FILES):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(stack))
+                self._stacks[key] = self._stacks.get(key, 0) + 1
+                self.samples += 1
+
+    def end(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        lines = (f"{stack} {count}" for stack, count in sorted(self._stacks.items()))
+        self.outputs["collapsed"] = ("\n".join(lines) + "\n").encode("utf-8")
+
+    def info(self) -> Dict:
+        return {**super().info(), "samples": self.samples, "interval_ms": self.interval * 1000.0}
+
+
+class TracemallocCapture(Capture):
+    kind = "tracemalloc"
+
+    FILTERS = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ]
+
+    def __init__(self, limit: int, seconds: float, frames: int = 16):
+        super().__init__(limit, seconds)
+        self.frames = frames
+        self._started_tracing = False
+
+    def begin(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        self._before = tracemalloc.take_snapshot().filter_traces(self.FILTERS)
+
+    def end(self):
+        after = tracemalloc.take_snapshot().filter_traces(self.FILTERS)
+        if self._started_tracing:
+            tracemalloc.stop()
+        by_line = after.compare_to(self._before, "lineno")
+        lines = [f"Top allocation changes over {self.count} requests"]
+        lines.extend(str(stat) for stat in by_line[:60])
+        self.outputs["text"] = ("\n".join(lines) + "\n").encode("utf-8")
+        collapsed = []
+        for stat in after.compare_to(self._before, "traceback"):
+            if stat.size_diff <= 0:
+                continue
+            # Frames run from the oldest call to the allocation, as collapsed stacks expect
+            frames = [f"{os.path.basename(frame.filename)}:{frame.lineno}" for frame in stat.traceback]
+            collapsed.append(f"{';'.join(frames)} {stat.size_diff}")
+        self.outputs["collapsed"] = ("\n".join(collapsed) + "\n").encode("utf-8")
+        self._before = None
+
+
+class TorchCapture(Capture):
+    kind = "torch"
+    unit = "images"
+
+    def __init__(self, limit: int, seconds: float):
+        super().__init__(limit, seconds)
+        self._events: List[Dict] = []
+        self._operators: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def run(self, fn: Callable, *args):
+        """Call fn(*args) for a batch under torch.profiler and keep its events"""
+        batch = args[-1]
+        with torch.profiler.profile(
+            activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True, profile_memory=True
+        ) as prof:
+            result = fn(*args)
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            prof.export_chrome_trace(path)
+            with open(path, encoding="utf-8") as f:
+                events = json.load(f).get("traceEvents", [])
+        finally:
+            os.remove(path)
+        with self._lock:
+            if self.state != "running":
+                return result
+            self._events.extend(events)
+            for event in prof.key_averages():
+                row = self._operators.setdefault(event.key, [0, 0.0, 0.0, 0, 0])
+                row[0] += event.count
+                row[1] += event.cpu_time_total
+                row[2] += event.self_cpu_time_total
+                row[3] += event.cpu_memory_usage
+                row[4] += event.self_cpu_memory_usage
+            self.count += len(batch)
+        return result
+
+    def end(self):
+        with self._lock:
+            self.outputs["chrome"] = json.dumps({"traceEvents": self._events}).encode("utf-8")
+            lines = [f"{'operator':<48} {'calls':>8} {'self cpu ms':>12} {'cpu ms':>12} "
+                     f"{'self mem MB':>12} {'mem MB':>10}"]
+            ranked = sorted(self._operators.items(), key=lambda item: -item[1][2])
+            for name, (calls, total, own, memory, own_memory) in ranked[:80]:
+                lines.append(f"{name[:48]:<48} {calls:>8} {own / 1000:>12.2f} {total / 1000:>12.2f} "
+                             f"{own_memory / 2**20:>12.2f} {memory / 2**20:>10.2f}")
+            self.outputs["table"] = ("\n".join(lines) + "\n").encode("utf-8")
+            self._events, self._operators = [], {}
+
+
+class ProfileManager:
+    """Starts captures, counts requests and images toward them and keeps their outputs"""
+
+    def __init__(self, keep: int = 8, sample_interval: float = 0.005, directory: Optional[str] = None):
+        self.keep = keep
+        self.sample_interval = sample_interval
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.captures: "OrderedDict[str, Capture]" = OrderedDict()
+        # Checked on every request and forward pass; None / empty while idle
+        self.torch_capture: Optional[TorchCapture] = None
+        self.request_captures: List[Capture] = []
+        self._lock = threading.Lock()
+
+    def start(self, kind: str, limit: int, seconds: float, loop=None) -> Capture:
+        """Begin a capture; call from the event-loop thread"""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown capture kind '{kind}'. Choose one of: {', '.join(KINDS)}")
+        with self._lock:
+            running = [c for c in self.captures.values() if c.state == "running" and c.kind == kind]
+            if running:
+                raise CaptureBusy(f"A {kind} capture is already running ({running[0].id})")
+            if kind == "torch":
+                capture = TorchCapture(limit, seconds)
+            elif kind == "cprofile":
+                capture = CProfileCapture(limit, seconds)
+            elif kind == "sample":
+                capture = SamplingCapture(limit, seconds, self.sample_interval)
+            else:
+                capture = TracemallocCapture(limit, seconds)
+            capture.begin()
+            self.captures[capture.id] = capture
+            while len(self.captures) > self.keep:
+                oldest = next(iter(self.captures.values()))
+                if oldest.state == "running":
+                    break
+                self.captures.popitem(last=False)
+            if kind == "torch":
+                self.torch_capture = capture
+            else:
+                self.request_captures = self.request_captures + [capture]
+        self._save(capture)
+        if loop is not None:
+            loop.call_later(seconds, self.finish, capture)
+        return capture
+
+    def run_forward(self, fn: Callable, *args):
+        """fn(*args), profiled when a torch capture is running; the batch is the last argument"""
+        capture = self.torch_capture
+        if capture is None:
+            return fn(*args)
+        result = capture.run(fn, *args)
+        if capture.count >= capture.limit:
+            self.finish(capture)
+        return result
+
+    def request_finished(self):
+        """Count one finished request toward the running request captures (event-loop thread)"""
+        for capture in self.request_captures:
+            capture.count += 1
+            if capture.count >= capture.limit:
+                self.finish(capture)
+
+    def finish(self, capture: Capture):
+        with self._lock:
+            if capture.state != "running":
+                return
+            capture.state = "finishing"
+            if capture is self.torch_capture:
+                self.torch_capture = None
+            self.request_captures = [c for c in self.request_captures if c is not capture]
+        try:
+            capture.end()
+            capture.state = "done"
+        except Exception as e:
+            capture.state = "failed"
+            capture.error = str(e)
+        capture.finished = time.time()
+        self._save(capture)
+
+    def _save(self, capture: Capture):
+        """Write a capture's info (and outputs, once finished) to the shared directory"""
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, capture.id)
+        try:
+            os.makedirs(path, exist_ok=True)
+            for name, data in capture.outputs.items():
+                with open(os.path.join(path, name), "wb") as f:
+                    f.write(data)
+            # Written last and replaced atomically, so readers never see formats that are not there yet
+            tmp = os.path.join(path, f"info.json.{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(capture.info(), f)
+            os.replace(tmp, os.path.join(path, "info.json"))
+        except OSError as e:
+            capture.error = capture.error or f"Could not save capture: {str(e)}"
+        self._prune()
+
+    def _stored_ids(self) -> List[str]:
+        """Capture ids in the shared directory, oldest first"""
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.is_dir()]
+        except OSError:
+            return []
+        return [entry.name for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime)]
+
+    def _prune(self):
+        stored = self._stored_ids()
+        for capture_id in stored[:max(0, len(stored) - self.keep)]:
+            capture = self.captures.get(capture_id) or self._load(capture_id)
+            if capture is not None and capture.state == "running":
+                continue
+            shutil.rmtree(os.path.join(self.directory, capture_id), ignore_errors=True)
+
+    def _load(self, capture_id: str) -> Optional[Capture]:
+        if not self.directory or not capture_id.isalnum():
+            return None
+        try:
+            return StoredCapture(os.path.join(self.directory, capture_id))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def get(self, capture_id: str) -> Optional[Capture]:
+        capture = self.captures.get(capture_id)
+        if capture is None:
+            capture = self._load(capture_id)
+        return capture
+
+    def list(self) -> List[Dict]:
+        infos = {capture.id: capture.info() for capture in self.captures.values()}
+        if self.directory:
+            for capture_id in self._stored_ids():
+                if capture_id not in infos:
+                    stored = self._load(capture_id)
+                    if stored is not None:
+                        infos[capture_id] = stored.info()
+        return sorted(infos.values(), key=lambda info: -info["started"])
+
+
+class ProfilingMiddleware:
+    """Counts finished requests toward running request captures"""
+
+    def __init__(self, app, manager: ProfileManager, exclude_prefixes=("/admin/", "/metrics")):
+        self.app = app
+        self.manager = manager
+        self.exclude_prefixes = tuple(exclude_prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if not self.manager.request_captures or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if not scope["path"].startswith(self.exclude_prefixes):
+                self.manager.request_finished()
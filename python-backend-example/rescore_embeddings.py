@@ -0,0 +1,84 @@
+# rescore_embeddings.py
+# Apply a new classifier head to every embedding in the image embedding store.
+#
+#   python rescore_embeddings.py --store image_embeddings --weights new_head.pth
+#   python rescore_embeddings.py --store image_embeddings --weights new_model.pth --out rescored.csv
+#
+# The weights are a full model state dict (as saved for medical_image_model.pth)
+# or a head-only one. Only the head runs, over the stored backbone features in
+# batches read straight from the memory map, so even a large store is re-scored
+# in seconds. The report compares the new top-1 with the prediction stored when
+# each image was analyzed; --out writes one row per stored image.
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import torch
+
+from embedding_store import EmbeddingStore
+from image_preprocess import DESCRIPTOR_DIM
+from inference_engine import BACKBONE_FEATURES, load_classifier_head
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def rescore():
+    parser = argparse.ArgumentParser(description="Re-score stored image embeddings with a new classifier head")
+    parser.add_argument("--store", default=os.path.join(HERE, "image_embeddings"), help="IMAGE_EMBEDDING_STORE directory")
+    parser.add_argument("--weights", required=True, help="model or classifier-head state dict")
+    parser.add_argument("--conditions", default=os.path.join(HERE, "medical_conditions.json"))
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--out", help="write key, stored and new prediction per image to this CSV")
+    args = parser.parse_args()
+
+    with open(args.conditions, encoding="utf-8") as f:
+        conditions = json.load(f)["skin_conditions"]
+    store = EmbeddingStore(args.store, BACKBONE_FEATURES, DESCRIPTOR_DIM)
+    head = load_classifier_head(args.weights, len(conditions))
+    count = store.count
+
+    started = time.perf_counter()
+    predictions = np.empty(count, dtype=np.int64)
+    confidences = np.empty(count, dtype=np.float32)
+    with torch.inference_mode():
+        for start in range(0, count, args.batch_size):
+            end = min(start + args.batch_size, count)
+            outputs = head(torch.from_numpy(np.ascontiguousarray(store.embeddings[start:end])))
+            confidence, predicted = outputs.max(dim=1)
+            predictions[start:end] = predicted.numpy()
+            confidences[start:end] = confidence.numpy()
+    elapsed = time.perf_counter() - started
+
+    stored = np.asarray(store.predictions[:count], dtype=np.int64)
+    changed = int((stored != predictions).sum())
+    logger.info(
+        f"Re-scored {count} embeddings in {elapsed:.2f}s ({count / max(elapsed, 1e-9):.0f}/s); "
+        f"top-1 changed for {changed} ({changed / max(count, 1):.1%})"
+    )
+    moves = {}
+    for old, new in zip(stored[stored != predictions], predictions[stored != predictions]):
+        moves[(old, new)] = moves.get((old, new), 0) + 1
+    for (old, new), n in sorted(moves.items(), key=lambda item: -item[1])[:10]:
+        logger.info(f"  {conditions[old]} -> {conditions[new]}: {n}")
+
+    if args.out:
+        with open(args.out, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["key", "stored", "rescored", "confidence"])
+            for row in range(count):
+                writer.writerow([
+                    store.keys[row].tobytes().hex(), conditions[stored[row]],
+                    conditions[predictions[row]], f"{confidences[row]:.4f}",
+                ])
+        logger.info(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    rescore()
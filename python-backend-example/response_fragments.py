@@ -0,0 +1,142 @@
+# response_fragments.py
+# Pre-encoded JSON pieces for the analysis responses.
+#
+# Everything about a condition except its probability is static: name,
+# description, recommendations per medical system and, for skin conditions,
+# visual characteristics. ResponseFragments encodes those parts once per
+# condition at load time, and the response builders only format the numbers
+# and join bytes. The output is the same bytes FastAPI's JSONResponse would
+# produce for the equivalent dict (compact separators, UTF-8, same key order),
+# so cached values and clients see no difference. Responses are sent as-is
+# with RawJSONResponse, skipping jsonable_encoder and json.dumps.
+import json
+from typing import Any, Dict, List, Sequence, Tuple
+
+from fastapi.responses import Response
+
+
+def dumps(value: Any) -> bytes:
+    # Same settings as starlette's JSONResponse.render
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def encode_number(value) -> bytes:
+    """A number exactly as json.dumps writes it"""
+    if isinstance(value, float):
+        return float.__repr__(value).encode()
+    return int.__repr__(value).encode()
+
+
+def append_field(body: bytes, name: str, value: Any) -> bytes:
+    """An encoded JSON object with one more field at the end"""
+    return body[:-1] + b',' + dumps(name) + b":" + dumps(value) + b"}"
+
+
+def urgency_for(severity) -> bytes:
+    return b'"high"' if severity >= 7 else b'"medium"' if severity >= 4 else b'"low"'
+
+
+class RawJSONResponse(Response):
+    """Response for bodies that are already encoded JSON"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            return bytes(content)
+        return dumps(content)
+
+
+class ResponseFragments:
+    def __init__(self, medical_conditions: Dict, image_training_data: Dict):
+        self.allopathy = medical_conditions.get("Allopathy", {})
+        self.ayurveda = medical_conditions.get("Ayurveda_recommendations", {})
+        self.homeopathy = medical_conditions.get("Homeopathy_recommendations", {})
+        self.image_training_data = image_training_data
+
+        # condition -> (prefix up to "probability":, suffix after the number)
+        self._symptom: Dict[str, Tuple[bytes, bytes]] = {}
+        for condition in self.allopathy:
+            self.symptom_fragment(condition)
+
+        # Indexed like the classifier's outputs: (prefix, suffix, visual score or None)
+        self.image: List[Tuple[bytes, bytes, Any]] = [
+            self._image_fragment(condition) for condition in medical_conditions.get("skin_conditions", [])
+        ]
+
+    def _recommendations(self, condition: str) -> bytes:
+        return dumps({
+            "allopathy": self.allopathy.get(condition, ""),
+            "ayurveda": self.ayurveda.get(condition, ""),
+            "homeopathy": self.homeopathy.get(condition, ""),
+        })
+
+    def symptom_fragment(self, condition: str) -> Tuple[bytes, bytes]:
+        fragment = self._symptom.get(condition)
+        if fragment is None:
+            fragment = (
+                b'{"name":' + dumps(condition) + b',"probability":',
+                b',"description":' + dumps(self.allopathy.get(condition, ""))
+                + b',"recommendations":' + self._recommendations(condition) + b"}",
+            )
+            self._symptom[condition] = fragment
+        return fragment
+
+    def _image_fragment(self, condition: str) -> Tuple[bytes, bytes, Any]:
+        training_data = self.image_training_data.get(condition, {})
+        visual_score = None
+        if training_data:
+            weights = training_data.get("confidence_weights", {})
+            visual_score = weights.get("color", 0.3) + weights.get("texture", 0.3) + weights.get("pattern", 0.4)
+        visual = dumps({
+            "patterns": training_data.get("visual_patterns", []),
+            "colors": training_data.get("colors", []),
+            "textures": training_data.get("textures", []),
+        })
+        return (
+            b'{"name":' + dumps(condition) + b',"probability":',
+            b',"description":' + dumps(self.allopathy.get(condition, ""))
+            + b',"visual_characteristics":' + visual
+            + b',"recommendations":' + self._recommendations(condition) + b"}",
+            visual_score,
+        )
+
+    def symptom_response(self, scores: Sequence[tuple], severity_hits: int) -> bytes:
+        """Encoded symptom analysis response for the top 3 (condition, score) pairs"""
+        top = sorted(scores, key=lambda x: x[1], reverse=True)[:3]
+        severity = severity_hits * 2
+        if top:
+            severity = min(10, severity + max(score for _, score in top) * 5)
+        parts = []
+        for condition, score in top:
+            prefix, suffix = self.symptom_fragment(condition)
+            parts.append(prefix + encode_number(int(score * 100)) + suffix)
+        return (
+            b'{"possibleConditions":[' + b",".join(parts)
+            + b'],"severity":' + encode_number(int(severity))
+            + b',"urgency":' + urgency_for(severity) + b"}"
+        )
+
+    def image_response(self, top_probs, top_indices) -> bytes:
+        """Encoded image analysis response for the classifier's top-k outputs"""
+        parts = []
+        max_probability = None
+        for prob, idx in zip(top_probs, top_indices):
+            prefix, suffix, visual_score = self.image[int(idx)]
+            confidence_score = float(prob)
+            if visual_score is not None:
+                confidence_score = (confidence_score + visual_score) / 2
+            probability = min(confidence_score * 100, 100)
+            if max_probability is None or probability > max_probability:
+                max_probability = probability
+            parts.append(prefix + encode_number(probability) + suffix)
+        severity = int(max_probability / 20)
+        return (
+            b'{"possibleConditions":[' + b",".join(parts)
+            + b'],"severity":' + encode_number(severity)
+            + b',"urgency":' + urgency_for(severity) + b"}"
+        )
+
+    @staticmethod
+    def error_response(message: str) -> bytes:
+        return b'{"error":' + dumps(message) + b',"possibleConditions":[],"severity":0,"urgency":"low"}'
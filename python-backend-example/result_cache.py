@@ -0,0 +1,299 @@
+# result_cache.py
+# Content-addressed cache for analysis results.
+#
+# Keys are hashes of the request content (image bytes, or normalized symptom
+# text + medical system). Entries live in an in-memory LRU bounded by entry
+# count and approximate size, expire after a TTL, and can optionally be written
+# to a directory so they survive restarts. The disk tier never blocks the event
+# loop: reads run on the given executor, writes are queued to it behind the
+# response (and skipped when too many are already queued), and the sweep of
+# expired files runs there too, once start_sweep() is called. get_or_compute()
+# coalesces concurrent identical requests: only the first computes, the rest
+# await the same future, unless it fails with the first caller's own deadline.
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Executor
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from admission import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+
+def content_key(*parts) -> str:
+    """sha256 over the given parts (bytes or str), separated so they cannot run together"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def _size_of(value: Any) -> int:
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return len(json.dumps(value, default=str))
+
+
+def _failed_for_its_caller(future: asyncio.Future) -> bool:
+    """The shared computation ended with its caller's deadline or cancellation"""
+    if not future.done():
+        return False
+    return future.cancelled() or isinstance(future.exception(), DeadlineExceeded)
+
+
+class ResultCache:
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: float = 3600.0,
+        disk_dir: Optional[str] = None,
+        executor: Optional[Executor] = None,
+        max_pending_writes: int = 1000,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self.disk_dir = os.path.join(disk_dir, name) if disk_dir else None
+        # Runs disk reads, writes and the sweep; None uses the loop's default executor
+        self.executor = executor
+        self.max_pending_writes = max_pending_writes
+        self._pending_writes = 0
+        self._pending_lock = threading.Lock()
+
+        # key -> (value, expires_at, size)
+        self._entries: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.disk_writes_skipped = 0
+
+    # -- memory tier --------------------------------------------------------
+
+    def _drop(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _store(self, key: str, value: Any, expires_at: float):
+        size = _size_of(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (value, expires_at, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _memory_get(self, key: str, now: float) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at, _ = entry
+        if expires_at > now:
+            self._entries.move_to_end(key)
+            return value
+        self._drop(key)
+        self.expirations += 1
+        return None
+
+    async def get(self, key: str) -> Optional[Any]:
+        return (await self.get_many([key]))[0]
+
+    async def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        """Cached values (None for misses) for several keys, reading the disk tier in one executor call"""
+        now = time.time()
+        values = [self._memory_get(key, now) for key in keys]
+        self.hits += sum(value is not None for value in values)
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing and self.disk_dir:
+            records = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._disk_read_many, [keys[i] for i in missing], now
+            )
+            for i, record in zip(missing, records):
+                if record is not None:
+                    values[i], expires_at = record
+                    # Promote back into memory
+                    self._store(keys[i], values[i], expires_at)
+                    self.disk_hits += 1
+        self.misses += sum(value is None for value in values)
+        return values
+
+    def put(self, key: str, value: Any):
+        expires_at = time.time() + self.ttl
+        self._store(key, value, expires_at)
+        if self.disk_dir:
+            self._queue_disk_write(key, value, expires_at)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Return a cached value, or compute it once even if many callers ask concurrently
+
+        The computation runs in the first caller's request. If it fails for
+        reasons of that caller alone (its deadline passed, or it was cancelled
+        because its client went away), the callers coalesced onto it do not get
+        that failure: they start a computation of their own.
+        """
+        value = await self.get(key)
+        if value is not None:
+            return value
+
+        while True:
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except (DeadlineExceeded, asyncio.CancelledError):
+                # Our own cancellation leaves the shared future running
+                if not _failed_for_its_caller(inflight):
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; mark the exception as retrieved
+            future.exception()
+            raise
+        else:
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    # -- disk tier ----------------------------------------------------------
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key + ".json")
+
+    def _disk_read_many(self, keys: List[str], now: float) -> List[Optional[Tuple[Any, float]]]:
+        return [self._disk_read(key, now) for key in keys]
+
+    def _disk_read(self, key: str, now: float) -> Optional[Tuple[Any, float]]:
+        """(value, expires_at) from the disk tier; runs on the executor"""
+        path = self._disk_path(key)
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if record.get("expires_at", 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        # Encoded responses are stored as text and come back as bytes
+        value = record["raw"].encode("utf-8") if "raw" in record else record["value"]
+        return value, record["expires_at"]
+
+    def _queue_disk_write(self, key: str, value: Any, expires_at: float):
+        with self._pending_lock:
+            if self._pending_writes >= self.max_pending_writes:
+                # The disk is not keeping up; the entry stays in memory only
+                self.disk_writes_skipped += 1
+                return
+            self._pending_writes += 1
+        try:
+            asyncio.get_running_loop().run_in_executor(self.executor, self._disk_write, key, value, expires_at)
+        except RuntimeError:
+            # No event loop (scripts, tests): write inline
+            self._disk_write(key, value, expires_at)
+
+    def _disk_write(self, key: str, value: Any, expires_at: float):
+        """Write one entry to the disk tier; runs on the executor"""
+        try:
+            self._disk_put(key, value, expires_at)
+        finally:
+            with self._pending_lock:
+                self._pending_writes -= 1
+
+    def _disk_put(self, key: str, value: Any, expires_at: float):
+        path = self._disk_path(key)
+        try:
+            if isinstance(value, (bytes, bytearray)):
+                record = {"expires_at": expires_at, "raw": bytes(value).decode("utf-8")}
+            else:
+                record = {"expires_at": expires_at, "value": value}
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(record, f)
+            os.replace(tmp, path)
+        except (OSError, TypeError, UnicodeDecodeError) as e:
+            logger.warning(f"Could not write {self.name} cache entry to disk: {str(e)}")
+
+    def start_sweep(self):
+        """Remove expired disk entries left over from previous runs, on the executor"""
+        if self.disk_dir:
+            asyncio.get_running_loop().run_in_executor(self.executor, self._sweep_disk)
+
+    def _sweep_disk(self):
+        now = time.time()
+        removed = 0
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    with open(path) as f:
+                        if json.load(f).get("expires_at", 0) > now:
+                            continue
+                except (OSError, ValueError):
+                    pass
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        if removed:
+            logger.info(f"Removed {removed} expired {self.name} cache entries from disk")
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "disk_tier": self.disk_dir is not None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "disk_writes_pending": self._pending_writes,
+            "disk_writes_skipped": self.disk_writes_skipped,
+            "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "inflight": len(self._inflight),
+        }
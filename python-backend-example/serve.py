@@ -0,0 +1,223 @@
+# serve.py
+# Pre-fork server: load models once, then fork workers that share them.
+#
+#   python serve.py --workers 4 --port 8000
+#
+# The master imports main.py and loads the symptom classifier, the image model
+# weights and the medical knowledge base once. It then freezes the
+# garbage collector (so collections in the workers never touch, and copy, the
+# pages holding those objects) and forks the workers. Workers share the
+# weights copy-on-write. Weights loaded from a model bundle are memory-mapped,
+# so those pages are shared through the page cache as well.
+#
+# Every worker runs a uvicorn server on the socket the master bound. Torch
+# intra-op threads are split so all workers together use one thread per core.
+# Inference backends that own native thread pools (ONNX Runtime, compiled
+# graphs) are built in each worker after the fork, never in the master. The
+# master restarts workers that die, and stops them all on SIGTERM/SIGINT.
+#
+# Runtime state is per worker: metrics, the /api/*-stats counters, admission
+# limits, result caches and micro-batchers. Every /metrics sample carries a
+# worker="<slot>" label (slots are kept across restarts), so a scrape that
+# lands on any worker reads consistent per-worker series; sum over the label
+# for the whole server. Profiling captures run in the worker that was asked,
+# and are written to a shared PROFILE_DIR so any worker can serve them.
+import argparse
+import gc
+import logging
+import os
+import random
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger("serve")
+
+# Components that are plain tensors / Python objects and safe to share across fork
+SHARED_COMPONENTS = ("symptom_classifier", "image_model")
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def watch_parent(master_pid: int):
+    """Stop this worker if the master goes away"""
+    while True:
+        time.sleep(1.0)
+        if os.getppid() != master_pid:
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+
+
+def run_worker(main, sock: socket.socket, args, master_pid: int, slot: int):
+    import uvicorn
+    from metrics import REGISTRY
+
+    # Undo the master's handlers; uvicorn installs its own for graceful shutdown
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    random.seed()
+    threading.Thread(target=watch_parent, args=(master_pid,), name="parent-watch", daemon=True).start()
+    REGISTRY.set_const_labels(worker=slot)
+
+    main.execution.configure_torch()
+    # Per-worker components, such as the inference engine, load here after the fork
+    main.model_registry.load_all()
+
+    config = uvicorn.Config(
+        main.app,
+        log_config=None,
+        access_log=args.access_log,
+        timeout_keep_alive=args.keep_alive,
+        lifespan="on",
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    def __init__(self, main, sock: socket.socket, args):
+        self.main = main
+        self.sock = sock
+        self.args = args
+        self.workers = {}  # pid -> (slot, started_at)
+        self.stopping = False
+        self.failures = 0
+
+    def spawn(self):
+        # Reuse the lowest free slot, so a restarted worker keeps its metrics label
+        used = {slot for slot, _ in self.workers.values()}
+        slot = next(n for n in range(len(used) + 1) if n not in used)
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.main, self.sock, self.args, self.master_pid, slot)
+            except BaseException:
+                logger.exception("Worker crashed")
+                code = 1
+            finally:
+                from structured_logging import stop_logging
+                stop_logging()
+                os._exit(code)
+        self.workers[pid] = (slot, time.monotonic())
+        logger.info(f"Started worker {slot} (pid {pid})")
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            slot, started = self.workers.pop(pid, (None, time.monotonic()))
+            if not self.stopping:
+                lifetime = time.monotonic() - started
+                self.failures = self.failures + 1 if lifetime < 10 else 0
+                logger.warning(f"Worker {slot} (pid {pid}) exited with status {status} after {lifetime:.1f}s")
+
+    def run(self):
+        self.master_pid = os.getpid()
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for _ in range(self.args.workers):
+            self.spawn()
+
+        while not self.stopping:
+            time.sleep(0.5)
+            self.reap()
+            while not self.stopping and len(self.workers) < self.args.workers:
+                if self.failures:
+                    # Workers dying at startup: back off instead of fork-bombing
+                    time.sleep(min(30.0, 2 ** min(self.failures, 5)))
+                    if self.stopping:
+                        break
+                self.spawn()
+
+        logger.info("Stopping workers")
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.args.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.reap()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-fork server sharing loaded models across workers")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--keep-alive", type=int, default=5)
+    parser.add_argument("--graceful-timeout", type=float, default=30.0)
+    parser.add_argument("--access-log", action="store_true")
+    args = parser.parse_args()
+
+    # Decide the thread split before torch is imported. Each worker runs
+    # INFERENCE_WORKERS concurrent forward passes; together they get one
+    # intra-op thread per core.
+    cores = os.cpu_count() or 1
+    inference_workers = int(os.environ.get("INFERENCE_WORKERS", "1"))
+    threads = max(1, cores // (args.workers * inference_workers))
+    os.environ.setdefault("TORCH_NUM_THREADS", str(threads))
+    os.environ.setdefault("OMP_NUM_THREADS", os.environ["TORCH_NUM_THREADS"])
+    # The master loads explicitly; workers must not start a background loader
+    os.environ["MODEL_LOADING"] = "lazy"
+    # Captures taken by one worker are readable from the others
+    own_profile_dir = None
+    if not os.environ.get("PROFILE_DIR"):
+        own_profile_dir = os.environ["PROFILE_DIR"] = tempfile.mkdtemp(prefix="healease-profiles-")
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main as app_module
+
+    started = time.perf_counter()
+    app_module.model_registry.load(*SHARED_COMPONENTS)
+    failed = [n for n in SHARED_COMPONENTS if not app_module.model_registry.is_ready(n)]
+    if failed:
+        logger.error(f"Could not load {', '.join(failed)}; workers will retry on demand")
+    logger.info(
+        f"Loaded shared models in {time.perf_counter() - started:.1f}s; forking {args.workers} workers "
+        f"with {os.environ['TORCH_NUM_THREADS']} torch threads each"
+    )
+
+    sock = bind_socket(args.host, args.port, args.backlog)
+    # Move everything allocated so far out of the collector's reach so that
+    # collections in the workers do not write to (and un-share) those pages
+    gc.collect()
+    gc.freeze()
+    try:
+        Supervisor(app_module, sock, args).run()
+    finally:
+        sock.close()
+        if own_profile_dir:
+            shutil.rmtree(own_profile_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,517 @@
+# similar_cases.py
+# Top-k retrieval of past cases with similar symptom descriptions.
+#
+# Texts are hashed into a fixed feature space (word unigrams and bigrams,
+# English stop words dropped, HashingVectorizer), so there is no vocabulary to
+# rebuild when cases are added. Weighting is the classic lnc.ltc scheme: each
+# case stores its length-normalized log term frequencies and never changes
+# once written, while the query is weighted by log tf * idf from the current
+# document frequencies and normalized. The score is the cosine between the two.
+#
+# The index is a list of immutable segments. Each holds an inverted index
+# (per term, the cases using it, highest weight first) and a forward index
+# (per case, its terms and weights). Appends add a new segment and swap the
+# list in one assignment; compaction merges segments back into one. A saved
+# index is a directory of .npy files per segment plus manifest.json, opened
+# with mmap_mode="r": opening costs nothing up front, pages are shared between
+# forked workers and only the postings a query touches are read.
+# Appends and compaction take an exclusive flock on the directory's lock file
+# and reload the manifest under it, so serve.py workers and build_case_index.py
+# can write to one index; every segment gets a directory name that is never
+# reused, so files another process has mapped are never overwritten.
+#
+# Search reads at most max_postings postings per segment: rarest query terms
+# first, and within a term the highest weights first, so the budget goes to
+# the postings that can move a case up the most. The best `rerank` cases by
+# partial score are then rescored exactly from the forward index. When the
+# budget covers every posting the result is exact; otherwise `python
+# benchmark.py similar` reports recall against exhaustive scoring (about 97%
+# of the true top 20 over a synthetic 1M-case corpus at the defaults, in
+# under 10 ms per query).
+import csv
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+DEFAULT_FEATURES = 1 << 20
+MANIFEST = "manifest.json"
+SEGMENT_FILES = ("terms", "indptr", "doc_ids", "weights", "row_indptr", "row_terms", "row_weights",
+                 "case_ids", "conditions")
+
+# (case id, condition, cosine similarity)
+SimilarCase = Tuple[str, str, float]
+
+
+def make_vectorizer(n_features: int) -> HashingVectorizer:
+    return HashingVectorizer(
+        n_features=n_features, ngram_range=(1, 2), stop_words="english", alternate_sign=False, norm=None,
+        dtype=np.float32,
+    )
+
+
+def case_weights(counts: sp.csr_matrix) -> sp.csr_matrix:
+    """Length-normalized log term frequencies, one row per case"""
+    weights = counts.tocsr(copy=True)
+    weights.sum_duplicates()
+    np.log(weights.data, out=weights.data)
+    weights.data += 1
+    norms = np.sqrt(np.asarray(weights.multiply(weights).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    weights.data /= np.repeat(norms, np.diff(weights.indptr)).astype(weights.data.dtype)
+    return weights
+
+
+_TEXT_FIELDS = ("symptoms", "text", "notes")
+_CONDITION_FIELDS = ("condition", "diagnosis", "label")
+_ID_FIELDS = ("caseId", "case_id", "id")
+
+
+def _first(row: Dict, fields) -> Optional[str]:
+    for field in fields:
+        value = row.get(field)
+        if value not in (None, ""):
+            return str(value)
+    return None
+
+
+def load_cases(path: str) -> Tuple[List[str], List[str], List[Optional[str]]]:
+    """(texts, conditions, case ids) from a .csv, .jsonl or .json list of case records"""
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, newline="" if ext == ".csv" else None, encoding="utf-8") as f:
+        if ext == ".csv":
+            rows = list(csv.DictReader(f))
+        elif ext == ".jsonl":
+            rows = [json.loads(line) for line in f if line.strip()]
+        elif ext == ".json":
+            rows = json.load(f)
+        else:
+            raise ValueError(f"Unsupported case file format: {path}")
+    texts, conditions, case_ids = [], [], []
+    for row in rows:
+        text, condition = _first(row, _TEXT_FIELDS), _first(row, _CONDITION_FIELDS)
+        if text is None or condition is None:
+            continue
+        texts.append(text)
+        conditions.append(condition)
+        case_ids.append(_first(row, _ID_FIELDS))
+    return texts, conditions, case_ids
+
+
+class Segment:
+    """Immutable index over a contiguous range of cases"""
+
+    def __init__(self, terms, indptr, doc_ids, weights, row_indptr, row_terms, row_weights,
+                 case_ids, conditions, name: str = ""):
+        # Inverted: postings of terms[i] (sorted feature ids) are [indptr[i], indptr[i + 1]),
+        # highest weight first
+        self.terms = terms
+        self.indptr = indptr
+        self.doc_ids = doc_ids        # segment-local case ids
+        self.weights = weights
+        # Forward: the terms and weights of each case, for exact rescoring
+        self.row_indptr = row_indptr
+        self.row_terms = row_terms
+        self.row_weights = row_weights
+        self.case_ids = case_ids      # bytes
+        self.conditions = conditions  # codes into SimilarCaseIndex.conditions
+        self.name = name
+
+    def __len__(self):
+        return len(self.case_ids)
+
+    @classmethod
+    def from_matrix(cls, weights: sp.spmatrix, case_ids: np.ndarray, conditions: np.ndarray, name: str = ""):
+        rows = sp.csr_matrix(weights, dtype=np.float32)
+        rows.sum_duplicates()
+        columns = rows.tocsc()
+        counts = np.diff(columns.indptr)
+        present = np.flatnonzero(counts)
+        indptr = np.zeros(len(present) + 1, dtype=np.int64)
+        np.cumsum(counts[present], out=indptr[1:])
+        # Impact order within each term, so a query can stop after the first postings
+        column_of = np.repeat(np.arange(len(counts)), counts)
+        order = np.lexsort((-columns.data, column_of))
+        return cls(
+            present.astype(np.int32), indptr, columns.indices[order].astype(np.int32), columns.data[order],
+            rows.indptr.astype(np.int64), rows.indices.astype(np.int32), rows.data,
+            case_ids, conditions.astype(np.int16), name,
+        )
+
+    def to_matrix(self, n_features: int) -> sp.csr_matrix:
+        return sp.csr_matrix((self.row_weights, self.row_terms, self.row_indptr), shape=(len(self), n_features))
+
+    def lookup(self, terms: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(positions of the given sorted feature ids that occur here, mask over terms)"""
+        pos = np.searchsorted(self.terms, terms)
+        found = pos < len(self.terms)
+        found[found] = self.terms[pos[found]] == terms[found]
+        return pos[found], found
+
+    def document_frequency(self, terms: np.ndarray) -> np.ndarray:
+        df = np.zeros(len(terms), dtype=np.int64)
+        pos, found = self.lookup(terms)
+        df[found] = self.indptr[pos + 1] - self.indptr[pos]
+        return df
+
+    def score(self, ids: np.ndarray, query_map: np.ndarray) -> np.ndarray:
+        """Exact cosine of the given cases against a dense query vector"""
+        starts = self.row_indptr[ids]
+        lengths = self.row_indptr[ids + 1] - starts
+        entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        contribution = query_map[self.row_terms[entries]] * self.row_weights[entries]
+        return np.bincount(np.repeat(np.arange(len(ids)), lengths), contribution, len(ids)).astype(np.float32)
+
+    def save(self, path: str):
+        # Fails rather than truncate files another process may have mapped
+        os.makedirs(path)
+        for field in SEGMENT_FILES:
+            np.save(os.path.join(path, f"{field}.npy"), np.asarray(getattr(self, field)))
+
+    @classmethod
+    def load(cls, path: str, name: str = ""):
+        # Plain ndarray views of the maps: slicing a np.memmap costs more than the read itself
+        arrays = [np.load(os.path.join(path, f"{field}.npy"), mmap_mode="r").view(np.ndarray) for field in SEGMENT_FILES]
+        return cls(*arrays, name=name)
+
+
+class _Scratch(threading.local):
+    """Per-thread score accumulator and dense query vector, left zeroed after every query"""
+
+    def __init__(self):
+        self.scores = np.zeros(0, dtype=np.float32)
+        self.query_map = np.zeros(0, dtype=np.float32)
+
+    def get(self, cases: int, n_features: int) -> Tuple[np.ndarray, np.ndarray]:
+        if len(self.scores) < cases:
+            self.scores = np.zeros(cases, dtype=np.float32)
+        if len(self.query_map) != n_features:
+            self.query_map = np.zeros(n_features, dtype=np.float32)
+        return self.scores, self.query_map
+
+
+class SimilarCaseIndex:
+    """Segmented inverted index of past cases, searchable by symptom text"""
+
+    def __init__(self, path: Optional[str] = None, n_features: int = DEFAULT_FEATURES,
+                 max_postings: int = 100000, rerank: int = 2048, max_segments: int = 8, poll_seconds: float = 0.0):
+        self.path = path
+        self.n_features = n_features
+        # Postings read per query and segment (0: all, exact), and partial-score candidates rescored exactly
+        self.max_postings = max_postings
+        self.rerank = rerank
+        self.max_segments = max_segments
+        self.poll_seconds = poll_seconds
+        self.vectorizer = make_vectorizer(n_features)
+        self.conditions: List[str] = []
+        self._condition_codes: Dict[str, int] = {}
+        # (first global case id, segment); replaced, never mutated
+        self.segments: Tuple[Tuple[int, Segment], ...] = ()
+        self.generation = 0
+        self.loaded_at = time.time()
+        self.appends = 0
+        self.compactions = 0
+        self._lock = threading.Lock()
+        self._scratch = _Scratch()
+        self._manifest_mtime: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def open(cls, path: str, **kwargs) -> "SimilarCaseIndex":
+        """Memory-map the index saved at path, or start an empty one that will be saved there"""
+        index = cls(path, **kwargs)
+        if os.path.exists(os.path.join(path, MANIFEST)):
+            index._load_manifest()
+            logger.info(f"Opened similar-case index {path}: {len(index)} cases in {len(index.segments)} segment(s)")
+        return index
+
+    def __len__(self):
+        segments = self.segments
+        return segments[-1][0] + len(segments[-1][1]) if segments else 0
+
+    # -- persistence ----------------------------------------------------------
+
+    def _read_manifest(self) -> Dict:
+        with open(os.path.join(self.path, MANIFEST), encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported similar-case index format in {self.path}: {manifest.get('format')}")
+        return manifest
+
+    def _load_manifest(self):
+        mtime = os.path.getmtime(os.path.join(self.path, MANIFEST))
+        manifest = self._read_manifest()
+        if manifest["n_features"] != self.n_features:
+            self.n_features = manifest["n_features"]
+            self.vectorizer = make_vectorizer(self.n_features)
+        # Keep the segments that are already mapped
+        opened = {segment.name: segment for _, segment in self.segments}
+        segments, base = [], 0
+        for name in manifest["segments"]:
+            segment = opened.get(name) or Segment.load(os.path.join(self.path, name), name)
+            segments.append((base, segment))
+            base += len(segment)
+        for code in range(len(self.conditions), len(manifest["conditions"])):
+            self._condition_codes[manifest["conditions"][code]] = code
+            self.conditions.append(manifest["conditions"][code])
+        self.segments = tuple(segments)
+        self.generation = manifest["generation"]
+        self._manifest_mtime = mtime
+        self.loaded_at = time.time()
+
+    def _write_manifest(self, segments, generation: int):
+        manifest = {
+            "format": FORMAT_VERSION,
+            "n_features": self.n_features,
+            "generation": generation,
+            "cases": sum(len(segment) for _, segment in segments),
+            "conditions": self.conditions,
+            "segments": [segment.name for _, segment in segments],
+        }
+        path = os.path.join(self.path, MANIFEST)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        # Readers see the old or the new segment list, never a partial one
+        os.replace(tmp, path)
+        self._manifest_mtime = os.path.getmtime(path)
+
+    def _publish(self, segments: List[Tuple[int, Segment]], new: Sequence[Segment] = ()):
+        """Persist new segments and the manifest if the index has a path, then swap the list in"""
+        generation = self.generation + 1
+        if self.path:
+            for segment in new:
+                segment.save(os.path.join(self.path, segment.name))
+            self._write_manifest(segments, generation)
+        self.segments = tuple(segments)
+        self.generation = generation
+
+    def _segment_name(self) -> str:
+        # The suffix keeps names unique even across indexes that diverged
+        return f"segment-{self.generation + 1:06d}-{uuid.uuid4().hex[:12]}"
+
+    @contextmanager
+    def _locked(self):
+        """Thread lock plus, for a saved index, an exclusive flock shared with other processes
+
+        The manifest is reloaded under the lock, so writes start from the
+        segments every other process has published.
+        """
+        with self._lock:
+            if not self.path:
+                yield
+                return
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, "lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    if os.path.exists(os.path.join(self.path, MANIFEST)):
+                        self._load_manifest()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def reload_if_changed(self) -> bool:
+        """Pick up segments another process appended or compacted"""
+        if not self.path:
+            return False
+        try:
+            mtime = os.path.getmtime(os.path.join(self.path, MANIFEST))
+        except OSError:
+            return False
+        if mtime == self._manifest_mtime:
+            return False
+        with self._lock:
+            try:
+                self._load_manifest()
+            except Exception as e:
+                logger.error(f"Failed to reload similar-case index {self.path}: {str(e)}")
+                return False
+        logger.info(f"Reloaded similar-case index {self.path}: {len(self)} cases")
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_seconds):
+            self.reload_if_changed()
+
+    def start_watching(self):
+        if self.path and self.poll_seconds > 0 and (self._thread is None or not self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="similar-cases-watch", daemon=True)
+            self._thread.start()
+
+    def stop_watching(self):
+        self._stop.set()
+
+    # -- writes ---------------------------------------------------------------
+
+    def _condition_code(self, condition: str) -> int:
+        code = self._condition_codes.get(condition)
+        if code is None:
+            code = self._condition_codes[condition] = len(self.conditions)
+            self.conditions.append(condition)
+        return code
+
+    def append(self, texts: Sequence[str], conditions: Sequence[str],
+               case_ids: Optional[Sequence[Optional[str]]] = None) -> int:
+        """Add cases as a new segment; they are searchable once this returns"""
+        if len(texts) != len(conditions) or (case_ids is not None and len(case_ids) != len(texts)):
+            raise ValueError("texts, conditions and case_ids must have the same length")
+        if not texts:
+            return 0
+        # Hashing needs no shared state, so the expensive part runs outside the lock
+        weights = case_weights(self.vectorizer.transform([text.lower() for text in texts]))
+        with self._locked():
+            if weights.shape[1] != self.n_features:
+                # The index on disk was rebuilt with another feature space meanwhile
+                weights = case_weights(self.vectorizer.transform([text.lower() for text in texts]))
+            first = len(self)
+            ids = [
+                str(case_ids[i]) if case_ids is not None and case_ids[i] not in (None, "") else str(first + i)
+                for i in range(len(texts))
+            ]
+            codes = np.array([self._condition_code(str(c)) for c in conditions], dtype=np.int16)
+            segment = Segment.from_matrix(weights, np.array([i.encode("utf-8") for i in ids]), codes,
+                                          self._segment_name())
+            self._publish(list(self.segments) + [(first, segment)], [segment])
+            self.appends += 1
+            compact = len(self.segments) > self.max_segments
+        if compact:
+            self.compact()
+        return len(texts)
+
+    def compact(self) -> bool:
+        """Merge all segments into one; False if there was nothing to merge"""
+        with self._locked():
+            old = self.segments
+            if len(old) < 2:
+                return False
+            started = time.perf_counter()
+            matrix = sp.vstack([segment.to_matrix(self.n_features) for _, segment in old], format="csr")
+            width = max(segment.case_ids.dtype.itemsize for _, segment in old)
+            case_ids = np.concatenate([np.asarray(segment.case_ids).astype(f"S{width}") for _, segment in old])
+            codes = np.concatenate([np.asarray(segment.conditions) for _, segment in old])
+            merged = Segment.from_matrix(matrix, case_ids, codes, self._segment_name())
+            self._publish([(0, merged)], [merged])
+            self.compactions += 1
+            if self.path:
+                # Open memory maps keep the old files readable until queries drop them
+                for _, segment in old:
+                    shutil.rmtree(os.path.join(self.path, segment.name), ignore_errors=True)
+        logger.info(f"Compacted {len(old)} similar-case segments in {time.perf_counter() - started:.2f}s")
+        return True
+
+    # -- search ---------------------------------------------------------------
+
+    def _query(self, text: str, segments) -> Tuple[np.ndarray, np.ndarray]:
+        """Sorted feature ids of the query and their normalized log tf * idf weights"""
+        counts = self.vectorizer.transform([text.lower()])
+        counts.sum_duplicates()
+        terms = counts.indices.astype(np.int32)
+        order = np.argsort(terms)
+        terms, tf = terms[order], counts.data[order].astype(np.float64)
+        df = sum(segment.document_frequency(terms) for _, segment in segments)
+        total = sum(len(segment) for _, segment in segments)
+        weights = (1 + np.log(tf)) * (np.log((1 + total) / (1 + df)) + 1)
+        # Terms no case uses still count towards the query length, as in a plain cosine
+        weights /= np.sqrt(weights @ weights)
+        keep = df > 0
+        return terms[keep], weights[keep].astype(np.float32)
+
+    def _search_segment(self, segment: Segment, terms, query, k: int, floor: float):
+        """Local ids and scores of the segment's top k cases scoring above floor"""
+        pos, found = segment.lookup(terms)
+        if not len(pos):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        weights = query[found]
+        lengths = segment.indptr[pos + 1] - segment.indptr[pos]
+        scores, query_map = self._scratch.get(len(segment), self.n_features)
+        touched: List[np.ndarray] = []
+        left, truncated = self.max_postings, False
+        try:
+            # Rarest terms first, each term's highest weights first, until the budget is spent
+            for i in np.argsort(lengths, kind="stable"):
+                if self.max_postings and left <= 0:
+                    truncated = True
+                    break
+                start, end = segment.indptr[pos[i]], segment.indptr[pos[i] + 1]
+                if self.max_postings and end - start > left:
+                    end = start + left
+                    truncated = True
+                ids = segment.doc_ids[start:end]
+                # Weights are positive, so a zero score marks a case not seen yet
+                touched.append(ids[scores[ids] == 0])
+                scores[ids] += weights[i] * segment.weights[start:end]
+                left -= end - start
+            candidates = np.concatenate(touched)
+            result = scores[candidates]
+        finally:
+            for ids in touched:
+                scores[ids] = 0
+        if truncated:
+            # Partial scores only pick the candidates; rescore the best of them exactly
+            if len(candidates) > self.rerank:
+                top = np.argpartition(result, len(result) - self.rerank)[len(result) - self.rerank:]
+                candidates = candidates[top]
+            query_map[terms] = query
+            try:
+                result = segment.score(candidates, query_map)
+            finally:
+                query_map[terms] = 0
+        keep = result > floor
+        candidates, result = candidates[keep], result[keep]
+        if len(candidates) > k:
+            top = np.argpartition(result, len(result) - k)[len(result) - k:]
+            candidates, result = candidates[top], result[top]
+        return candidates.astype(np.int64), result
+
+    def search(self, text: str, k: int = 5, min_similarity: float = 0.0) -> List[SimilarCase]:
+        """The k cases most similar to text, best first, above min_similarity"""
+        segments = self.segments
+        if not segments or k <= 0:
+            return []
+        terms, query = self._query(text, segments)
+        if not len(terms):
+            return []
+        found: List[Tuple[float, int, Segment, int]] = []
+        threshold = min_similarity
+        # Largest segment first: it sets the bar the small ones have to clear
+        for base, segment in sorted(segments, key=lambda s: -len(s[1])):
+            ids, scores = self._search_segment(segment, terms, query, k, threshold)
+            found.extend((float(s), base + int(i), segment, int(i)) for i, s in zip(ids, scores))
+            if len(found) >= k:
+                found = sorted(found, key=lambda f: (-f[0], f[1]))[:k]
+                threshold = max(threshold, found[-1][0])
+        found.sort(key=lambda f: (-f[0], f[1]))
+        return [
+            (bytes(segment.case_ids[i]).decode("utf-8"), self.conditions[int(segment.conditions[i])], score)
+            for score, _, segment, i in found[:k]
+        ]
+
+    def stats(self) -> Dict:
+        segments = self.segments
+        return {
+            "path": self.path,
+            "cases": len(self),
+            "segments": len(segments),
+            "postings": sum(len(segment.doc_ids) for _, segment in segments),
+            "conditions": len(self.conditions),
+            "generation": self.generation,
+            "appends": self.appends,
+            "compactions": self.compactions,
+            "loaded_at": self.loaded_at,
+        }
@@ -0,0 +1,238 @@
+# structured_logging.py
+# Logging that stays off the request hot path.
+#
+# configure_logging() installs a QueueHandler on the root logger; a
+# QueueListener thread does the formatting and writing. Records are queued
+# unformatted, so messages, payloads and tracebacks are only rendered on the
+# writer thread, and only for records that are actually emitted. If the
+# writer falls behind, new records are dropped (and counted) rather than
+# blocking requests.
+#
+# log_event() adds per-endpoint sampling (warnings and errors are never
+# sampled away) and structured fields. Payload fields are redacted or
+# truncated when they are formatted, so patient symptom text never reaches
+# the log in full unless LOG_PAYLOADS=full.
+#
+# Settings (environment):
+#   LOG_LEVEL          default INFO
+#   LOG_FORMAT         json (default) or text
+#   LOG_QUEUE_SIZE     records buffered for the writer thread (default 10000)
+#   LOG_SAMPLE_RATES   e.g. "/api/analyze-symptoms=0.01,/api/analyze-image=0.1,*=1"
+#   LOG_PAYLOADS       redact (default), truncate or full
+#   LOG_PAYLOAD_CHARS  longest string kept when truncating (default 120)
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from typing import Any, Dict, Optional
+
+# Request fields that carry patient-provided text
+SENSITIVE_FIELDS = {"symptoms", "symptoms_text", "text"}
+MAX_LIST_ITEMS = 5
+MAX_DEPTH = 4
+
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for part in spec.split(","):
+        if "=" in part:
+            endpoint, _, rate = part.partition("=")
+            rates[endpoint.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class Sampler:
+    """Per-endpoint probability of keeping an info/debug record"""
+
+    def __init__(self, rates: Dict[str, float]):
+        self.rates = dict(rates)
+        self.default = self.rates.pop("*", 1.0)
+
+    def allow(self, endpoint: Optional[str], level: int) -> bool:
+        if level >= logging.WARNING:
+            return True
+        rate = self.rates.get(endpoint, self.default)
+        return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+
+class PayloadRedactor:
+    """Shrinks payloads at format time: redacts or truncates sensitive text, caps size"""
+
+    def __init__(self, mode: str = "redact", max_chars: int = 120):
+        self.mode = mode
+        self.max_chars = max_chars
+
+    def _text(self, value: str, sensitive: bool) -> Any:
+        if sensitive and self.mode == "redact":
+            return {"redacted": True, "chars": len(value)}
+        if self.mode != "full" and len(value) > self.max_chars:
+            return value[:self.max_chars] + f"...(+{len(value) - self.max_chars} chars)"
+        return value
+
+    def shrink(self, value: Any, sensitive: bool = False, depth: int = 0) -> Any:
+        dump = getattr(value, "model_dump", None) or getattr(value, "dict", None)
+        if callable(dump) and not isinstance(value, dict):
+            # pydantic models are converted here, on the writer thread
+            value = dump()
+        if isinstance(value, (bytes, bytearray)):
+            # Pre-encoded JSON responses are decoded here, like pydantic models above
+            try:
+                value = json.loads(value)
+            except ValueError:
+                return f"<{len(value)} bytes>"
+        if isinstance(value, str):
+            return self._text(value, sensitive)
+        if depth >= MAX_DEPTH and self.mode != "full":
+            return "..."
+        if isinstance(value, dict):
+            return {k: self.shrink(v, sensitive or k in SENSITIVE_FIELDS, depth + 1) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            items = [self.shrink(v, sensitive, depth + 1) for v in value[:MAX_LIST_ITEMS if self.mode != "full" else None]]
+            if self.mode != "full" and len(value) > MAX_LIST_ITEMS:
+                items.append(f"...(+{len(value) - MAX_LIST_ITEMS} items)")
+            return items
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        return self._text(str(value), sensitive)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message plus structured fields"""
+
+    def __init__(self, redactor: PayloadRedactor):
+        super().__init__()
+        self.redactor = redactor
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = self.redactor.shrink(value, key in SENSITIVE_FIELDS)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Classic single-line format with structured fields appended as key=value"""
+
+    def __init__(self, redactor: PayloadRedactor):
+        super().__init__("%(levelname)s:%(name)s:%(message)s")
+        self.redactor = redactor
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = {
+            k: self.redactor.shrink(v, k in SENSITIVE_FIELDS)
+            for k, v in record.__dict__.items()
+            if k not in _RESERVED and not k.startswith("_")
+        }
+        if fields:
+            line += " " + " ".join(f"{k}={json.dumps(v, default=str)}" for k, v in fields.items())
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that defers all formatting to the listener and never blocks"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare() formats the message here, on the caller's thread.
+        # Records are handed over as they are; callers must not mutate logged objects.
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _LoggingState:
+    sampler = Sampler({})
+    handler: Optional[DroppingQueueHandler] = None
+    listener: Optional[logging.handlers.QueueListener] = None
+    target: Optional[logging.Handler] = None
+    queue_size = 10000
+
+
+_state = _LoggingState()
+
+
+def _start_listener():
+    log_queue = queue.Queue(maxsize=_state.queue_size)
+    _state.handler.queue = log_queue
+    _state.listener = logging.handlers.QueueListener(log_queue, _state.target, respect_handler_level=True)
+    _state.listener.start()
+
+
+def _restart_after_fork():
+    # The writer thread does not survive fork, and the old queue's lock may be held
+    if _state.handler is not None:
+        _start_listener()
+
+
+def stop_logging():
+    if _state.listener is not None:
+        _state.listener.stop()
+        _state.listener = None
+
+
+def configure_logging():
+    """Route all logging through a background writer; safe to call more than once"""
+    level = getattr(logging, os.environ.get("LOG_LEVEL", "INFO").upper(), logging.INFO)
+    redactor = PayloadRedactor(
+        os.environ.get("LOG_PAYLOADS", "redact"), int(os.environ.get("LOG_PAYLOAD_CHARS", "120"))
+    )
+    _state.sampler = Sampler(parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", "")))
+    _state.queue_size = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+    target = logging.StreamHandler(sys.stderr)
+    if os.environ.get("LOG_FORMAT", "json") == "text":
+        target.setFormatter(TextFormatter(redactor))
+    else:
+        target.setFormatter(JsonFormatter(redactor))
+
+    root = logging.getLogger()
+    stop_logging()
+    if _state.handler is not None:
+        root.removeHandler(_state.handler)
+    else:
+        atexit.register(stop_logging)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=_restart_after_fork)
+
+    _state.target = target
+    _state.handler = DroppingQueueHandler(queue.Queue(maxsize=_state.queue_size))
+    _start_listener()
+    root.addHandler(_state.handler)
+    root.setLevel(level)
+
+
+def log_event(logger: logging.Logger, level: int, endpoint: Optional[str], message: str, **fields):
+    """Log a sampled, structured event; nothing is built unless it will be kept"""
+    if not logger.isEnabledFor(level) or not _state.sampler.allow(endpoint, level):
+        return
+    if endpoint is not None:
+        fields["endpoint"] = endpoint
+    logger.log(level, message, extra=fields)
+
+
+def dropped_records() -> int:
+    return _state.handler.dropped if _state.handler is not None else 0
@@ -0,0 +1,46 @@
+# stub_places_server.py
+# Local stand-in for the Google Places Nearby Search API, for tests and load runs.
+#
+#   uvicorn stub_places_server:app --port 8081
+#   PLACES_BASE_URL=http://localhost:8081 uvicorn main:app
+#
+# Returns a deterministic set of synthetic hospitals around the requested
+# location. STUB_PLACES_LATENCY_MS adds an artificial delay per request.
+import asyncio
+import hashlib
+import math
+import os
+
+from fastapi import FastAPI
+
+app = FastAPI()
+
+STUB_PLACES_LATENCY_MS = float(os.environ.get("STUB_PLACES_LATENCY_MS", "0"))
+STUB_PLACES_COUNT = int(os.environ.get("STUB_PLACES_COUNT", "10"))
+
+
+@app.get("/maps/api/place/nearbysearch/json")
+async def nearby_search(location: str, radius: int = 5000, type: str = "hospital", key: str = ""):
+    if STUB_PLACES_LATENCY_MS:
+        await asyncio.sleep(STUB_PLACES_LATENCY_MS / 1000.0)
+    lat, lon = (float(v) for v in location.split(","))
+
+    results = []
+    for i in range(STUB_PLACES_COUNT):
+        seed = hashlib.sha256(f"{lat:.5f},{lon:.5f},{i}".encode()).digest()
+        # Spread points deterministically within the radius
+        distance = radius * (seed[0] / 255.0)
+        bearing = 2 * math.pi * (seed[1] / 255.0)
+        d_lat = distance * math.cos(bearing) / 111_320.0
+        d_lon = distance * math.sin(bearing) / (111_320.0 * max(math.cos(math.radians(lat)), 1e-6))
+        place_id = "stub-" + seed[:8].hex()
+        results.append({
+            "place_id": place_id,
+            "name": f"Stub Hospital {i + 1}",
+            "vicinity": f"{i + 1} Example Road",
+            "geometry": {"location": {"lat": lat + d_lat, "lng": lon + d_lon}},
+            "types": ["hospital", "health", "point_of_interest", "establishment"],
+            "rating": round(3.0 + seed[2] / 127.5, 1),
+            "business_status": "OPERATIONAL",
+        })
+    return {"results": results, "status": "OK" if results else "ZERO_RESULTS"}
@@ -0,0 +1,154 @@
+# symptom_engines.py
+# Selectable scoring engines for /api/analyze-symptoms.
+#
+#   keyword   SymptomScorer: keyword hits plus word overlap with the training phrases
+#   tfidf_nb  the trained TF-IDF + MultinomialNB pipeline
+#   hybrid    a weighted blend of the two, over every condition either one scores
+#
+# Every engine returns what SymptomScorer.score does: (condition, score) pairs
+# plus the number of severity indicators in the text, so the response builders
+# do not care which engine ran.
+#
+# NaiveBayesScorer compiles the fitted pipeline into its arrays (vocabulary,
+# idf weights, per-class log probabilities) and computes predict_proba directly:
+# a dense gather for one text, one sparse matrix product for a batch. That
+# skips sklearn's per-call validation and pipeline dispatch. The arrays are
+# used in place, so a memory-mapped joblib model stays shared. Probabilities
+# match predict_proba to floating-point rounding.
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+ENGINES = ("keyword", "tfidf_nb", "hybrid")
+
+Scored = Tuple[List[Tuple[str, float]], int]
+
+
+class NaiveBayesScorer:
+    """predict_proba of a fitted TfidfVectorizer + MultinomialNB pipeline, without sklearn overhead"""
+
+    def __init__(self, pipeline):
+        vectorizer, classifier = pipeline.steps[0][1], pipeline.steps[-1][1]
+        if vectorizer.norm not in ("l2", None) or vectorizer.sublinear_tf:
+            raise ValueError("NaiveBayesScorer supports l2 or no normalization without sublinear tf")
+        self.pipeline = pipeline
+        self.analyzer = vectorizer.build_analyzer()
+        self.vocabulary: Dict[str, int] = vectorizer.vocabulary_
+        self.idf = vectorizer.idf_ if vectorizer.use_idf else np.ones(len(self.vocabulary))
+        self.normalize = vectorizer.norm == "l2"
+        self.classes: List[str] = [str(c) for c in classifier.classes_]
+        # (features, classes) view of the (possibly memory-mapped) log probabilities
+        self.feature_log_prob = classifier.feature_log_prob_.T
+        self.class_log_prior = np.asarray(classifier.class_log_prior_, dtype=np.float64)
+
+    def _term_counts(self, text: str) -> Counter:
+        vocabulary = self.vocabulary
+        return Counter(i for i in map(vocabulary.get, self.analyzer(text)) if i is not None)
+
+    def _softmax(self, jll: np.ndarray) -> np.ndarray:
+        jll = jll - jll.max(axis=-1, keepdims=True)
+        np.exp(jll, out=jll)
+        jll /= jll.sum(axis=-1, keepdims=True)
+        return jll
+
+    def predict_proba_one(self, text: str) -> np.ndarray:
+        counts = self._term_counts(text)
+        if not counts:
+            return self._softmax(self.class_log_prior.copy())
+        ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        weights = np.fromiter(counts.values(), dtype=np.float64, count=len(counts)) * self.idf[ids]
+        if self.normalize:
+            weights /= np.sqrt(weights @ weights)
+        return self._softmax(weights @ self.feature_log_prob[ids] + self.class_log_prior)
+
+    def predict_proba(self, texts: Sequence[str]) -> np.ndarray:
+        """Class probabilities for many texts from one sparse product, shape (texts, classes)"""
+        indptr, indices, data = [0], [], []
+        for text in texts:
+            counts = self._term_counts(text)
+            indices.extend(counts.keys())
+            data.extend(counts.values())
+            indptr.append(len(indices))
+        indices = np.asarray(indices, dtype=np.int64)
+        data = np.asarray(data, dtype=np.float64) * self.idf[indices]
+        if self.normalize and len(data):
+            row_of = np.repeat(np.arange(len(texts)), np.diff(indptr))
+            norms = np.sqrt(np.bincount(row_of, weights=data * data, minlength=len(texts)))
+            data /= norms[row_of]
+        features = sp.csr_matrix((data, indices, np.asarray(indptr)), shape=(len(texts), len(self.vocabulary)))
+        return self._softmax(features @ self.feature_log_prob + self.class_log_prior)
+
+
+class KeywordEngine:
+    name = "keyword"
+
+    def __init__(self, scorer):
+        self.scorer = scorer
+
+    def score(self, text: str) -> Scored:
+        return self.scorer.score(text)
+
+    def score_batch(self, texts: Sequence[str]) -> List[Scored]:
+        return self.scorer.score_batch(texts)
+
+
+class NaiveBayesEngine:
+    name = "tfidf_nb"
+
+    def __init__(self, scorer, classifier: NaiveBayesScorer):
+        # The keyword scorer still counts severity indicators
+        self.scorer = scorer
+        self.classifier = classifier
+
+    def _scored(self, probabilities: np.ndarray, severity_hits: int) -> Scored:
+        return [(c, float(p)) for c, p in zip(self.classifier.classes, probabilities) if p > 0], severity_hits
+
+    def score(self, text: str) -> Scored:
+        return self._scored(self.classifier.predict_proba_one(text), self.scorer.severity_hits(text))
+
+    def score_batch(self, texts: Sequence[str]) -> List[Scored]:
+        if not texts:
+            return []
+        probabilities = self.classifier.predict_proba(texts)
+        return [self._scored(row, self.scorer.severity_hits(text)) for row, text in zip(probabilities, texts)]
+
+
+class HybridEngine:
+    """keyword_weight * keyword score + (1 - keyword_weight) * classifier probability"""
+
+    name = "hybrid"
+
+    def __init__(self, scorer, classifier: NaiveBayesScorer, keyword_weight: float = 0.5):
+        self.scorer = scorer
+        self.classifier = classifier
+        self.keyword_weight = keyword_weight
+
+    def _blend(self, keyword: Scored, probabilities: np.ndarray) -> Scored:
+        w = self.keyword_weight
+        blended = {condition: w * score for condition, score in keyword[0]}
+        for condition, probability in zip(self.classifier.classes, probabilities):
+            blended[condition] = blended.get(condition, 0.0) + (1 - w) * float(probability)
+        # Severity indicators come from the keyword pass
+        return [(c, s) for c, s in blended.items() if s > 0], keyword[1]
+
+    def score(self, text: str) -> Scored:
+        return self._blend(self.scorer.score(text), self.classifier.predict_proba_one(text))
+
+    def score_batch(self, texts: Sequence[str]) -> List[Scored]:
+        if not texts:
+            return []
+        return [self._blend(k, p) for k, p in zip(self.scorer.score_batch(texts), self.classifier.predict_proba(texts))]
+
+
+def create_symptom_engine(name: str, scorer, classifier=None, keyword_weight: float = 0.5):
+    if name == "keyword":
+        return KeywordEngine(scorer)
+    if classifier is None:
+        raise ValueError(f"The {name} engine needs the symptom classifier")
+    if name == "tfidf_nb":
+        return NaiveBayesEngine(scorer, classifier)
+    if name == "hybrid":
+        return HybridEngine(scorer, classifier, keyword_weight)
+    raise ValueError(f"Unknown symptom engine {name!r}; expected one of {', '.join(ENGINES)}")
@@ -0,0 +1,295 @@
+# symptom_scoring.py
+# Precompiled symptom-scoring index used by /api/analyze-symptoms.
+#
+# Everything that used to be rebuilt on every request (keyword lists, the
+# per-condition training examples and their word sets) is compiled once here:
+#   - a token vocabulary and an inverted index token -> training examples
+#   - a single Aho-Corasick automaton for keywords, severity words and body parts
+# Scores are accumulated in the same order as the original loop so the floats
+# come out bit-for-bit identical.
+#
+# score_batch() scores many texts at once: a sparse document-term matrix is
+# multiplied against the example-term matrix, and the per-text feature rows are
+# multiplied against a per-condition weight matrix with SciPy.
+from collections import defaultdict
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+
+class PatternMatcher:
+    """Aho-Corasick automaton that finds every pattern occurring as a substring in one pass"""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Set[str]] = [set()]
+
+        for pattern in dict.fromkeys(patterns):
+            if not pattern:
+                continue
+            self.patterns.append(pattern)
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(set())
+                state = nxt
+            self._out[state].add(pattern)
+
+        # Breadth-first pass to wire failure links and merge outputs
+        queue = list(self._goto[0].values())
+        while queue:
+            next_queue = []
+            for state in queue:
+                for ch, nxt in self._goto[state].items():
+                    fail = self._fail[state]
+                    while fail and ch not in self._goto[fail]:
+                        fail = self._fail[fail]
+                    self._fail[nxt] = self._goto[fail].get(ch, 0)
+                    self._out[nxt] |= self._out[self._fail[nxt]]
+                    next_queue.append(nxt)
+            queue = next_queue
+
+        # Freeze outputs so the hot loop only does truthiness checks
+        self._out_frozen = [frozenset(out) for out in self._out]
+
+    def find(self, text: str) -> Set[str]:
+        """Return the set of patterns that occur anywhere in text"""
+        goto, fail, out = self._goto, self._fail, self._out_frozen
+        found: Set[str] = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found |= out[state]
+        return found
+
+
+class SymptomScorer:
+    """Scores symptom text against every condition using indexes built once at startup"""
+
+    KEYWORD_WEIGHT = 0.3
+    EXAMPLE_WEIGHT = 0.4
+    SEVERITY_STEP = 0.1
+    SEVERITY_CAP = 0.3
+    LOCATION_BONUS = 0.1
+
+    def __init__(
+        self,
+        conditions: Sequence[str],
+        condition_keywords: Dict[str, List[str]],
+        training_data: Sequence[Tuple[str, str]],
+        severity_words: Sequence[str],
+        body_parts: Sequence[str],
+        severity_indicators: Sequence[str],
+    ):
+        self.conditions = list(conditions)
+        self.condition_keywords = {c: list(condition_keywords.get(c, [])) for c in self.conditions}
+        self.severity_words = list(severity_words)
+        self.body_parts = list(body_parts)
+        self.severity_indicators = list(severity_indicators)
+
+        # Token vocabulary and inverted index: token id -> example ids
+        self.vocabulary: Dict[str, int] = {}
+        self.postings: List[List[int]] = []
+        self.example_lengths: List[int] = []
+        self.example_conditions: List[int] = []
+
+        condition_index = {c: i for i, c in enumerate(self.conditions)}
+        for example, label in training_data:
+            if label not in condition_index:
+                continue
+            example_id = len(self.example_lengths)
+            words = set(example.lower().split())
+            self.example_lengths.append(len(words))
+            self.example_conditions.append(condition_index[label])
+            for word in words:
+                token_id = self.vocabulary.get(word)
+                if token_id is None:
+                    token_id = len(self.postings)
+                    self.vocabulary[word] = token_id
+                    self.postings.append([])
+                self.postings[token_id].append(example_id)
+
+        self.matcher = PatternMatcher(
+            [kw for c in self.conditions for kw in self.condition_keywords[c]]
+            + self.severity_words
+            + self.body_parts
+            + self.severity_indicators
+        )
+        self._build_matrices()
+
+    def _build_matrices(self):
+        """Precompute the sparse matrices used by score_batch"""
+        n_examples = len(self.example_lengths)
+        n_tokens = len(self.postings)
+        n_conditions = len(self.conditions)
+        self.pattern_index = {p: i for i, p in enumerate(self.matcher.patterns)}
+        n_patterns = len(self.pattern_index)
+
+        # Example-term incidence matrix, transposed so D @ example_terms gives overlaps
+        rows = [t for t, posting in enumerate(self.postings) for _ in posting]
+        cols = [e for posting in self.postings for e in posting]
+        self.example_terms = sp.csr_matrix(
+            (np.ones(len(rows), dtype=np.float64), (rows, cols)), shape=(n_tokens, n_examples)
+        )
+        self.example_lengths_arr = np.asarray(self.example_lengths, dtype=np.float64)
+
+        # Feature columns: [patterns | examples | severity bonus | location bonus].
+        # Each text's score for a condition is its feature row times this weight
+        # matrix; SciPy accumulates a row in column order, which is the same
+        # order the single-text loop adds the terms in.
+        self._example_offset = n_patterns
+        self._severity_col = n_patterns + n_examples
+        self._location_col = self._severity_col + 1
+        n_features = self._location_col + 1
+
+        w_rows, w_cols, w_vals = [], [], []
+        for c, condition in enumerate(self.conditions):
+            for keyword in self.condition_keywords[condition]:
+                w_rows.append(self.pattern_index[keyword])
+                w_cols.append(c)
+                w_vals.append(self.KEYWORD_WEIGHT)
+        for e, c in enumerate(self.example_conditions):
+            w_rows.append(self._example_offset + e)
+            w_cols.append(c)
+            w_vals.append(1.0)
+        for c in range(n_conditions):
+            w_rows += [self._severity_col, self._location_col]
+            w_cols += [c, c]
+            w_vals += [1.0, 1.0]
+        # Duplicate keywords in one condition's list must stay separate additions,
+        # so build via CSR directly rather than summing duplicates in COO
+        order = np.lexsort((w_cols, w_rows))
+        indptr = np.zeros(n_features + 1, dtype=np.int64)
+        np.add.at(indptr, np.asarray(w_rows, dtype=np.int64) + 1, 1)
+        self.condition_weights = sp.csr_matrix(
+            (np.asarray(w_vals)[order], np.asarray(w_cols)[order], np.cumsum(indptr)),
+            shape=(n_features, n_conditions),
+        )
+
+        self.severity_step_sums = [sum(self.SEVERITY_STEP for _ in range(k)) for k in range(len(self.severity_words) + 1)]
+
+    def example_overlaps(self, symptoms_text: str) -> Dict[int, int]:
+        """Count shared distinct words between the text and every training example it touches"""
+        overlaps: Dict[int, int] = defaultdict(int)
+        vocabulary, postings = self.vocabulary, self.postings
+        for word in set(symptoms_text.split()):
+            token_id = vocabulary.get(word)
+            if token_id is not None:
+                for example_id in postings[token_id]:
+                    overlaps[example_id] += 1
+        return overlaps
+
+    def score(self, symptoms_text: str) -> Tuple[List[Tuple[str, float]], int]:
+        """Return (condition, score) for every condition with a positive score, plus the
+        number of severity indicators found in the text.
+
+        symptoms_text is expected to be stripped and lower-cased already.
+        """
+        matched = self.matcher.find(symptoms_text)
+
+        # Per-example overlap, grouped by condition in training-data order
+        per_condition: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+        for example_id, common in sorted(self.example_overlaps(symptoms_text).items()):
+            per_condition[self.example_conditions[example_id]].append((example_id, common))
+
+        severity_score = sum(self.SEVERITY_STEP for word in self.severity_words if word in matched)
+        severity_bonus = min(severity_score, self.SEVERITY_CAP)
+        location_bonus = self.LOCATION_BONUS if any(part in matched for part in self.body_parts) else 0
+
+        condition_scores = []
+        for i, condition in enumerate(self.conditions):
+            score = 0
+            for keyword in self.condition_keywords[condition]:
+                if keyword in matched:
+                    score += self.KEYWORD_WEIGHT
+            for example_id, common in per_condition.get(i, ()):
+                score += common / self.example_lengths[example_id] * self.EXAMPLE_WEIGHT
+            score += severity_bonus
+            if location_bonus:
+                score += location_bonus
+            if score > 0:
+                condition_scores.append((condition, min(score, 1.0)))
+
+        severity_hits = sum(1 for word in self.severity_indicators if word in matched)
+        return condition_scores, severity_hits
+
+    def severity_hits(self, symptoms_text: str) -> int:
+        """Number of severity indicators in the text, for engines that score conditions themselves"""
+        matched = self.matcher.find(symptoms_text)
+        return sum(1 for word in self.severity_indicators if word in matched)
+
+    def score_batch(self, texts: Sequence[str]) -> List[Tuple[List[Tuple[str, float]], int]]:
+        """Vectorized score() over many texts; results are identical and in input order"""
+        if not texts:
+            return []
+        n_texts = len(texts)
+        vocabulary = self.vocabulary
+        severity_words, body_parts, severity_indicators = self.severity_words, self.body_parts, self.severity_indicators
+
+        # Sparse document-term matrix and per-text pattern hits
+        doc_rows, doc_cols = [], []
+        feat_rows, feat_cols, feat_vals = [], [], []
+        severity_hits = []
+        for i, text in enumerate(texts):
+            for word in set(text.split()):
+                token_id = vocabulary.get(word)
+                if token_id is not None:
+                    doc_rows.append(i)
+                    doc_cols.append(token_id)
+            matched = self.matcher.find(text)
+            for pattern in matched:
+                feat_rows.append(i)
+                feat_cols.append(self.pattern_index[pattern])
+                feat_vals.append(1.0)
+            bonus = min(self.severity_step_sums[sum(1 for w in severity_words if w in matched)], self.SEVERITY_CAP)
+            if bonus:
+                feat_rows.append(i)
+                feat_cols.append(self._severity_col)
+                feat_vals.append(bonus)
+            if any(part in matched for part in body_parts):
+                feat_rows.append(i)
+                feat_cols.append(self._location_col)
+                feat_vals.append(self.LOCATION_BONUS)
+            severity_hits.append(sum(1 for w in severity_indicators if w in matched))
+
+        documents = sp.csr_matrix(
+            (np.ones(len(doc_rows), dtype=np.float64), (doc_rows, doc_cols)),
+            shape=(n_texts, len(self.postings)),
+        )
+        overlaps = (documents @ self.example_terms).tocoo()
+        example_scores = overlaps.data / self.example_lengths_arr[overlaps.col] * self.EXAMPLE_WEIGHT
+
+        features = sp.csr_matrix(
+            (
+                np.concatenate([np.asarray(feat_vals, dtype=np.float64), example_scores]),
+                (
+                    np.concatenate([np.asarray(feat_rows, dtype=np.int64), overlaps.row.astype(np.int64)]),
+                    np.concatenate([np.asarray(feat_cols, dtype=np.int64), overlaps.col.astype(np.int64) + self._example_offset]),
+                ),
+            ),
+            shape=(n_texts, self.condition_weights.shape[0]),
+        )
+        features.sort_indices()
+        scores = (features @ self.condition_weights).toarray()
+
+        results = []
+        for i in range(n_texts):
+            row = scores[i]
+            condition_scores = [
+                (condition, min(float(row[c]), 1.0))
+                for c, condition in enumerate(self.conditions)
+                if row[c] > 0
+            ]
+            results.append((condition_scores, severity_hits[i]))
+        return results
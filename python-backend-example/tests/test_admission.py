@@ -0,0 +1,169 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from admission import (
+    AdmissionLimiter,
+    AdmissionMiddleware,
+    DeadlineExceeded,
+    Rejected,
+    check_deadline,
+    current_deadline,
+)
+
+
+def test_limiter_admits_queues_and_rejects_when_full():
+    limiter = AdmissionLimiter("test", max_concurrent=1, max_queued=1, queue_timeout=5.0)
+
+    async def main():
+        await limiter.acquire(None)
+        queued = asyncio.ensure_future(limiter.acquire(None))
+        await asyncio.sleep(0)
+        assert limiter.stats()["queued"] == 1
+        with pytest.raises(Rejected) as rejected:
+            await limiter.acquire(None)
+        # The slot passes straight to the queued request
+        limiter.release(2.0)
+        await queued
+        assert limiter.active == 1
+        limiter.release(2.0)
+        return rejected.value
+
+    rejected = asyncio.run(main())
+    assert rejected.status_code == 429
+    assert rejected.reason == "queue_full"
+    assert rejected.retry_after >= 1
+    assert limiter.active == 0
+    assert limiter.rejected["queue_full"] == 1
+
+
+def test_limiter_times_out_queued_requests_with_503():
+    limiter = AdmissionLimiter("test", max_concurrent=1, max_queued=4, queue_timeout=0.02)
+
+    async def main():
+        await limiter.acquire(None)
+        with pytest.raises(Rejected) as timed_out:
+            await limiter.acquire(None)
+        with pytest.raises(Rejected) as expired:
+            await limiter.acquire(time.perf_counter() + 0.01)
+        limiter.release(0.1)
+        return timed_out.value, expired.value
+
+    timed_out, expired = asyncio.run(main())
+    assert (timed_out.status_code, timed_out.reason) == (503, "queue_timeout")
+    assert (expired.status_code, expired.reason) == (503, "deadline")
+    assert limiter.stats()["queued"] == 0
+    assert limiter.active == 0
+
+
+def test_limiter_rejects_requests_already_past_their_deadline():
+    limiter = AdmissionLimiter("test", max_concurrent=4, max_queued=4, queue_timeout=5.0)
+
+    async def main():
+        with pytest.raises(Rejected) as rejected:
+            await limiter.acquire(time.perf_counter() - 1.0)
+        return rejected.value
+
+    assert asyncio.run(main()).status_code == 503
+    assert limiter.active == 0
+
+
+def test_retry_after_grows_with_the_backlog():
+    limiter = AdmissionLimiter("test", max_concurrent=2, max_queued=10, queue_timeout=5.0)
+    limiter.service_time = 3.0
+    assert limiter.retry_after() == 1
+    limiter.active = 2
+    assert limiter.retry_after() == 3
+    limiter.active = 4
+    assert limiter.retry_after() == 6
+
+
+def make_client(limiter, default_timeout=None, hold: float = 0.1):
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(current_deadline())
+        try:
+            check_deadline("handler")
+        except DeadlineExceeded:
+            status = 503
+        else:
+            await asyncio.sleep(hold)
+            status = 200
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    middleware = AdmissionMiddleware(app, [limiter], {"/api/limited": limiter.name}, default_timeout)
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=middleware), base_url="http://test")
+    return client, seen
+
+
+def test_middleware_sheds_with_429_and_retry_after():
+    limiter = AdmissionLimiter("image", max_concurrent=1, max_queued=0, queue_timeout=5.0)
+    client, _ = make_client(limiter)
+
+    async def main():
+        async with client:
+            first = asyncio.ensure_future(client.post("/api/limited"))
+            await asyncio.sleep(0.02)
+            shed = await client.post("/api/limited")
+            unlimited = await client.post("/api/other")
+            return await first, shed, unlimited
+
+    first, shed, unlimited = asyncio.run(main())
+    assert first.status_code == 200
+    assert shed.status_code == 429
+    assert int(shed.headers["retry-after"]) >= 1
+    assert "queue_full" in shed.json()["detail"]
+    assert unlimited.status_code == 200
+    assert limiter.active == 0
+
+
+def test_middleware_times_out_queued_requests_with_503():
+    limiter = AdmissionLimiter("image", max_concurrent=1, max_queued=4, queue_timeout=0.02)
+    client, _ = make_client(limiter, hold=0.2)
+
+    async def main():
+        async with client:
+            first = asyncio.ensure_future(client.post("/api/limited"))
+            await asyncio.sleep(0.02)
+            shed = await client.post("/api/limited")
+            return await first, shed
+
+    first, shed = asyncio.run(main())
+    assert first.status_code == 200
+    assert shed.status_code == 503
+    assert "retry-after" in shed.headers
+
+
+def test_middleware_sets_the_deadline_from_the_header():
+    limiter = AdmissionLimiter("image", max_concurrent=4, max_queued=4, queue_timeout=5.0)
+    client, seen = make_client(limiter, default_timeout=30.0, hold=0)
+
+    async def main():
+        async with client:
+            before = time.perf_counter()
+            await client.post("/api/limited", headers={"X-Request-Timeout-Ms": "2000"})
+            await client.post("/api/limited")
+            await client.post("/api/other")
+            return before
+
+    before = asyncio.run(main())
+    assert before + 1.5 < seen[0] < before + 3.0
+    assert seen[1] > before + 25.0
+    # Unlimited paths run without a deadline
+    assert seen[2] is None
+
+
+def test_middleware_lets_preflights_bypass_admission():
+    limiter = AdmissionLimiter("image", max_concurrent=1, max_queued=0, queue_timeout=5.0)
+    client, _ = make_client(limiter, hold=0)
+
+    async def main():
+        async with client:
+            return await client.options("/api/limited")
+
+    assert asyncio.run(main()).status_code == 200
+    assert limiter.admitted == 0
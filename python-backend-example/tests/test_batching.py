@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import torch
+
+from admission import DeadlineExceeded
+from batching import MicroBatcher
+
+
+class RecordingForward:
+    """forward_fn that doubles its input and records batch sizes and concurrency"""
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.batch_sizes = []
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, batch: torch.Tensor):
+        with self._lock:
+            self.batch_sizes.append(len(batch))
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            if self.delay:
+                time.sleep(self.delay)
+            if self.fail:
+                raise RuntimeError("forward failed")
+            return batch * 2
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def test_concurrent_submits_are_batched_in_order():
+    forward = RecordingForward()
+    batcher = MicroBatcher(forward, max_batch_size=4, max_wait_ms=50)
+
+    async def main():
+        results = await asyncio.gather(*(batcher.submit(torch.tensor([float(i)])) for i in range(10)))
+        await batcher.stop()
+        return results
+
+    results = asyncio.run(main())
+    assert [float(r) for r in results] == [2.0 * i for i in range(10)]
+    assert forward.batch_sizes == [4, 4, 2]
+    assert batcher.items == 10 and batcher.batches == 3
+
+
+def test_submit_many_shares_batches_and_splits_at_max_batch_size():
+    forward = RecordingForward()
+    batcher = MicroBatcher(forward, max_batch_size=3, max_wait_ms=0)
+
+    async def main():
+        futures = batcher.submit_many([torch.tensor([float(i)]) for i in range(7)])
+        results = await asyncio.gather(*futures)
+        await batcher.stop()
+        return results
+
+    results = asyncio.run(main())
+    assert [float(r) for r in results] == [2.0 * i for i in range(7)]
+    assert forward.batch_sizes == [3, 3, 1]
+
+
+def test_lone_item_waits_at_most_max_wait():
+    batcher = MicroBatcher(RecordingForward(), max_batch_size=8, max_wait_ms=20)
+
+    async def main():
+        started = time.perf_counter()
+        result = await batcher.submit(torch.tensor([1.0]))
+        elapsed = time.perf_counter() - started
+        await batcher.stop()
+        return result, elapsed
+
+    result, elapsed = asyncio.run(main())
+    assert float(result) == 2.0
+    assert elapsed < 1.0
+
+
+def test_expired_items_are_failed_without_running():
+    forward = RecordingForward()
+    batcher = MicroBatcher(forward, max_batch_size=4, max_wait_ms=20)
+
+    async def main():
+        [expired] = batcher.submit_many([torch.tensor([1.0])], deadline=time.perf_counter() - 1.0)
+        [live] = batcher.submit_many([torch.tensor([2.0])], deadline=time.perf_counter() + 60.0)
+        with pytest.raises(DeadlineExceeded):
+            await expired
+        result = await live
+        await batcher.stop()
+        return result
+
+    assert float(asyncio.run(main())) == 4.0
+    assert batcher.expired == 1
+    assert forward.batch_sizes == [1]
+
+
+def test_batch_of_only_expired_items_skips_the_forward_pass():
+    forward = RecordingForward()
+    batcher = MicroBatcher(forward, max_batch_size=4, max_wait_ms=0)
+
+    async def main():
+        with pytest.raises(DeadlineExceeded):
+            await batcher.submit(torch.tensor([1.0]), deadline=time.perf_counter() - 1.0)
+        await batcher.stop()
+
+    asyncio.run(main())
+    assert forward.batch_sizes == []
+    assert batcher.batches == 0
+
+
+def test_forward_error_reaches_every_caller_in_the_batch():
+    batcher = MicroBatcher(RecordingForward(fail=True), max_batch_size=4, max_wait_ms=20)
+
+    async def main():
+        results = await asyncio.gather(
+            *(batcher.submit(torch.tensor([float(i)])) for i in range(3)), return_exceptions=True
+        )
+        await batcher.stop()
+        return results
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_cancelled_caller_is_dropped_from_its_batch():
+    forward = RecordingForward()
+    batcher = MicroBatcher(forward, max_batch_size=4, max_wait_ms=50)
+
+    async def main():
+        gone, kept = batcher.submit_many([torch.tensor([1.0]), torch.tensor([2.0])])
+        gone.cancel()
+        result = await kept
+        await batcher.stop()
+        return result
+
+    assert float(asyncio.run(main())) == 4.0
+    assert forward.batch_sizes == [1]
+
+
+def test_runs_up_to_max_concurrent_batches_at_once():
+    forward = RecordingForward(delay=0.1)
+    executor = ThreadPoolExecutor(3)
+    batcher = MicroBatcher(forward, max_batch_size=2, max_wait_ms=0, executor=executor, max_concurrent=3)
+
+    async def main():
+        results = await asyncio.gather(*(batcher.submit(torch.tensor([float(i)])) for i in range(12)))
+        await batcher.stop()
+        return results
+
+    try:
+        results = asyncio.run(main())
+    finally:
+        executor.shutdown()
+    assert [float(r) for r in results] == [2.0 * i for i in range(12)]
+    assert forward.peak == 3
@@ -0,0 +1,185 @@
+import asyncio
+
+import pytest
+
+from jobs import DONE, FAILED, PRIORITIES, QUEUED, RUNNING, JobQueue, QueueFull, SQLiteJobStore
+
+
+class AnalysisError(Exception):
+    status_code = 422
+
+
+async def wait_for_status(queue: JobQueue, job_id: str, status: str, timeout: float = 5.0):
+    async def poll():
+        while (await queue.get(job_id)).status != status:
+            await asyncio.sleep(0.005)
+    await asyncio.wait_for(poll(), timeout)
+    return await queue.get(job_id)
+
+
+def test_job_runs_to_done_with_its_result():
+    async def process(payload: bytes):
+        await asyncio.sleep(0.01)
+        return {"size": len(payload)}
+
+    queue = JobQueue(process, workers=1)
+
+    async def main():
+        job = await queue.submit(b"abcd")
+        assert job.status == QUEUED
+        done = await wait_for_status(queue, job.id, DONE)
+        await queue.stop()
+        return done
+
+    job = asyncio.run(main())
+    view = job.view()
+    assert view["status"] == DONE
+    assert view["result"] == {"size": 4}
+    assert view["priority"] == "normal"
+    assert view["submittedAt"] <= view["startedAt"] <= view["finishedAt"]
+    # The payload is dropped once the job has finished
+    assert job.payload is None
+    assert queue.stats()["completed"] == 1
+
+
+def test_failed_job_keeps_the_error_and_status():
+    async def process(payload: bytes):
+        raise AnalysisError("Invalid image file")
+
+    queue = JobQueue(process, workers=1)
+
+    async def main():
+        job = await queue.submit(b"not an image")
+        failed = await wait_for_status(queue, job.id, FAILED)
+        await queue.stop()
+        return failed
+
+    view = asyncio.run(main()).view()
+    assert view["error"] == {"message": "Invalid image file", "status": 422}
+    assert "result" not in view
+    assert queue.stats()["failed"] == 1
+
+
+def test_higher_priority_jobs_run_first():
+    order = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def process(payload: bytes):
+            if payload == b"blocker":
+                await release.wait()
+            order.append(payload)
+            return None
+
+        queue = JobQueue(process, workers=1)
+        blocker = await queue.submit(b"blocker")
+        await wait_for_status(queue, blocker.id, RUNNING)
+        low = await queue.submit(b"low", PRIORITIES["low"])
+        await queue.submit(b"normal", PRIORITIES["normal"])
+        await queue.submit(b"high", PRIORITIES["high"])
+        release.set()
+        await wait_for_status(queue, low.id, DONE)
+        await queue.stop()
+
+    asyncio.run(main())
+    assert order == [b"blocker", b"high", b"normal", b"low"]
+
+
+def test_full_queue_rejects_with_retry_after():
+    async def main():
+        release = asyncio.Event()
+
+        async def process(payload: bytes):
+            await release.wait()
+
+        queue = JobQueue(process, workers=1, max_queued=2)
+        running = await queue.submit(b"0")
+        await wait_for_status(queue, running.id, RUNNING)
+        await queue.submit(b"1")
+        await queue.submit(b"2")
+        with pytest.raises(QueueFull) as full:
+            await queue.submit(b"3")
+        release.set()
+        await queue.stop()
+        return queue, full.value
+
+    queue, full = asyncio.run(main())
+    assert full.retry_after >= 1
+    assert queue.stats()["rejected"] == 1
+
+
+def test_updates_follow_the_job_until_it_finishes():
+    async def main():
+        release = asyncio.Event()
+
+        async def process(payload: bytes):
+            await release.wait()
+            return "ok"
+
+        queue = JobQueue(process, workers=1)
+        job = await queue.submit(b"x")
+        statuses = []
+        async for view in queue.updates(job.id, heartbeat=0.05):
+            if view is None:
+                # Heartbeat while the job runs; let it finish
+                release.set()
+                continue
+            statuses.append(view["status"])
+        await queue.stop()
+        return statuses
+
+    assert asyncio.run(main()) == [QUEUED, RUNNING, DONE]
+
+
+def test_finished_jobs_expire_after_the_ttl():
+    async def process(payload: bytes):
+        return "ok"
+
+    queue = JobQueue(process, workers=1, result_ttl=0.0)
+
+    async def main():
+        job = await queue.submit(b"x")
+        await wait_for_status(queue, job.id, DONE)
+        queue._last_purge = 0.0
+        gone = await queue.get(job.id)
+        await queue.stop()
+        return gone
+
+    assert asyncio.run(main()) is None
+
+
+def test_store_shares_jobs_and_resumes_unfinished_ones(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+
+    async def main():
+        started = asyncio.Event()
+
+        async def stuck(payload: bytes):
+            started.set()
+            await asyncio.Event().wait()
+
+        first = JobQueue(stuck, workers=1, store=SQLiteJobStore(path))
+        job = await first.submit(b"payload")
+        await started.wait()
+        # The process running the job goes away mid-job
+        await first.stop()
+
+        async def process(payload: bytes):
+            return {"payload": payload.decode()}
+
+        # A fresh queue on the same database picks the job back up, and any
+        # other queue on it can poll the result
+        second = JobQueue(process, workers=1, store=SQLiteJobStore(path))
+        await second._ensure_started()
+        done = await wait_for_status(second, job.id, DONE)
+        other = JobQueue(process, workers=1, store=SQLiteJobStore(path))
+        # The result is written through just after the status changes
+        fetched = await wait_for_status(other, job.id, DONE)
+        await second.stop()
+        return done, fetched
+
+    done, fetched = asyncio.run(main())
+    assert done.view()["result"] == {"payload": "payload"}
+    assert fetched.status == DONE
+    assert fetched.view()["result"] == {"payload": "payload"}
@@ -0,0 +1,181 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from admission import DeadlineExceeded
+from result_cache import ResultCache, content_key
+
+
+def test_content_key_separates_parts():
+    assert content_key("ab", "c") != content_key("a", "bc")
+    assert content_key(b"image", "en") == content_key("image", "en")
+
+
+def test_get_or_compute_coalesces_concurrent_callers():
+    cache = ResultCache("test")
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return {"answer": 42}
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert results == [{"answer": 42}] * 5
+    assert calls == 1
+    assert cache.coalesced == 4
+    assert cache.stats()["inflight"] == 0
+
+    # Later callers are served from memory
+    assert asyncio.run(cache.get_or_compute("k", compute)) == {"answer": 42}
+    assert calls == 1
+
+
+def test_compute_error_reaches_coalesced_callers_and_is_not_cached():
+    cache = ResultCache("test")
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        raise ValueError("bad image")
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_compute("k", failing) for _ in range(3)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert calls == 1
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["inflight"] == 0
+
+    async def ok():
+        return "fine"
+
+    # The failure is not remembered
+    assert asyncio.run(cache.get_or_compute("k", ok)) == "fine"
+
+
+def test_first_callers_deadline_does_not_fail_the_others():
+    cache = ResultCache("test")
+    calls = 0
+
+    async def compute(deadline_passes: bool):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        if deadline_passes:
+            raise DeadlineExceeded("Request deadline passed before inference")
+        return "result"
+
+    async def main():
+        first = asyncio.ensure_future(cache.get_or_compute("k", lambda: compute(True)))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_compute("k", lambda: compute(False)))
+        return await asyncio.gather(first, second, return_exceptions=True)
+
+    first, second = asyncio.run(main())
+    assert isinstance(first, DeadlineExceeded)
+    assert second == "result"
+    assert calls == 2
+
+
+def test_cancelled_first_caller_does_not_cancel_the_others():
+    cache = ResultCache("test")
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        first = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "result"
+
+
+def test_cancelled_waiter_leaves_the_computation_running():
+    cache = ResultCache("test")
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        first = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0.01)
+        second.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        return await first
+
+    assert asyncio.run(main()) == "result"
+
+
+def test_lru_eviction_and_ttl_expiry():
+    cache = ResultCache("test", max_entries=2, ttl_seconds=60)
+
+    async def main():
+        cache.put("a", 1)
+        cache.put("b", 2)
+        await cache.get("a")
+        cache.put("c", 3)
+        return await cache.get_many(["a", "b", "c"])
+
+    assert asyncio.run(main()) == [1, None, 3]
+    assert cache.evictions == 1
+
+    expiring = ResultCache("test", ttl_seconds=0.01)
+    expiring.put("a", 1)
+    time.sleep(0.02)
+    assert asyncio.run(expiring.get("a")) is None
+    assert expiring.expirations == 1
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    executor = ThreadPoolExecutor(2)
+    cache = ResultCache("test", disk_dir=str(tmp_path), executor=executor)
+
+    async def main():
+        cache.put("json", {"possibleConditions": [], "severity": 3})
+        cache.put("raw", b'{"diagnosis":"Acne"}')
+
+    asyncio.run(main())
+    executor.shutdown(wait=True)
+    assert cache.stats()["disk_writes_pending"] == 0
+
+    executor = ThreadPoolExecutor(2)
+    restarted = ResultCache("test", disk_dir=str(tmp_path), executor=executor)
+    try:
+        values = asyncio.run(restarted.get_many(["json", "raw", "missing"]))
+    finally:
+        executor.shutdown()
+    assert values == [{"possibleConditions": [], "severity": 3}, b'{"diagnosis":"Acne"}', None]
+    assert restarted.disk_hits == 2 and restarted.misses == 1
+    # Disk hits are promoted into memory
+    assert restarted.stats()["entries"] == 2
+
+
+def test_disk_writes_are_skipped_past_the_pending_limit(tmp_path):
+    cache = ResultCache("test", disk_dir=str(tmp_path), max_pending_writes=0)
+    cache.put("a", 1)
+    assert cache.disk_writes_skipped == 1
+    assert not any(tmp_path.rglob("*.json"))
+    # Still served from memory
+    assert asyncio.run(cache.get("a")) == 1
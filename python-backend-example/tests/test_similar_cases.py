@@ -0,0 +1,56 @@
+import multiprocessing
+
+from similar_cases import SimilarCaseIndex
+
+CASES = [
+    ("itchy red rash on both arms", "Eczema"),
+    ("dark mole that keeps changing shape", "Melanoma"),
+    ("painful blisters in a band on the chest", "Shingles"),
+    ("hives and welts after eating shrimp", "Urticaria"),
+]
+
+
+def test_appends_from_stale_instances_keep_every_case(tmp_path):
+    indexes = [SimilarCaseIndex.open(str(tmp_path)) for _ in CASES]
+    for i, (index, (text, condition)) in enumerate(zip(indexes, CASES)):
+        index.append([text], [condition], [f"case-{i}"])
+
+    reopened = SimilarCaseIndex.open(str(tmp_path))
+    assert len(reopened) == len(CASES)
+    for i, (text, condition) in enumerate(CASES):
+        [(case_id, found_condition, _)] = reopened.search(text, 1)
+        assert (case_id, found_condition) == (f"case-{i}", condition)
+
+
+def test_compaction_after_appends_elsewhere(tmp_path):
+    first = SimilarCaseIndex.open(str(tmp_path))
+    first.append([CASES[0][0]], [CASES[0][1]])
+    second = SimilarCaseIndex.open(str(tmp_path))
+    second.append([CASES[1][0]], [CASES[1][1]])
+    # first has not seen second's segment yet
+    assert first.compact()
+    assert len(first.segments) == 1 and len(first) == 2
+    second.append([CASES[2][0]], [CASES[2][1]])
+    assert len(SimilarCaseIndex.open(str(tmp_path))) == 3
+
+
+def _append_many(path: str, worker: int, count: int):
+    index = SimilarCaseIndex.open(path, max_segments=4)
+    for i in range(count):
+        text, condition = CASES[i % len(CASES)]
+        index.append([text], [condition], [f"w{worker}-{i}"])
+
+
+def test_concurrent_appends_from_processes(tmp_path):
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_append_many, args=(str(tmp_path), w, 10)) for w in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    index = SimilarCaseIndex.open(str(tmp_path))
+    assert len(index) == 30
+    ids = {case_id for _, segment in index.segments for case_id in (bytes(c).decode() for c in segment.case_ids)}
+    assert ids == {f"w{w}-{i}" for w in range(3) for i in range(10)}
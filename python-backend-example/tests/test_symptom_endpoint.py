@@ -0,0 +1,52 @@
+import asyncio
+import importlib
+
+import httpx
+import pytest
+
+
+@pytest.fixture(scope="module")
+def main():
+    # Configuration is read at import; keep it offline and free of shared state
+    with pytest.MonkeyPatch.context() as env:
+        env.setenv("MODEL_BUNDLE_DIR", "/nonexistent")
+        env.setenv("MODEL_LOADING", "lazy")
+        env.setenv("LOG_LEVEL", "WARNING")
+        for name in ("RESULT_CACHE_DIR", "SIMILAR_CASES_INDEX", "IMAGE_EMBEDDING_STORE", "IMAGE_JOB_DB",
+                     "PROFILE_DIR"):
+            env.delenv(name, raising=False)
+        yield importlib.import_module("main")
+
+
+def post_all(main, bodies):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(client.post("/api/analyze-symptoms", json=body) for body in bodies))
+    return asyncio.run(run())
+
+
+def test_concurrent_identical_reports_are_scored_once(main, monkeypatch):
+    compute = main.compute_symptom_analysis
+    calls = []
+
+    async def counted(symptoms_text, engine_name, kb):
+        calls.append(symptoms_text)
+        # Keep the computation in flight while the other requests arrive
+        await asyncio.sleep(0.05)
+        return await compute(symptoms_text, engine_name, kb)
+
+    monkeypatch.setattr(main, "compute_symptom_analysis", counted)
+    main.symptom_cache.clear()
+    body = {"symptoms": "Itchy red rash spreading on my arms for a week", "medicalSystem": "Allopathy"}
+    other = {"symptoms": "dark mole that keeps changing shape", "medicalSystem": "Allopathy"}
+
+    responses = post_all(main, [body] * 5 + [other])
+    assert [r.status_code for r in responses] == [200] * 6
+    assert len({r.content for r in responses[:5]}) == 1
+    assert responses[0].json()["possibleConditions"]
+    assert sorted(calls) == sorted([body["symptoms"].lower(), other["symptoms"]])
+
+    # Repeats are served from the cache
+    post_all(main, [body])
+    assert len(calls) == 2
@@ -0,0 +1,113 @@
+import json
+import os
+
+import pytest
+
+from knowledge_base import load_training_data
+from symptom_scoring import PatternMatcher, SymptomScorer
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Scoring inputs as the original /api/analyze-symptoms handler had them
+CONDITION_KEYWORDS = {
+    "Acne": ["pimples", "inflammation", "red", "oily", "spots", "breakout"],
+    "Eczema": ["dry", "itchy", "patches", "inflammation", "chronic", "red", "stress"],
+    "Psoriasis": ["red", "scaly", "patches", "autoimmune", "thick", "chronic"],
+    "Contact Dermatitis": ["inflammation", "irritants", "allergic", "triggers", "burning", "rash"],
+    "Fungal Infection": ["infection", "fungal", "itchy", "spreading", "rash"],
+    "Rosacea": ["facial", "redness", "bumps", "flushing", "chronic"],
+    "Melanoma": ["cancer", "skin cancer", "serious", "dark", "changing", "mole"],
+    "Basal Cell Carcinoma": ["cancer", "growth", "lesion", "skin cancer"],
+    "Urticaria": ["hives", "allergic", "itchy", "welts", "swelling"],
+    "Vitiligo": ["pigmentation", "white patches", "loss of color", "skin color"],
+    "Impetigo": ["bacterial", "infection", "sores", "crusting", "contagious"],
+    "Shingles": ["painful", "blisters", "rash", "burning", "nerve pain"],
+    "Cellulitis": ["bacterial", "infection", "red", "swollen", "warm", "tender"],
+    "Scabies": ["itchy", "rash", "burrows", "intense itching", "night", "parasites"],
+    "Warts": ["growth", "viral", "rough", "bump", "raised"]
+}
+SEVERITY_WORDS = ["severe", "intense", "extreme", "very", "lot", "constant", "chronic", "unbearable"]
+BODY_PARTS = ["face", "arms", "legs", "back", "chest", "neck", "hands", "feet", "scalp"]
+SEVERITY_INDICATORS = ["severe", "intense", "extreme", "unbearable", "pain", "bleeding", "infection"]
+
+TEXTS = [
+    "red pimples and inflammation on face, oily skin with breakouts",
+    "dry itchy skin with red patches that gets worse with stress",
+    "thick red patches with silvery scales on elbows and knees, very itchy",
+    "intense itching at night between fingers, rash spreading to arms",
+    "a dark mole that keeps changing shape, worried about skin cancer",
+    "white patches and loss of color on hands and feet",
+    "painful blisters in a band on one side of the chest with nerve pain",
+    "swollen warm tender red skin on legs after a cut, fever and infection",
+    "severe unbearable extreme constant pain and bleeding on my scalp",
+    "hives and welts all over after eating shrimp, lot of swelling",
+    "rough raised bump on my thumb that will not go away",
+    "nothing in particular happening here at all",
+    "red red red red red red",
+    "ITCHY rash, itchy rash; itchy-rash",
+    "burning and itching after new soap contact with allergen",
+]
+
+
+def baseline_score(symptoms_text, conditions, training_data):
+    """The original per-request loop, kept verbatim as the reference"""
+    condition_scores = []
+    for condition in conditions:
+        score = 0
+        for keyword in CONDITION_KEYWORDS.get(condition, []):
+            if keyword in symptoms_text:
+                score += 0.3
+        condition_examples = [example for example, label in training_data if label == condition]
+        for example in condition_examples:
+            example_words = set(example.lower().split())
+            symptom_words = set(symptoms_text.split())
+            common_words = example_words.intersection(symptom_words)
+            if len(common_words) > 0:
+                score += len(common_words) / len(example_words) * 0.4
+        severity_score = sum(0.1 for word in SEVERITY_WORDS if word in symptoms_text)
+        score += min(severity_score, 0.3)
+        if sum(1 for part in BODY_PARTS if part in symptoms_text) > 0:
+            score += 0.1
+        if score > 0:
+            condition_scores.append((condition, min(score, 1.0)))
+    severity_hits = sum(word in symptoms_text for word in SEVERITY_INDICATORS)
+    return condition_scores, severity_hits
+
+
+@pytest.fixture(scope="module")
+def knowledge():
+    with open(os.path.join(HERE, "medical_conditions.json"), encoding="utf-8") as f:
+        conditions = json.load(f)["skin_conditions"]
+    training_data = load_training_data(os.path.join(HERE, "symptom_training_data.json"))
+    scorer = SymptomScorer(conditions, CONDITION_KEYWORDS, training_data,
+                           SEVERITY_WORDS, BODY_PARTS, SEVERITY_INDICATORS)
+    return scorer, conditions, training_data
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_score_matches_baseline(knowledge, text):
+    scorer, conditions, training_data = knowledge
+    text = text.strip().lower()
+    # Exact float equality: the response's probability is int(score * 100)
+    assert scorer.score(text) == baseline_score(text, conditions, training_data)
+
+
+def test_score_batch_matches_single(knowledge):
+    scorer, conditions, training_data = knowledge
+    texts = [text.strip().lower() for text in TEXTS]
+    batch = scorer.score_batch(texts)
+    assert batch == [scorer.score(text) for text in texts]
+    assert batch == [baseline_score(text, conditions, training_data) for text in texts]
+
+
+def test_score_batch_empty_and_duplicates(knowledge):
+    scorer, _, _ = knowledge
+    assert scorer.score_batch([]) == []
+    text = TEXTS[0].lower()
+    assert scorer.score_batch([text, text, "short"]) == [scorer.score(text), scorer.score(text), scorer.score("short")]
+
+
+def test_pattern_matcher_finds_overlapping_substrings():
+    matcher = PatternMatcher(["skin cancer", "cancer", "can", "red", "redness", ""])
+    assert matcher.find("signs of skin cancer and redness") == {"skin cancer", "cancer", "can", "red", "redness"}
+    assert matcher.find("nothing") == set()
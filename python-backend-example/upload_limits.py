@@ -0,0 +1,87 @@
+# upload_limits.py
+# Byte limits for uploads, enforced while the request body streams in.
+#
+# Starlette parses multipart bodies into spooled files before the endpoint
+# runs, so a check inside the handler is too late to protect memory. This ASGI
+# middleware rejects oversized requests from Content-Length up front, and
+# counts bytes as they arrive for chunked uploads, answering 413 as soon as
+# the limit is crossed.
+import json
+from typing import Iterable
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadLimitMiddleware:
+    def __init__(self, app, max_bytes: int, paths: Iterable[str]):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = set(paths)
+
+    async def _reject(self, send):
+        body = json.dumps({
+            "detail": f"Upload exceeds the {self.max_bytes} byte limit"
+        }).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    if int(value) > self.max_bytes:
+                        await self._reject(send)
+                        return
+                except ValueError:
+                    pass
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    # Looks like a disconnect to the app, which stops reading
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded:
+            await self._reject(send)
+
+
+async def read_upload(file, max_bytes: int, chunk_size: int = 1 << 16) -> bytes:
+    """Read an UploadFile in chunks, stopping as soon as it exceeds max_bytes"""
+    chunks = []
+    total = 0
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds the {max_bytes} byte limit")
+        chunks.append(chunk)
+    return b"".join(chunks)